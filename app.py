@@ -1,10 +1,14 @@
 from apscheduler.triggers.cron import CronTrigger
-from plombery import Trigger, register_pipeline, get_app
+from plombery import Trigger, get_app
 
 from src.check_config import check_config_job
-from src.check_xxljob_config import check_xxl_job
-from src.fetch_account_data import fetch_account_data_job
+from src.check_xxljob_config import check_xxl_job, watch_xxl_job
+from src.fetch_account_data import fetch_account_data_job, fetch_account_quick_job, watch_account_anomaly_job
 from src.fetch_plan_data import fetch_plan_data_job
+from src.monitor_progress import monitor_progress_job
+from src.sms.sms_client import get_sms_client
+# 带资源准入的 register_pipeline：定时触发按 admission.jitter 配置加随机延迟
+from src.utils.admission import register_pipeline
 
 app = get_app()
 register_pipeline(
@@ -38,6 +42,21 @@ register_pipeline(
         ),
     ],
 )
+register_pipeline(
+    id="watch_XXL_JOB",
+    description="远传出账定时任务配置变更轮询",
+    tasks = [
+             watch_xxl_job
+    ],
+    triggers = [
+        Trigger(
+            id="polling",
+            name="每10分钟",
+            description="与上一次快照比较，只校验配置发生变化的任务",
+            schedule=CronTrigger.from_crontab("*/10 * * * *",timezone='Asia/Shanghai'),
+        ),
+    ],
+)
 register_pipeline(
     id="fetch_account",
     description="月初统计远传数据",
@@ -51,6 +70,39 @@ register_pipeline(
         ),
     ],
 )
+register_pipeline(
+    id="fetch_account_quick",
+    description="远传出账看板快速查看（近似统计，不发送短信）",
+    tasks = [fetch_account_quick_job],
+    # 不配置定时触发，需要时手动运行
+    triggers = [],
+)
+register_pipeline(
+    id="watch_account",
+    description="远传出账指标异常检测",
+    tasks = [watch_account_anomaly_job],
+    triggers = [
+        Trigger(
+            id="hourly",
+            name="1-10号每小时",
+            description="只在出现异常分公司时发送短信",
+            schedule=CronTrigger.from_crontab("0 8-20 1-10 * *",timezone='Asia/Shanghai'),
+        ),
+    ],
+)
+register_pipeline(
+    id="monitor_progress",
+    description="出账日远传出账实时进度（增量统计）",
+    tasks = [monitor_progress_job],
+    triggers = [
+        Trigger(
+            id="every_5_minutes",
+            name="1-10号每5分钟",
+            description="按 mr_input_time 高水位增量统计，定期全量核对",
+            schedule=CronTrigger.from_crontab("*/5 7-22 1-10 * *",timezone='Asia/Shanghai'),
+        ),
+    ],
+)
 register_pipeline(
     id="fetch",
     description="月初统计查表计划数据",
@@ -65,6 +117,9 @@ register_pipeline(
     ],
 )
 
+# 补发上次进程退出前未送达的短信；没有遗留短信时不启动投递线程
+get_sms_client().resume_pending()
+
 if __name__ == "__main__":
    import uvicorn
    uvicorn.run("plombery:get_app", reload=True, factory=True)
@@ -1,18 +1,15 @@
 from datetime import datetime, timedelta # 导入了 datetime 类
-from dateutil.relativedelta import relativedelta
 import logging
 
 from plombery import task, get_logger
 
 from src.utils import logger
 from src.rules.CompanyEnum import CompanyNameEnum
-from src.sms.sms_client import SMSClient
-from src.utils import ConfigLoader, dbutils
+from src.sms.sms_client import get_sms_client
+from src.utils import ConfigLoader, db_metrics, dbutils
 
-config = ConfigLoader.ConfigLoader()
-sms_client = SMSClient(base_url=config.get_sms_api())
+config = ConfigLoader.get_config()
 job_name = "check_config_job"
-job_config = config.get_config_by_job(job_name)
 logger = logging.getLogger(__name__)
 
 
@@ -47,7 +44,7 @@ def check_system_parameter() -> bool:
     只有当 0125='2' 且 0126='3' 且 param_state='Y' 时才返回 True。
     """
     # 假设 dbutils 和 config 已经在作用域内
-    db = dbutils.DBUtils(config=config.get_database('ds_common'))
+    db = dbutils.DBUtils(config=config.get_database('ds_common'), company='ds_common')
     sql = '''
           SELECT param_code, param_state, param_value
           FROM water_revenue.sys_param
@@ -111,7 +108,9 @@ def check_work_day_jq():
     3. 如果日期不是 02-06，则 is_make_day 必须是 'N'。
     """
 
-    db = dbutils.DBUtils(config=config.get_database('ds_common'))
+    from dateutil.relativedelta import relativedelta
+
+    db = dbutils.DBUtils(config=config.get_database('ds_common'), company='ds_common')
 
     # --- 日期计算逻辑 (保留) ---
     now = datetime.now()
@@ -133,7 +132,7 @@ def check_work_day_jq():
         res = db.query(sql,params=None)
 
         if not res:
-            logger.warning(f"查询月份 {query_prefix} 结果集为空，跳过检查。")
+            logger.warning("查询月份 %s 结果集为空，跳过检查。", query_prefix)
             return True  # 保持您的逻辑：查询为空返回 True
 
         for item in res:
@@ -145,27 +144,27 @@ def check_work_day_jq():
 
             # --- 约束 1: cal_day 的日期部分必须等于 work_day_seq ---
             if cal_day_date_str != work_day_seq or is_work_day != '0':
-                logger.error(f"约束1失败: 日期 '{cal_day_date_str}' 不等于 work_day_seq '{work_day_seq}'")
+                logger.error("约束1失败: 日期 '%s' 不等于 work_day_seq '%s'", cal_day_date_str, work_day_seq)
                 return False
 
             # --- 约束 2 & 3: 检查 is_make_day 的逻辑 ---
             if cal_day_date_str in MAKE_DAY_DATES:
                 # 逻辑：日期是 02-06，要求 is_make_day 必须是 'Y'
                 if is_make_day != 'Y':
-                    logger.error(f"约束2失败: 日期 '{cal_day_date_str}' 要求 is_make_day 为 'Y'，实际为 '{is_make_day}'")
+                    logger.error("约束2失败: 日期 '%s' 要求 is_make_day 为 'Y'，实际为 '%s'", cal_day_date_str, is_make_day)
                     return False
             else:
                 # 逻辑：日期不是 02-06 (即其他所有日期)，要求 is_make_day 必须是 'N'
                 if is_make_day != 'N':
-                    logger.error(f"约束3失败: 日期 '{cal_day_date_str}' 要求 is_make_day 为 'N'，实际为 '{is_make_day}'")
+                    logger.error("约束3失败: 日期 '%s' 要求 is_make_day 为 'N'，实际为 '%s'", cal_day_date_str, is_make_day)
                     return False
 
         # 如果所有项都通过了循环中的检查
-        logger.info(f"成功通过日历配置检查：月份 {query_prefix} 的所有记录都满足约束。")
+        logger.info("成功通过日历配置检查：月份 %s 的所有记录都满足约束。", query_prefix)
         return True
 
     except Exception as e:
-        logger.error(f"检查日历配置时发生异常: {e}", exc_info=True)
+        logger.error("检查日历配置时发生异常: %s", e, exc_info=True)
         return False
 
     finally:
@@ -175,23 +174,28 @@ def check_fee_price():
     """检查全量水价"""
     pass
 @task
+@config.run_snapshot()
 def check_config_job():
     logger = get_logger()
+    job_config = config.get_config_by_job(job_name)
     message = '\n当月远传配置情况\n'
-    if check_system_parameter():
+    with db_metrics.run_stats("check_config", logger):
+        system_parameter_ok = check_system_parameter()
+        work_day_ok = check_work_day_jq()
+    if system_parameter_ok:
         message += '【系统参数0125/0126】远传出账取数时间范围正确√'+'\n'
         logger.info('远传出账取数时间范围正确√')
     else :
         message += '【系统参数0125/0126】远传出账取数时间范围，需要调整'+'\n'
         logger.error('远传出账取数时间范围，需要调整')
-    if check_work_day_jq():
+    if work_day_ok:
         message +='【计划管理】工作日与户表开账日配置正确√'+'\n'
         logger.info('工作日与户表开账日配置正确√')
     else :
         message += '【计划管理】工作日与户表开账日配置错误，需要调整' + '\n'
         logger.error('工作日与户表开账日配置错误，需要调整')
     # 组装成短信，并发送
-    sms_client.send_sms(phones=job_config['phones'],content=message,logger=logger)
+    get_sms_client().enqueue(phones=job_config['phones'],content=message,logger=logger)
 
 if __name__ == '__main__':
     check_config_job()
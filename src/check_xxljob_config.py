@@ -1,350 +1,213 @@
 import logging
 from logging import getLogger
 
-import requests
-import json
-
 from plombery import task,get_logger
 
-from src.fetch_account_data import sms_client
-from src.sms.sms_client import SMSClient
-from src.utils import ConfigLoader
+from src.sms.sms_client import get_sms_client
+from src.utils import ConfigLoader, xxljob_snapshot
+from src.utils.xxljob_client import XxlJobError, XxlJobLoginError, get_xxljob_client
 
-config = ConfigLoader.ConfigLoader()
-LOGIN_URL = config.get('XXL_LOGIN_URL')
-PAGE_URL = config.get('XXL_PAGE_URL')
+config = ConfigLoader.get_config()
 
-sms_client = SMSClient(base_url=config.get_sms_api())
 logger = logging.getLogger(__name__)
 
-def get_xxl_session(url, login_data):
-    """
-    使用requests.Session来自动管理Cookie。
-    登录成功后，返回这个session对象。
-    """
-    logger.info("正在尝试登录 XXL-Job...")
-    session = requests.Session()
-    try:
-        response = session.post(url, data=login_data, timeout=10)
-        response.raise_for_status()
-        if response.json().get('code') == 200:
-            logger.info("登录成功！")
-            return session
-        else:
-            logger.error(f"登录失败: {response.json().get('msg', '未知错误')}")
-            return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"登录请求失败: {e}")
-        return None
+job_name = "check_job_configs"
+
 
+def get_job_config():
+    """巡检配置：执行器查询条件和期望的任务配置(jobs.check_job_configs.groups)"""
+    return config.get_config_by_job(job_name)
 
-def get_xxl_page(session, url, page_payload):
+
+def get_snapshot_store(job_config):
+    path = job_config.get("snapshot_path")
+    return xxljob_snapshot.get_store(config.root_dir / path if path else None)
+
+
+def fetch_job_groups(groups: dict, logger) -> dict:
     """
-    使用上一步获取的session对象来调用pagelist接口，获取定时任务数据。
+    登录一次后并发拉取所有执行器的全部分页，返回 {名称: 任务列表}，获取任务列表失败的执行器为 None；
+    登录失败（包括会话失效后重新登录失败）时抛出 XxlJobLoginError，由调用方单独提示
     """
-    if not session:
-        return None
-    logger.info("正在获取任务列表...")
+    client = get_xxljob_client(config)
+    filters = {name: group["filters"] for name, group in groups.items()}
     try:
-        response = session.post(url, data=page_payload, timeout=10)
-        response.raise_for_status()
-        page_data = response.json()
-        logger.info(f"成功获取到 {len(page_data.get('data', []))} 条任务数据。")
-        return page_data
-    except requests.exceptions.RequestException as e:
-        logger.error(f"获取任务列表失败: {e}")
-        return None
-    except json.JSONDecodeError:
-        logger.error("解析任务列表响应失败，返回的不是有效的JSON格式。")
-        return None
-
-
-def check_job_configs_dlb(logger) -> str:
-    """
-    检查大路表远传表出账定时任务参数
-    """
+        results = client.fetch_groups(filters)
+    except XxlJobLoginError as e:
+        logger.error("XXL-Job 登录失败: %s", e)
+        raise
+    for jobs in results.values():
+        if isinstance(jobs, XxlJobLoginError):
+            raise jobs
+    return {name: (None if isinstance(jobs, XxlJobError) else jobs) for name, jobs in results.items()}
 
-    logger.info("=      开始执行 XXL-Job 配置巡检任务      =")
-    # --- 1. 定义所有需要校验的任务配置 ---
-    jobs_to_check = [
-        {
-            "job_id": 1079,
-            "job_desc": "清北大路表远传表出账",  # 描述，用于日志输出
-            "expected_cron": "0 0 7 1-5 * ?",
-            "expected_param": '{"2":["02150201","02150205"]}',
-            "company":['ds_qb']
-        },
-        {
-            "job_id": 1078,
-            "job_desc": "怀柔、檀州大路表远传表出账",
-            "expected_cron": "0 0 7 1 * ?",
-            "expected_param": '{0:["02180201","02170201"]}'
-            ,
-            "company": ['ds_hr','ds_jy']
-        },
-        {
-            "job_id": 1074,
-            "job_desc": "通州大路表远传表出账",
-            "expected_cron": "0 0 7 * * ?",
-            "expected_param": '{"1":["02130201"]}'
-            ,
-            "company": ['ds_tz']
-        },
-        {
-            "job_id": 1073,
-            "job_desc": "良泉大路表远传表出账",
-            "expected_cron": "0 0 7 1-16 * ?",
-            "expected_param": '{"2":["02110201","02110202","02110203","02110204","02110205","02110207","02110208","02110209"]}',
-            "company":['ds_lq']
-
-        },
-        {
-            "job_id": 1071,
-            "job_desc": "门头沟、缙阳大路表远传表出账",
-            "expected_cron": "0 0 7 * * ?",
-            "expected_param": '{"0":["02160201"],"1":["02190202","02190201"]}',
-            "company":['ds_mtg','ds_jy']
-        },
-        {
-            "job_id": 1070,
-            "job_desc": "大兴大路表远传表出账",
-            "expected_cron": "0 0 7 1-8 * ?",
-            "expected_param": '{"1":["02120201"],"2":["02120202"]}',
-            "company":['ds_dx']
-        },
-        {
-            "job_id": 1069,
-            "job_desc": "石景山大路表远传表出账",
-            "expected_cron": "0 0 7 1-3 * ?",
-            "expected_param": '{"0":["02200201"],"1":["02200207"],"2":["02200208"]}',
-            "company":['ds_sjs']
-        }
-    ]
-
-    # --- 2. 登录和查询的公共配置 ---
-    login_payload = {'userName': 'admin', 'password': '123456'}
-    page_payload = {
-        'jobGroup': 38,  # 任务所在的执行器ID
-        'triggerStatus': -1,
-        'start': 0,
-        'length': 200
-    }
-
-    message = '[大路表远传出账定时任务检查]\n'
-    session = get_xxl_session(LOGIN_URL, login_payload)
-    if not session:
-        logger.error("\n巡检任务因登录失败而中止。")
-        message += "xxljob登录失败，无法检查"
-        return message
 
-    page_data = get_xxl_page(session, PAGE_URL, page_payload)
-    if not page_data or 'data' not in page_data:
-        logger.error("\n巡检任务因获取任务列表失败而中止。")
-        message += "获取任务列表失败而中止。"
-        return message
+def login_failed_message(title: str) -> str:
+    return f'[{title}]\nxxljob登录失败，无法检查'
 
-    # --- 4. 遍历并校验每个预定义的任务 ---
-    all_jobs_data = {job['id']: job for job in page_data['data']}  # 将列表转为字典，方便通过ID查找
 
-    logger.info("\n--- 开始逐一校验任务配置 ---")
-    overall_success = True
-    message = '[大路表远传出账定时任务检查]\n'
+def find_problems(jobs_to_check, jobs, logger, job_ids=None) -> dict:
+    """
+    校验任务的 Cron、参数和启用状态，返回 {job_id: [问题描述]}，校验通过的任务不在结果中。
+    摘要与期望配置一致时直接判定通过；job_ids 不为空时只校验其中的任务。
+    """
+    all_jobs_data = {job['id']: job for job in jobs}  # 将列表转为字典，方便通过ID查找
+    problems = {}
     for check_item in jobs_to_check:
         job_id = check_item["job_id"]
         job_desc = check_item["job_desc"]
-        expected_cron = check_item["expected_cron"]
-        expected_param = check_item["expected_param"]
+        if job_ids is not None and job_id not in job_ids:
+            continue
 
-        logger.info(f"\n--- 校验任务: {job_desc} (ID: {job_id}) ---")
+        logger.info("\n--- 校验任务: %s (ID: %s) ---", job_desc, job_id)
 
         if job_id not in all_jobs_data:
-            logger.error(f"校验失败：在任务列表中未找到 ID 为 {job_id} 的任务。")
-            message += f'{job_desc}在任务列表中未找到!\n'
-            overall_success = False
+            logger.error("校验失败：在任务列表中未找到 ID 为 %s 的任务。", job_id)
+            problems[job_id] = ['在任务列表中未找到']
             continue
 
         target_job = all_jobs_data[job_id]
+        if xxljob_snapshot.job_hash(target_job) == xxljob_snapshot.spec_hash(check_item):
+            logger.info("  - 配置完全正确！")
+            continue
+
+        expected_cron = check_item["expected_cron"]
+        expected_param = check_item["expected_param"]
         actual_cron = target_job.get('scheduleConf')
         actual_param = target_job.get('executorParam')
-        actual_status = target_job.get('triggerStatus')
-
-        # 标志当前任务是否校验成功
-        current_job_success = True
+        issues = []
 
         # 校验Cron
-        if actual_cron.replace(" ", "").replace("\n", "") != expected_cron.replace(" ", "").replace("\n", ""):
-            # 处理不匹配的情况
-            logger.error(f"  -{job_desc}Cron不匹配! 期望: '{expected_cron}', 实际: '{actual_cron}'")
-            message += f'{job_desc}Cron不匹配!\n'
-
-            current_job_success = False
-            overall_success = False
-
-        # 校验参数
-        if actual_param.replace(" ", "").replace("\n", "") != expected_param.replace(" ", "").replace("\n", ""):
-            # 处理不匹配的情况
-            logger.error(f"  -{job_desc}参数不匹配! 期望: '{expected_param}', 实际: '{actual_param}'")
-            message += f'{job_desc}参数不匹配!\n'
-            current_job_success = False
-            overall_success = False
+        if xxljob_snapshot.canonical_cron(actual_cron) != xxljob_snapshot.canonical_cron(expected_cron):
+            logger.error("  -%sCron不匹配! 期望: '%s', 实际: '%s'", job_desc, expected_cron, actual_cron)
+            issues.append('Cron不匹配')
 
-        # 校验定时任务状态
-        if actual_status != 1:
-            logger.error(f"  -{job_desc}当前定时任务状态异常，未开启")
-            message += f'{job_desc}任务状态异常，未开启!\n'
-            current_job_success = False
-            overall_success = False
-
-        if current_job_success:
-            logger.info("  - ✅ 配置完全正确！")
-            message += f'{job_desc}配置完全正确!\n'
+        # 校验参数（按 JSON 解析后比较，忽略空白和键顺序）
+        if xxljob_snapshot.canonical_param(actual_param) != xxljob_snapshot.canonical_param(expected_param):
+            logger.error("  -%s参数不匹配! 期望: '%s', 实际: '%s'", job_desc, expected_param, actual_param)
+            issues.append('参数不匹配')
 
-    if overall_success:
-        logger.info("所有预定义的任务配置均校验通过！")
-        message += "所有预定义的任务配置均校验通过！"
-    else:
-        logger.info("注意！部分任务配置存在不匹配项，请检查以上日志！")
-        message += f'部分任务配置存在不匹配项，请检查以上日志！'
-
-    # sms_client.send_sms(phones=job_config['phones'],content=message,logger=logger)
-    return message
-
-def check_job_configs_hb(logger) -> str:
-    """
-    检查大路表户表出账定时任务参数
-    """
+        # 校验定时任务状态
+        if target_job.get('triggerStatus') != 1:
+            logger.error("  -%s当前定时任务状态异常，未开启", job_desc)
+            issues.append('任务状态异常，未开启')
 
-    logger.info("=      开始执行 XXL-Job 配置巡检任务      =")
+        if issues:
+            problems[job_id] = issues
+        else:
+            logger.info("  - 配置完全正确！")
+    return problems
 
-    # --- 1. 定义所有需要校验的任务配置 ---
-    jobs_to_check = [
-        {
-            "job_id": 1023,
-            "job_desc": "户表远传表出账(非良泉\石景山)",  # 描述，用于日志输出
-            "expected_cron": "0 0 6 3-6 * ?",
-            "expected_param": '{"0":["02160201","02130201","02150201","02150205"],"1":["02120201","02190202","02190201"],"2":["02120202","02180201","02170201"]}'
-            # "expected_param": '{"0":["02200208","02160201","02130201","02150201","02150205"],"1":["02200207","02120201","02190202","02190201"],"2":["02200201","02120202","02180201","02170201"]}'
-        },
-        {
-            "job_id": 1084,
-            "job_desc": "户表远传表出账(石景山)",  # 描述，用于日志输出
-            "expected_cron": "0 0 6 10-13 * ?",
-            "expected_param": '{"0":["02200208"],"1":["02200207"],"2":["02200201"]}'
-        },
-        {
-            "job_id": 1072,
-            "job_desc": "户表远传表出账(良泉)",
-            "expected_cron": "0 0 6 2-6 * ?",
-            "expected_param": '{"0":["02110201","02110202","02110203"],"1":["02110204","02110205"],"2":["02110207","02110208","02110209"]}'
-        }
-    ]
-
-    # --- 2. 登录和查询的公共配置 ---
-    login_payload = {'userName': 'admin', 'password': '123456'}
-    page_payload = {
-        'jobGroup': 35,  # 任务所在的执行器ID
-        'triggerStatus': -1,
-        'jobDesc':'出账',
-        'start': 0,
-        'length': 200
-    }
-
-    # --- 3. 执行登录和查询 ---
-    message = '[户表远传出账定时任务检查]\n'
-    session = get_xxl_session(LOGIN_URL, login_payload)
-    if not session:
-        logger.error("\n巡检任务因登录失败而中止。")
-        message += "xxljob登录失败，无法检查"
-        return message
 
-    page_data = get_xxl_page(session, PAGE_URL, page_payload)
-    if not page_data or 'data' not in page_data:
+def validate_jobs(title: str, jobs_to_check, jobs, logger) -> str:
+    """按期望配置逐一校验全部任务，返回完整的巡检短信内容"""
+    message = f'[{title}]\n'
+    if jobs is None:
         logger.error("\n巡检任务因获取任务列表失败而中止。")
         message += "获取任务列表失败而中止。"
         return message
 
-    # --- 4. 遍历并校验每个预定义的任务 ---
-    all_jobs_data = {job['id']: job for job in page_data['data']}  # 将列表转为字典，方便通过ID查找
-
     logger.info("\n--- 开始逐一校验任务配置 ---")
-    overall_success = True
+    problems = find_problems(jobs_to_check, jobs, logger)
     for check_item in jobs_to_check:
-        job_id = check_item["job_id"]
         job_desc = check_item["job_desc"]
-        expected_cron = check_item["expected_cron"]
-        expected_param = check_item["expected_param"]
-
-        logger.info(f"\n校验任务: {job_desc} (ID: {job_id}) ---")
-
-        if job_id not in all_jobs_data:
-            logger.error(f"校验失败：在任务列表中未找到 ID 为 {job_id} 的任务。")
-            message += f'{job_desc}在任务列表中未找到!\n'
-            overall_success = False
-            continue
-
-        target_job = all_jobs_data[job_id]
-        actual_cron = target_job.get('scheduleConf')
-        actual_param = target_job.get('executorParam')
-        actual_status = target_job.get('triggerStatus')
-
-        # 标志当前任务是否校验成功
-        current_job_success = True
-
-        # 校验Cron
-        if actual_cron.replace(" ", "").replace("\n", "") != expected_cron.replace(" ", "").replace("\n", ""):
-            # 处理不匹配的情况
-            logger.error(f"  -{job_desc}Cron不匹配! 期望: '{expected_cron}', 实际: '{actual_cron}'")
-            message+=f'{job_desc}Cron不匹配!\n'
-
-            current_job_success = False
-            overall_success = False
-
-        # 校验参数
-        if actual_param.replace(" ", "").replace("\n", "") != expected_param.replace(" ", "").replace("\n", ""):
-            # 处理不匹配的情况
-            logger.error(f"  -{job_desc}参数不匹配! 期望: '{expected_param}', 实际: '{actual_param}'")
-            message += f'{job_desc}参数不匹配!\n'
-            current_job_success = False
-            overall_success = False
-
-        # 校验定时任务状态
-        if actual_status != 1:
-            logger.error(f"  -{job_desc}当前定时任务状态异常，未开启")
-            message += f'{job_desc}任务状态异常，未开启!\n'
-            current_job_success = False
-            overall_success = False
-
-        if current_job_success:
-            logger.info("  - 配置完全正确！")
+        issues = problems.get(check_item["job_id"])
+        if issues:
+            message += "".join(f'{job_desc}{issue}!\n' for issue in issues)
+        else:
             message += f'{job_desc}配置完全正确!\n'
 
-    # --- 5. 打印最终总结 ---
-    if overall_success:
+    if not problems:
         logger.info("所有预定义的任务配置均校验通过！")
         message += "所有预定义的任务配置均校验通过！"
     else:
         logger.info("注意！部分任务配置存在不匹配项，请检查以上日志！")
         message += f'部分任务配置存在不匹配项，请检查以上日志！'
     return message
-    # 发送短信
-    # sms_client.send_sms(phones=job_config['phones'],content=message,logger=logger)
+
+
+def check_job_groups(logger) -> list:
+    """全量巡检：拉取任务列表、保存快照，并按期望配置生成每个执行器的巡检短信"""
+    logger.info("=      开始执行 XXL-Job 配置巡检任务      =")
+    job_config = get_job_config()
+    groups = job_config["groups"]
+    try:
+        job_groups = fetch_job_groups(groups, logger)
+    except XxlJobLoginError:
+        logger.error("\n巡检任务因登录失败而中止。")
+        return [login_failed_message(group["title"]) for group in groups.values()]
+    store = get_snapshot_store(job_config)
+    messages = []
+    for name, group in groups.items():
+        jobs = job_groups.get(name)
+        if jobs is not None:
+            store.save(name, jobs)
+        messages.append(validate_jobs(group["title"], group["jobs"], jobs, logger))
+    return messages
+
+
+def watch_job_groups(logger) -> list:
+    """
+    轮询巡检：与上一次快照比较摘要，只对摘要变化、新增或被删除的受检任务做逐项校验，
+    返回需要告警的短信内容（没有问题时为空列表）
+    """
+    job_config = get_job_config()
+    groups = job_config["groups"]
+    try:
+        job_groups = fetch_job_groups(groups, logger)
+    except XxlJobLoginError:
+        # 轮询只告警配置变更，登录失败由全量巡检（check_xxl_job）发送短信提示
+        logger.error("XXL-Job 登录失败，跳过本轮轮询")
+        return []
+    store = get_snapshot_store(job_config)
+    messages = []
+    for name, group in groups.items():
+        jobs = job_groups.get(name)
+        if jobs is None:
+            logger.error("执行器 %s 获取任务列表失败，跳过本轮轮询", name)
+            continue
+        diff = store.save(name, jobs)
+        watched = {spec["job_id"] for spec in group["jobs"]}
+        touched = (diff["changed"] | diff["removed"]) & watched
+        if not touched:
+            logger.info("执行器 %s 受检任务配置无变化", name)
+            continue
+        logger.info("执行器 %s 有 %d 个受检任务配置变化: %s", name, len(touched), sorted(touched))
+        problems = find_problems(group["jobs"], jobs, logger, touched)
+        if problems:
+            message = f'[{group["title"]}]\n'
+            for spec in group["jobs"]:
+                for issue in problems.get(spec["job_id"], []):
+                    message += f'{spec["job_desc"]}{issue}!\n'
+            messages.append(message + '定时任务配置发生变更，请检查！')
+    return messages
+
+
 @task
+@config.run_snapshot()
 def check_xxl_job():
     logger = get_logger()
-    job_name = "check_job_configs"
-    job_config = config.get_config_by_job(job_name)
-    message = check_job_configs_dlb(logger)
-    sms_client.send_sms(phones=job_config['phones'], content=message, logger=logger)
-    message = check_job_configs_hb(logger)
-    sms_client.send_sms(phones=job_config['phones'], content=message, logger=logger)
+    job_config = get_job_config()
+    # 一次登录，所有执行器的全部分页在同一轮并发请求中拉取
+    messages = check_job_groups(logger)
+    # 巡检结果连续写入发件箱，由投递线程合并为一次 batchSend 请求
+    sms_client = get_sms_client()
+    for message in messages:
+        sms_client.enqueue(phones=job_config['phones'], content=message, logger=logger)
+
+
+@task
+@config.run_snapshot()
+def watch_xxl_job():
+    logger = get_logger()
+    job_config = get_job_config()
+    messages = watch_job_groups(logger)
+    sms_client = get_sms_client()
+    for message in messages:
+        sms_client.enqueue(phones=job_config['phones'], content=message, logger=logger)
+
 
 if __name__ == "__main__":
     logger = getLogger(__name__)
-    job_name = "check_job_configs"
-    job_config = config.get_config_by_job(job_name)
-    message = check_job_configs_dlb(logger)
-    logger.info(message)
-    # sms_client.send_sms(phones=job_config['phones'], content=message, logger=logger)
-    message = check_job_configs_hb(logger)
-    logger.info(message)
-    # sms_client.send_sms(phones=job_config['phones'], content=message, logger=logger)
\ No newline at end of file
+    for message in check_job_groups(logger):
+        logger.info(message)
@@ -1,29 +1,35 @@
 import datetime
+import functools
 import logging
-import os
 
-import openpyxl
 from plombery import task, get_logger
 
 from src.utils import logger
 from src.rules.CompanyEnum import CompanyNameEnum
-from src.sms.sms_client import SMSClient
-from src.utils import ConfigLoader, dbutils
+from src.sms.sms_client import get_sms_client
+from src.utils import (ConfigLoader, admission, anomaly, async_db, circuit_breaker, db_metrics, db_pool, dbutils,
+                       excel_export, fanout, metric_compiler, metric_fetcher, query_memo, template_registry)
 
-config = ConfigLoader.ConfigLoader()
-sms_client = SMSClient(base_url=config.get_sms_api())
+config = ConfigLoader.get_config()
 job_name = "fetch_account_data"
-job_config = config.get_config_by_job(job_name)
 logger = logging.getLogger(__name__)
 
+# 每小时巡检覆盖的异常检测参数，任务配置 watch_anomaly 可再覆盖
+WATCH_ANOMALY_SETTINGS = {"zscore": False}
 
-def fill_sql(job_config):
-    """填充config中的sql参数并返回最终可执行的sql"""
-    sql_template = job_config.get("sql")
+# 未完成分公司在短信和 Excel 中的标记
+STATUS_TEXT = {"timeout": "查询超时", "busy": "连接繁忙", "unavailable": "数据库不可用", "error": "查询失败"}
 
+
+def get_job_config() -> dict:
+    """当前配置快照中的任务配置，配置文件热更新后在下一次运行生效"""
+    return config.get_config_by_job(job_name)
+
+
+def sql_params() -> dict:
+    """计算指标 SQL 模板中使用的日期参数"""
     # 获取当前日期
     today = datetime.date.today()
-    current_month = today.strftime("%Y%m")  # 202509 -> mr_month 格式
 
     # 上一年同月
     last_year_date = today.replace(year=today.year - 1)
@@ -34,8 +40,7 @@ def fill_sql(job_config):
     previous_month_date = first_day_of_this_month - datetime.timedelta(days=1)
     previous_month = previous_month_date.strftime("%Y-%m")
 
-    # 填充 SQL 模板
-    sql_filled = sql_template.format(
+    return dict(
         previous=previous_month_date.year,
         previous_month=previous_month,
         last_year=last_year_date.year,
@@ -44,85 +49,154 @@ def fill_sql(job_config):
         previous_year_date =previous_month_date,
         work_day=today.day # TODO:后续取计划管理的工作日，目前暂时按自然日取
     )
-    return sql_filled
 
-def fetch_data_by_company(company: str):
-    """按分公司获取数据"""
-    company_config =  config.get_database(company)
-    db = dbutils.DBUtils(company_config)
-    db.connect()
 
+def fill_sql(job_config, dialect=None):
+    """把config中的指标定义编译为单次扫描的聚合sql，返回最终可执行的sql"""
+    metrics = metric_compiler.render_metrics(job_config.get("metrics"), sql_params())
+    return metric_compiler.compile_metrics(metrics, dialect=dialect)
+
+def fetch_data_by_company(company: str, mode="exact", record=True):
+    """
+    按分公司获取数据，mode 为 exact（精确统计，正式短信使用）或 approximate（采样/规划器估算）；
+    record 为 False 时指标历史只用于查询，本次结果不写入（每小时巡检不覆盖出账任务的日样本）
+    """
+    company_config =  config.get_database(company)
     # 获取公司对应数据库配置（如果有不同公司）
-    sql = fill_sql(job_config)
-    users = db.query(sql)
-    db.close()
-    # 返回格式 [{'count': 139930, 'seq': 1}, {'count': 0, 'seq': 2}, {'count': 134194, 'seq': 3}]
-    # 1-本周期 2-上周期 3-去年同期
-    data = {
-        '本周期户表出账(支)': users[0]['count'] if len(users) > 0 else -1,
-        '本周期户表应出账(支)': users[1]['count'] if len(users) > 1 else -1,
-        '本周期大路表出账(支)': users[2]['count'] if len(users) > 0 else -1,
-        '本周期大路表应出账(支)': users[3]['count'] if len(users) > 1 else -1,
-        '上周期户表出账(支)': users[4]['count'] if len(users) > 0 else -1,
-        '去年周期户表出账(支)': users[5]['count'] if len(users) > 1 else -1,
-        '上周期大路表出账(支)': users[6]['count'] if len(users) > 1 else -1,
-        '去年周期大路表出账(支)': users[7]['count'] if len(users) > 1 else -1,
-    }
+    job_config = get_job_config()
+    metrics = metric_compiler.render_metrics(job_config.get("metrics"), sql_params())
+    errors = None
+    if mode == "approximate":
+        # 估算值带误差，不写入指标历史，避免影响环比和异常检测
+        values, errors = metric_fetcher.estimate_metrics(company, company_config, metrics,
+                                                         cache=metric_fetcher.get_metrics_cache(config),
+                                                         history=metric_fetcher.get_metric_history(config),
+                                                         settings=job_config.get("approximate"))
+    elif mode == "exact":
+        # 返回指标 name -> 值，例如 {'hb_actual': 139930, 'hb_expected': 140021, ...}；上周期/去年同期优先读本地缓存
+        values = metric_fetcher.fetch_metrics(company, company_config, metrics,
+                                              cache=metric_fetcher.get_metrics_cache(config),
+                                              history=metric_fetcher.get_metric_history(config),
+                                              job=job_name, record=record)
+    else:
+        raise ValueError(f"不支持的统计模式: {mode}")
+    return company_result(company, metrics, values, errors)
+
+
+async def fetch_data_by_company_async(company: str, record=True):
+    """fetch_data_by_company 的 asyncio 引擎版本（精确统计）"""
+    metrics = metric_compiler.render_metrics(get_job_config().get("metrics"), sql_params())
+    values = await metric_fetcher.fetch_metrics_async(company, config.get_database(company), metrics,
+                                                      cache=metric_fetcher.get_metrics_cache(config),
+                                                      history=metric_fetcher.get_metric_history(config),
+                                                      job=job_name, record=record)
+    return company_result(company, metrics, values)
+
+
+def company_result(company: str, metrics, values: dict, errors=None):
+    data = metric_compiler.map_result(metrics, [values])
 
     res = {
         'company': company,
         'data': data
     }
+    if errors is not None:
+        res['errors'] = metric_compiler.map_result(metrics, [errors], missing=None)
 
     logger.info("处理后数据：%s", res)
+    # 按指标 name 的原始值，供异常检测使用
+    res['values'] = values
     return res
 
 
-def build_excel(all_company_data,template_name="远传表出账明细.xlsx", output_path="远传表出账明细.xlsx"):
-    '''查询出来的结果写入到excel'''
-
-    # 1. 定义数据键名与Excel行号的映射关系（基于模板图片）
-    # 假设模板表格的“类目”在 A1，数据从 A2 开始。
-    # 模板行名:           数据字典键名:                     行号 (row index)
-    DATA_ROW_MAP = {
-        '本周期户表应出账': '本周期户表应出账(支)',  # 第 2 行
-        '本周期户表实际出账': '本周期户表出账(支)',  # 第 3 行
-        '上周期户表实际出账': '上周期户表出账(支)',  # 第 4 行
-        '去年同期户表实际出账': '去年周期户表出账(支)',  # 第 5 行
-        '本周期大路表应出账': '本周期大路表应出账(支)',  # 第 6 行
-        '本周期大路表实际出账': '本周期大路表出账(支)',  # 第 7 行
-        '上周期大路表实际出账': '上周期大路表出账(支)',  # 第 8 行
-        '去年同期大路表实际出账': '去年周期大路表出账(支)',  # 第 9 行
+def fetch_all(job_config, logger=logger, record=True):
+    """
+    并发获取所有分公司数据，结果顺序与配置中的分公司顺序一致；指向同一物理库的分公司只查询一次。
+    engine 为 asyncio 时所有分公司在一个事件循环中查询，否则使用线程池；record 为 False 时结果不写入指标历史
+    """
+    companies = job_config.get("companies")
+    if async_db.get_engine(job_config) == "asyncio":
+        return async_db.run_by_company(companies, functools.partial(fetch_data_by_company_async, record=record),
+                                       max_concurrency=job_config.get("max_concurrency"), logger=logger,
+                                       on_error=failed_result)
+    return fanout.run_by_company(companies, functools.partial(fetch_data_by_company, record=record),
+                                 max_workers=job_config.get("max_workers"), logger=logger,
+                                 on_error=failed_result)
+
+
+def failed_result(company: str, error: Exception):
+    """超时或失败的分公司：各指标写明未完成原因，而不是填 -1"""
+    if isinstance(error, (db_pool.PoolTimeout, admission.AdmissionTimeout)):
+        # 本地连接池或主机名额排队超时，数据库本身没有超时
+        status = "busy"
+    elif isinstance(error, TimeoutError):
+        # 连接、SQL 超时（dbutils.QueryTimeout）
+        status = "timeout"
+    elif isinstance(error, circuit_breaker.CircuitOpenError):
+        # 数据库处于熔断状态，本次未访问
+        status = "unavailable"
+    else:
+        status = "error"
+    metrics = get_job_config().get("metrics")
+    return {
+        'company': company,
+        'status': status,
+        'error': str(error),
+        'data': {metric.get("label", metric["name"]): STATUS_TEXT[status] for metric in metrics},
+        'values': {},
     }
 
-    # 将字典值（数据键名）作为映射的查找键
-    DATA_KEY_TO_ROW = {v: k for k, v in DATA_ROW_MAP.items()}
 
+def run_deadlines(job_config):
+    """任务级连接、SQL 期限（jobs.<job>.deadlines），与全局、数据源配置取较小值"""
+    return dbutils.deadlines(**(job_config.get("deadlines") or {}))
+
+
+def analyze_results(all_company_data, job_config, overrides=None):
+    """
+    本次结果与本地指标历史组成 分公司 × 指标 矩阵，一次向量化计算出异常分公司；
+    overrides 覆盖任务配置 anomaly 中的参数
+    """
+    settings = dict(job_config.get("anomaly") or {})
+    settings.update(overrides or {})
+    return anomaly.analyze(
+        {data['company']: data.get('values', {}) for data in all_company_data},
+        metrics=job_config.get("metrics"),
+        history=metric_fetcher.get_metric_history(config),
+        settings=settings,
+    )
+
+
+def report_layout(template_name="远传表出账明细.xlsx"):
+    """
+    报表布局：模板由注册表解析并缓存，指标通过 row 对应模板行标签。
+    Excel 和短信使用同一份布局，模板缺失时按指标配置生成最简布局
+    """
+    metrics = get_job_config().get("metrics")
+    try:
+        template = template_registry.get_template(template_name)
+    except FileNotFoundError:
+        logger.error("模板文件未找到: %s。请确保模板存在。", template_registry.registry.path_of(template_name))
+        template = template_registry.TemplateModel.blank(
+            "远传出账明细", [metric.get("row") or metric.get("label", metric["name"]) for metric in metrics])
+    return template, template_registry.report_rows(template, metrics)
+
+
+def build_excel(all_company_data, template_name="远传表出账明细.xlsx", output_path="远传表出账明细.xlsx", layout=None,
+                report=None):
+    '''查询出来的结果写入到excel'''
     # Excel 的起始列 (B列，列索引为 2)
     START_COL_INDEX = 2
 
     try:
-        # 2. 加载模板
-        current_dir = os.getcwd()
-        # 构建模板文件的完整路径：run/template/远传出账明细模板.xlsx
-        template_path = os.path.join(current_dir, 'template', template_name)
-        if not os.path.exists(template_path):
-            logger.error(f"模板文件未找到: {template_path}。请确保模板存在。")
-            # 如果模板不存在，可以创建基础结构 (简化处理)
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.cell(row=1, column=1, value="远传出账明细")
-            ws.cell(row=2, column=1, value="类目")
-            # 写入类目名称
-            for i, category in enumerate(DATA_ROW_MAP.keys()):
-                ws.cell(row=i + 3, column=1, value=category)
-            # 为了匹配图片，重新调整 row index
-            for i, category in enumerate(DATA_ROW_MAP.keys()):
-                ws.cell(row=i + 2, column=1, value=category)
-        else:
-            wb = openpyxl.load_workbook(template_path)
-
-        ws = wb.active
+        template, rows = layout or report_layout(template_name)
+        # 公司名称写在“类目”所在行，各指标按模板行号直接定位
+        header_row = template.row_of("类目") or 2
+        wb, ws = template.new_workbook()
+        # 异常检测结果写在模板最后一行之后
+        flag_row = len(template.cells) + 1 if report is not None else None
+        if flag_row:
+            ws.cell(row=flag_row, column=1, value="异常标记")
         for i, data_obj in enumerate(all_company_data):
 
             company_code = data_obj.get('company')
@@ -131,72 +205,157 @@ def build_excel(all_company_data,template_name="远传表出账明细.xlsx", out
 
             # 当前写入的列索引：从 B 列 (2) 开始，随着 i 递增
             current_col = START_COL_INDEX + i
+            ws.cell(row=header_row, column=current_col, value=company_name)
 
-            # 5. 写入公司名称 (列标题)
-            # 写入公司名称到第 2 行 (Row 2) 作为列头
-            ws.cell(row=2, column=current_col, value=company_name)
-
-            # 6. 遍历映射，写入该公司的各项数据
-            for key_in_data, row_name in DATA_KEY_TO_ROW.items():
-                if key_in_data in data_to_write:
-                    try:
-                        list_of_row_names = list(DATA_ROW_MAP.keys())
-                        index = list_of_row_names.index(row_name)
-                        # 实际行号是索引 + 3 (A1 标题, A2 类目/公司名, A3 是第一项数据)
-                        row_index = index + 3
-
-                    except ValueError:
-                        continue
+            for row in rows:
+                if row.row is not None and row.label in data_to_write:
+                    ws.cell(row=row.row, column=current_col, value=data_to_write[row.label])
 
-                    # 写入数据到对应的行和当前的列 (current_col)
-                    value = data_to_write[key_in_data]
-                    ws.cell(row=row_index, column=current_col, value=value)
+            if flag_row:
+                reasons = report.reasons(company_code)
+                if data_obj.get('status'):
+                    reasons = [STATUS_TEXT[data_obj['status']]]
+                cell = ws.cell(row=flag_row, column=current_col, value="；".join(reasons) if reasons else "正常")
+                if reasons:
+                    from openpyxl.styles import Font
+                    cell.font = Font(color="FFC00000", bold=True)
 
-            logger.info(f"已将 {company_name} 数据写入 Excel 第 {current_col} 列 ({chr(64 + current_col)} 列)。")
+            logger.info("已将 %s 数据写入 Excel 第 %s 列 (%s 列)。", company_name, current_col, chr(64 + current_col))
 
-            # 7. 保存 Excel 文件 (在循环结束后保存)
         wb.save(output_path)
-        logger.info(f"Excel 文件已成功生成并保存到: {output_path}")
+        logger.info("Excel 文件已成功生成并保存到: %s", output_path)
         return True
 
     except Exception as e:
-        logger.error(f"生成 Excel 出现错误: {e}")
+        logger.error("生成 Excel 出现错误: %s", e)
         return False
 
 
+def export_detail_report(job_config, logger=logger):
+    """
+    表级明细导出（jobs.fetch_account_data.detail）：各分公司明细逐行流式写入，每个分公司一个 sheet，
+    保留模板表头和列样式；行数可达数十万，不会一次性加载到内存
+    """
+    detail = job_config.get("detail") or {}
+    if not detail.get("enabled"):
+        return None
+    sql = detail["sql"].format(**sql_params())
+    return excel_export.export_detail(
+        job_config.get("companies"), config.get_database, sql,
+        output=detail.get("output", "远传表出账明细_表级.xlsx"), fmt=detail.get("format", "xlsx"),
+        template=detail.get("template"), header_rows=detail.get("header_rows", 2), columns=detail.get("columns"),
+        sheet_name=CompanyNameEnum.get_name, logger=logger,
+    )
+
 
-def build_sms_message(all_data):
+def build_sms_message(all_data, layout=None, report=None, outliers_only=False):
+    """
+    短信中各指标的顺序与 Excel 模板行顺序一致；传入异常检测结果时在末尾列出异常分公司，
+    outliers_only 为 True 时只列出异常分公司
+    """
+    _, rows = layout or report_layout()
     message = "【生产环境】截至目前本月远传出账情况："
+    unfinished = []
     for data in all_data:
+        if data.get('status'):
+            unfinished.append(data)
+            continue
+        if outliers_only and not (report and report.reasons(data['company'])):
+            continue
         message += '\n'
-        message += CompanyNameEnum.get_name(data['company'].upper()) + ':' + str(data['data']).replace('{', '').replace('}',
-                                                                                                             '').replace(
-            '\'', '')
+        message += CompanyNameEnum.get_name(data['company'].upper()) + ':' + template_registry.format_values(rows, data['data'])
+    if unfinished:
+        message += '\n【未完成分公司】'
+        for data in unfinished:
+            message += '\n' + CompanyNameEnum.get_name(data['company'].upper()) + ':' + STATUS_TEXT[data['status']]
+    if report is not None and report.outliers:
+        message += '\n【异常分公司】'
+        for company, reasons in report.outliers.items():
+            message += '\n' + CompanyNameEnum.get_name(company.upper()) + ':' + '；'.join(reasons)
     logger.debug(message)
     return message
 
+def build_estimate_message(all_data):
+    """近似统计结果：每个指标带 ± 误差，误差为 None 时标注为估算值"""
+    message = "截至目前本月远传出账情况（近似统计）："
+    for data in all_data:
+        if data.get('status'):
+            message += '\n' + CompanyNameEnum.get_name(data['company'].upper()) + ':' + STATUS_TEXT[data['status']]
+            continue
+        errors = data.get('errors', {})
+        values = []
+        for label, value in data['data'].items():
+            error = errors.get(label)
+            if error is None:
+                values.append(f"{label}: ≈{value}")
+            elif error:
+                values.append(f"{label}: {value}±{error}")
+            else:
+                values.append(f"{label}: {value}")
+        message += '\n' + CompanyNameEnum.get_name(data['company'].upper()) + ':' + ', '.join(values)
+    return message
+
+
 # 注册到plombery
 @task
+@config.run_snapshot()
 def fetch_account_data_job():
     """定时任务：发送生产环境远传出账生成情况"""
     logger = get_logger()
-    companies = job_config.get("companies")
-    res = []
-    # 获取所有分公司数据
-    for company in companies:
-        data = fetch_data_by_company(company)
-        res.append(data)
+    job_config = get_job_config()
+    # 单个分公司超时或失败时按未完成标记，其余分公司照常发送短信和生成 Excel
+    with db_metrics.run_stats("fetch_account", logger), query_memo.run_scope(logger), run_deadlines(job_config):
+        res = fetch_all(job_config, logger)
     if res:
-        message = build_sms_message(res)
-        sms_client.send_sms(phones=job_config['phones'],content=message,logger=logger)
-        build_excel(all_company_data=res)
+        layout = report_layout()
+        report = analyze_results(res, job_config)
+        message = build_sms_message(res, layout, report)
+        get_sms_client().enqueue(phones=job_config['phones'],content=message,logger=logger)
+        build_excel(all_company_data=res, layout=layout, report=report)
+        with db_metrics.run_stats("fetch_account_detail", logger):
+            export_detail_report(job_config, logger)
     else:
         logger.warning("未获取到任何公司数据，Excel生成跳过。")
         logger.warning("未获取到任何公司数据，短信发送跳过。")
 
 
+@task
+@config.run_snapshot()
+def watch_account_anomaly_job():
+    """定时任务：每小时检查远传出账指标，只在出现异常分公司时发送短信"""
+    logger = get_logger()
+    job_config = get_job_config()
+    # 每小时巡检只读取指标历史做对比，日样本由 fetch_account_data_job 写入
+    with db_metrics.run_stats("watch_account", logger), query_memo.run_scope(logger), run_deadlines(job_config):
+        res = fetch_all(job_config, logger, record=False)
+    # 历史是出账任务每天固定时刻的日样本，盘中累计值和完成率与之不可比：默认不计算 z-score，
+    # 只检查完成率阈值和截止时间相同的指标对比，可由 watch_anomaly 覆盖
+    overrides = dict(WATCH_ANOMALY_SETTINGS)
+    overrides.update(job_config.get("watch_anomaly") or {})
+    report = analyze_results(res, job_config, overrides) if res else None
+    if report is None or not report.outliers:
+        logger.info("未发现异常分公司，本次不发送短信")
+        return
+    message = build_sms_message(res, report=report, outliers_only=True)
+    get_sms_client().enqueue(phones=job_config['phones'], content=message, logger=logger)
+
+
+@task
+@config.run_snapshot()
+def fetch_account_quick_job():
+    """看板快速查看：按采样或规划器统计估算各分公司出账指标并写入运行日志，不发送短信"""
+    logger = get_logger()
+    job_config = get_job_config()
+    with db_metrics.run_stats("fetch_account_quick", logger), query_memo.run_scope(logger), run_deadlines(job_config):
+        res = fanout.run_by_company(job_config.get("companies"),
+                                    functools.partial(fetch_data_by_company, mode="approximate"),
+                                    max_workers=job_config.get("max_workers"), logger=logger,
+                                    on_error=failed_result)
+    logger.info(build_estimate_message(res))
+
+
 if __name__ == "__main__":
     # 手动触发测试
     fetch_account_data_job()
     # build_sms_message()
-    # fill_sql(job_config)
\ No newline at end of file
+    # fill_sql(get_job_config())
\ No newline at end of file
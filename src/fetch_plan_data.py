@@ -5,22 +5,23 @@ from plombery import task, get_logger
 
 from src.utils import logger
 from src.rules.CompanyEnum import CompanyNameEnum
-from src.sms.sms_client import SMSClient
-from src.utils import ConfigLoader, dbutils
+from src.sms.sms_client import get_sms_client
+from src.utils import ConfigLoader, async_db, db_metrics, fanout, metric_compiler, metric_fetcher, query_memo
 
-config = ConfigLoader.ConfigLoader()
-sms_client = SMSClient(base_url=config.get_sms_api())
+config = ConfigLoader.get_config()
 job_name = "fetch_plan_data_every_day"
-job_config = config.get_config_by_job(job_name)
 logger = logging.getLogger(__name__)
 
-def fill_sql(job_config):
-    """填充config中的sql参数并返回最终可执行的sql"""
-    sql_template = job_config.get("sql")
 
+def get_job_config() -> dict:
+    """当前配置快照中的任务配置，配置文件热更新后在下一次运行生效"""
+    return config.get_config_by_job(job_name)
+
+
+def sql_params() -> dict:
+    """计算指标 SQL 模板中使用的日期参数"""
     # 获取当前日期
     today = datetime.date.today()
-    current_month = today.strftime("%Y%m")  # 202509 -> mr_month 格式
 
     # 上一年同月
     last_year_date = today.replace(year=today.year - 1)
@@ -31,33 +32,44 @@ def fill_sql(job_config):
     previous_month_date = first_day_of_this_month - datetime.timedelta(days=1)
     previous_month = previous_month_date.strftime("%Y-%m")
 
-    # 填充 SQL 模板
-    sql_filled = sql_template.format(
+    return dict(
         previous=previous_month_date.year,
         previous_month=previous_month,
         last_year=last_year_date.year,
         last_year_month=last_year_month
     )
-    return sql_filled
+
+
+def fill_sql(job_config, dialect=None):
+    """把config中的指标定义编译为单次扫描的聚合sql，返回最终可执行的sql"""
+    metrics = metric_compiler.render_metrics(job_config.get("metrics"), sql_params())
+    return metric_compiler.compile_metrics(metrics, dialect=dialect)
 
 
 def fetch_data_by_company(company: str):
     """按分公司获取数据"""
     company_config =  config.get_database(company)
-    db = dbutils.DBUtils(company_config)
-    db.connect()
-
     # 获取公司对应数据库配置（如果有不同公司）
-    sql = fill_sql(job_config)
-    users = db.query(sql)
-    db.close()
-    # 返回格式 [{'count': 139930, 'seq': 1}, {'count': 0, 'seq': 2}, {'count': 134194, 'seq': 3}]
-    # 1-本周期 2-上周期 3-去年同期
-    data = {
-        '本周期查表计划数量(支)': users[0]['count'] if len(users) > 0 else -1,
-        '上周期查表计划数量(支)': users[1]['count'] if len(users) > 1 else -1,
-        '去年同期查表计划数量(支)': users[2]['count'] if len(users) > 2 else -1,
-    }
+    metrics = metric_compiler.render_metrics(get_job_config().get("metrics"), sql_params())
+    # 返回指标 name -> 值，例如 {'plan_current': 139930, 'plan_previous': 0, 'plan_last_year': 134194}；上周期/去年同期优先读本地缓存
+    values = metric_fetcher.fetch_metrics(company, company_config, metrics,
+                                          cache=metric_fetcher.get_metrics_cache(config),
+                                          history=metric_fetcher.get_metric_history(config), job=job_name)
+    return company_result(company, metrics, values)
+
+
+async def fetch_data_by_company_async(company: str):
+    """fetch_data_by_company 的 asyncio 引擎版本"""
+    metrics = metric_compiler.render_metrics(get_job_config().get("metrics"), sql_params())
+    values = await metric_fetcher.fetch_metrics_async(company, config.get_database(company), metrics,
+                                                      cache=metric_fetcher.get_metrics_cache(config),
+                                                      history=metric_fetcher.get_metric_history(config),
+                                                      job=job_name)
+    return company_result(company, metrics, values)
+
+
+def company_result(company: str, metrics, values: dict):
+    data = metric_compiler.map_result(metrics, [values])
 
     res = {
         'company': company,
@@ -67,15 +79,21 @@ def fetch_data_by_company(company: str):
     logger.info("处理后数据：%s", res)
     return res
 
-def build_sms_message():
+def build_sms_message(logger=logger):
     # 从config.yaml中获取该定时任务需要执行的分公司名称，注意获取数据并组装成短信内容
+    job_config = get_job_config()
     companies = job_config.get("companies")
-    res = []
     message = "\n【生产环境】查表计划当前生成情况："
-    # 获取所有分公司数据
-    for company in companies:
-        data = fetch_data_by_company(company)
-        res.append(data)
+    # 并发获取所有分公司数据，结果顺序与配置中的分公司顺序一致；指向同一物理库的分公司只查询一次
+    # engine 为 asyncio 时所有分公司在一个事件循环中查询，否则使用线程池
+    with db_metrics.run_stats("fetch", logger), query_memo.run_scope(logger):
+        if async_db.get_engine(job_config) == "asyncio":
+            res = async_db.run_by_company(companies, fetch_data_by_company_async,
+                                          max_concurrency=job_config.get("max_concurrency"), logger=logger)
+        else:
+            res = fanout.run_by_company(companies, fetch_data_by_company,
+                                        max_workers=job_config.get("max_workers"), logger=logger)
+    for data in res:
         message += '\n'
         message += CompanyNameEnum.get_name(data['company'].upper()) + ':' + str(data['data']).replace('{', '').replace('}',
                                                                                                              '').replace(
@@ -86,12 +104,13 @@ def build_sms_message():
 
 # 注册到plombery
 @task
+@config.run_snapshot()
 def fetch_plan_data_job():
     """定时任务：发送生产环境查表计划生成情况"""
     logger = get_logger()
-    message = build_sms_message()
+    message = build_sms_message(logger)
     logger.info(message)
-    sms_client.send_sms(phones=job_config['phones'],content=message,logger=logger)
+    get_sms_client().enqueue(phones=get_job_config()['phones'],content=message,logger=logger)
 
 def run_fetch_wmr_uat():
     """定时任务：发送生产环境查表计划生成情况"""
@@ -102,4 +121,4 @@ def run_fetch_wmr_uat():
 #     # 手动触发测试
 #     run_fetch_wmr_pro()
 #
-#     # fill_sql(job_config)
+#     # fill_sql(get_job_config())
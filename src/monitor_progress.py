@@ -0,0 +1,55 @@
+import logging
+
+from plombery import task, get_logger
+
+from src.rules.CompanyEnum import CompanyNameEnum
+from src.utils import ConfigLoader, db_metrics, fanout, progress_monitor
+
+config = ConfigLoader.get_config()
+job_name = "progress_monitor"
+logger = logging.getLogger(__name__)
+
+
+def get_job_config() -> dict:
+    """当前配置快照中的任务配置，配置文件热更新后在下一次运行生效"""
+    return config.get_config_by_job(job_name)
+
+
+def get_monitor(job_config) -> progress_monitor.ProgressMonitor:
+    settings = dict(progress_monitor.DEFAULT_PROGRESS_SETTINGS)
+    settings.update({k: v for k, v in job_config.items() if k in settings and v is not None})
+    path = job_config.get("path")
+    store = progress_monitor.get_store(config.root_dir / path if path else None)
+    return progress_monitor.ProgressMonitor(store, job_config["metrics"], table=settings["table"],
+                                            watermark_column=settings["watermark_column"],
+                                            reconcile_interval=settings["reconcile_interval"])
+
+
+def format_progress(results, metrics) -> str:
+    labels = {metric["name"]: metric.get("label", metric["name"]) for metric in metrics}
+    lines = ["远传出账实时进度："]
+    for result in results:
+        values = ", ".join(
+            f"{labels[name]}: {total}(+{result['delta'][name]})" for name, total in result["totals"].items())
+        mode = "全量核对" if result["mode"] == "full" else "增量"
+        lines.append(f"{CompanyNameEnum.get_name(result['company'])}[{mode}]: {values}")
+    return "\n".join(lines)
+
+
+# 注册到plombery
+@task
+@config.run_snapshot()
+def monitor_progress_job():
+    """定时任务：出账日每隔几分钟增量统计各分公司出账进度"""
+    logger = get_logger()
+    job_config = get_job_config()
+    monitor = get_monitor(job_config)
+
+    # 盘中进度只写入 ProgressStore，不写指标历史，避免覆盖出账任务的日样本
+    def update(company):
+        return monitor.update(company, config.get_database(company))
+
+    with db_metrics.run_stats("monitor_progress", logger):
+        results = fanout.run_by_company(job_config.get("companies"), update,
+                                        max_workers=job_config.get("max_workers"), logger=logger)
+    logger.info(format_progress(results, job_config["metrics"]))
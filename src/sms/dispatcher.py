@@ -0,0 +1,197 @@
+# sms/dispatcher.py
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from src.utils import admission
+
+# 短信发送默认参数，可在 config.yaml 的 sms 节点覆盖
+DEFAULT_SMS_SETTINGS = {
+    "batch_size": 50,     # 每次 batchSend 请求最多合并的短信条数
+    "timeout": 10,        # 单次请求超时秒数
+    "max_retries": 2,     # 请求未发出（连接失败、连接超时）或 5xx 时的最大重试次数
+    "backoff": 1.0,       # 重试间隔基数（秒），按 backoff * 2^n 递增
+}
+
+_SUCCESS_CODES = {0, 200, "0", "200"}
+
+# 发送结果：unknown 表示请求已发出但未收到响应（读超时等），网关可能已经发出短信，不能自动重发
+SENT = "sent"
+FAILED = "failed"
+UNKNOWN = "unknown"
+_RESULT_ORDER = (SENT, FAILED, UNKNOWN)
+
+# 连接尚未建立的异常（requests / urllib3 / 内置），此时请求体一定没有发出
+_NOT_CONNECTED = {"ConnectTimeout", "ConnectTimeoutError", "NewConnectionError", "NameResolutionError",
+                  "ConnectionRefusedError"}
+
+
+def _error_chain(error):
+    """异常及其包装的底层异常：requests.ConnectionError(MaxRetryError(reason=NewConnectionError)) 等"""
+    seen, stack = [], [error]
+    while stack:
+        item = stack.pop()
+        if not isinstance(item, BaseException) or any(item is other for other in seen):
+            continue
+        seen.append(item)
+        stack.extend(item.args)
+        stack.extend((getattr(item, "reason", None), item.__cause__, item.__context__))
+    return seen
+
+
+def request_not_sent(error) -> bool:
+    """
+    请求是否确定没有到达网关：连接超时、建立连接失败（包括域名解析失败、连接被拒绝）或本地排队超时，可以安全重试。
+    其它 ConnectionError（Connection aborted / RemoteDisconnected、ConnectionResetError 等）可能发生在请求体
+    写出之后，例如复用了已失效的 keep-alive 连接，与读超时一样按结果未知处理，batchSend 不幂等，不能重试
+    """
+    if isinstance(error, admission.AdmissionTimeout):
+        return True
+    return any(cls.__name__ in _NOT_CONNECTED for item in _error_chain(error) for cls in type(item).__mro__)
+
+
+def parse_response(status_code: int, text: str):
+    """
+    解析 batchSend 响应，返回 (是否成功, 说明)。
+    网关可能返回纯文本 success，也可能返回 {"code": 200, "msg": ...} 形式的 JSON。
+    """
+    if not 200 <= status_code < 300:
+        return False, f"HTTP {status_code}: {text[:200]}"
+    body = (text or "").strip()
+    if body.lower() in ("success", "ok", "true"):
+        return True, body
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return False, f"无法识别的响应: {body[:200]}"
+    if isinstance(data, dict):
+        if data.get("success") is True or str(data.get("status", "")).lower() == "success":
+            return True, body[:200]
+        if "code" in data:
+            return data["code"] in _SUCCESS_CODES, str(data.get("msg") or data.get("message") or body[:200])
+    if data is True:
+        return True, body
+    return False, f"无法识别的响应: {body[:200]}"
+
+
+class SMSBatch:
+    """一次运行内待发送的短信，flush 时合并为 batchSend 请求"""
+
+    def __init__(self, dispatcher, logger=None):
+        self.dispatcher = dispatcher
+        self.logger = logger or dispatcher.logger
+        self._messages = []
+        self._lock = threading.Lock()
+
+    def enqueue(self, phones: str, content: str):
+        with self._lock:
+            self._messages.append({"phones": phones, "content": content})
+
+    def flush(self) -> bool:
+        with self._lock:
+            messages, self._messages = self._messages, []
+        if not messages:
+            return True
+        return self.dispatcher.send(messages, logger=self.logger)
+
+    def __len__(self):
+        return len(self._messages)
+
+
+class SMSDispatcher:
+    """基于 keep-alive Session 的 batchSend 发送器，带超时、有限次重试和响应解析"""
+
+    def __init__(self, base_url: str, batch_size=50, timeout=10, max_retries=2, backoff=1.0, session=None):
+        self.base_url = base_url
+        self.batch_size = max(1, int(batch_size))
+        self.timeout = timeout
+        self.max_retries = max(0, int(max_retries))
+        self.backoff = backoff
+        self._session = session
+        self._session_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    # requests 在第一次发送短信时才导入
+                    import requests
+                    self._session = requests.Session()
+        return self._session
+
+    @contextmanager
+    def batch(self, logger=None):
+        """with dispatcher.batch(logger) as sms: sms.enqueue(...)，退出时合并发送"""
+        batch = SMSBatch(self, logger)
+        try:
+            yield batch
+        finally:
+            batch.flush()
+
+    def send(self, messages, logger=None, deadline=None) -> bool:
+        """按 batch_size 切分后发送，全部成功返回 True"""
+        return self.deliver(messages, logger, deadline) == SENT
+
+    def deliver(self, messages, logger=None, deadline=None) -> str:
+        """
+        按 batch_size 切分后发送，返回 sent / failed / unknown（多批时取最差的结果）。
+        deadline 为截止时间戳（time.time()），请求超时和重试都不会超过该时间。
+        """
+        if logger is None:
+            logger = self.logger
+        result = SENT
+        for start in range(0, len(messages), self.batch_size):
+            chunk = messages[start:start + self.batch_size]
+            status = self._post(chunk, logger, deadline)
+            for message in chunk:
+                if status == SENT:
+                    logger.info("【短信发送成功】手机号: %s, 内容: %s", message["phones"], message["content"])
+                elif status == UNKNOWN:
+                    logger.error("【短信发送结果未知】请求已发出但未收到响应，不自动重发，请人工核实。手机号: %s, 内容: %s",
+                                 message["phones"], message["content"])
+                else:
+                    logger.error("【短信发送失败】手机号: %s, 内容: %s", message["phones"], message["content"])
+            result = max(result, status, key=_RESULT_ORDER.index)
+        return result
+
+    def _remaining(self, deadline):
+        if deadline is None:
+            return self.timeout
+        return min(self.timeout, deadline - time.time())
+
+    def _post(self, payload, logger, deadline=None) -> str:
+        """发送一次 batchSend，只在请求未发出或 5xx 时重试，返回 sent / failed / unknown"""
+        logger.info("post:%s,短信条数:%d,参数:%s", self.base_url, len(payload),
+                    json.dumps(payload, ensure_ascii=False))
+        for attempt in range(self.max_retries + 1):
+            timeout = self._remaining(deadline)
+            if timeout <= 0:
+                logger.warning("短信发送已超过截止时间，放弃本次请求")
+                break
+            try:
+                with admission.service_slot("sms", logger):
+                    resp = self.session.post(self.base_url, json=payload, timeout=timeout)
+                ok, detail = parse_response(resp.status_code, resp.text)
+                if ok:
+                    return SENT
+                # 4xx 或业务失败不重试
+                retryable = resp.status_code >= 500
+                logger.warning("短信网关返回失败(第 %d 次): %s", attempt + 1, detail)
+            except Exception as e:
+                if not request_not_sent(e):
+                    # 请求可能已被网关处理，重发会重复发送短信
+                    logger.error("短信请求已发出但未收到响应(第 %d 次)，发送结果未知，不重试: %s", attempt + 1, e)
+                    return UNKNOWN
+                retryable = True
+                logger.warning("短信请求未发出(第 %d 次): %s", attempt + 1, e)
+            if not retryable or attempt >= self.max_retries:
+                break
+            delay = self.backoff * (2 ** attempt)
+            if deadline is not None and time.time() + delay >= deadline:
+                break
+            time.sleep(delay)
+        return FAILED
@@ -0,0 +1,274 @@
+# sms/outbox.py
+"""
+    短信异步投递：任务把短信写入本地 SQLite 发件箱后立即返回，由后台线程合并发送。
+    - 每条短信带截止时间，超过截止时间仍未送达的标记为 expired，不再重试
+    - 请求已发出但未收到响应（读超时）的标记为 unknown，不自动重发，避免重复发送
+    - 发送结果写回发件箱，并输出到入队时传入的任务日志
+    - 进程崩溃或重启后，服务启动时发件箱中仍有 pending 短信则启动投递线程补发（SMSClient.resume_pending）：
+      入队不超过 recovery_max_age 秒的按 recovery_deadline 重新计算截止时间，更早的视为过时告警，标记 expired
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.sms.dispatcher import SENT, UNKNOWN
+
+DEFAULT_PATH = Path(__file__).parent.parent.resolve() / "data" / "sms_outbox.db"
+
+# 异步投递默认参数，可在 config.yaml 的 sms_outbox 节点覆盖
+DEFAULT_OUTBOX_SETTINGS = {
+    "enabled": True,
+    "path": None,           # 发件箱文件，相对 src 目录，默认 data/sms_outbox.db
+    "deadline": 600,        # 单条短信从入队起的最长投递时间（秒）
+    "recovery_deadline": 600,  # 重启后恢复的短信从恢复起的最长投递时间（秒），为空时沿用原截止时间
+    "recovery_max_age": 3600,  # 重启后只补发入队不超过该秒数的短信，截止时间也不超过入队时间加该秒数
+    "retry_interval": 30,   # 发送失败后下一轮重试的间隔（秒）
+    "linger": 0.5,          # 被唤醒后等待的时间（秒），把同一时刻入队的短信合并为一次 batchSend
+}
+
+PENDING = "pending"
+EXPIRED = "expired"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_outbox (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    base_url     TEXT NOT NULL,
+    phones       TEXT NOT NULL,
+    content      TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    created_at   REAL NOT NULL,
+    deadline_at  REAL NOT NULL,
+    updated_at   REAL NOT NULL,
+    last_error   TEXT
+)
+"""
+_INDEX = "CREATE INDEX IF NOT EXISTS idx_sms_outbox_status ON sms_outbox (status, base_url, id)"
+
+
+class SMSOutbox:
+    """本地持久化发件箱，写入即提交，进程退出不会丢失未发送的短信"""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else DEFAULT_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(_SCHEMA)
+        self._conn.execute(_INDEX)
+        self._conn.commit()
+
+    def add(self, base_url: str, phones: str, content: str, deadline_at: float) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO sms_outbox (base_url, phones, content, status, created_at, deadline_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (base_url, phones, content, PENDING, now, deadline_at, now),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def pending(self, base_url: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, phones, content, attempts, deadline_at FROM sms_outbox "
+                "WHERE status = ? AND base_url = ? ORDER BY id",
+                (PENDING, base_url),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def has_pending(self, base_url: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sms_outbox WHERE status = ? AND base_url = ? LIMIT 1", (PENDING, base_url),
+            ).fetchone()
+        return row is not None
+
+    def recover(self, base_url: str, created_before: float, deadline_at: float, max_age=None):
+        """
+        上次进程遗留（created_before 之前入队）的 pending 短信：入队超过 max_age 秒的标记 expired，
+        其余截止时间延后到 deadline_at（只延后不提前，且不超过入队时间 + max_age）。返回 (恢复条数, 过期条数)
+        """
+        now = time.time()
+        limit = "MIN(?, created_at + ?)" if max_age else "?"
+        bound = (deadline_at, max_age) if max_age else (deadline_at,)
+        with self._lock:
+            expired = 0
+            if max_age:
+                expired = self._conn.execute(
+                    "UPDATE sms_outbox SET status = ?, updated_at = ?, last_error = ? "
+                    "WHERE status = ? AND base_url = ? AND created_at < ? AND created_at + ? <= ?",
+                    (EXPIRED, now, "重启前入队时间过久，不再补发", PENDING, base_url, created_before, max_age, now),
+                ).rowcount
+            recovered = self._conn.execute(
+                f"UPDATE sms_outbox SET deadline_at = MAX(deadline_at, {limit}) "
+                "WHERE status = ? AND base_url = ? AND created_at < ?",
+                (*bound, PENDING, base_url, created_before),
+            ).rowcount
+            self._conn.commit()
+        return recovered, expired
+
+    def mark(self, ids, status: str, error=None):
+        """更新投递状态；status 仍为 pending 时表示本轮失败、等待重试"""
+        if not ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE sms_outbox SET status = ?, attempts = attempts + 1, updated_at = ?, last_error = ? "
+                "WHERE id = ?",
+                [(status, now, error, message_id) for message_id in ids],
+            )
+            self._conn.commit()
+
+    def status(self, message_id: int):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM sms_outbox WHERE id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DeliveryWorker:
+    """
+    后台投递线程：按 id 顺序读取发件箱中的 pending 短信，按 batch_size 合并调用 dispatcher 发送。
+    请求超时和重试都受该批短信中最早的截止时间约束，任务线程不会等待短信网关。
+    """
+
+    def __init__(self, dispatcher, outbox: SMSOutbox, deadline=600, retry_interval=30, linger=0.5,
+                 recovery_deadline=600, recovery_max_age=3600):
+        self.dispatcher = dispatcher
+        self.outbox = outbox
+        self.deadline = deadline
+        self.recovery_deadline = recovery_deadline
+        self.recovery_max_age = recovery_max_age
+        # 此前入队的短信都是上次进程遗留的
+        self._created_at = time.time()
+        self._recovered = False
+        self.retry_interval = retry_interval
+        self.linger = linger
+        # 入队时传入的任务日志，投递结果写回对应运行的日志；重启后恢复的短信使用默认日志
+        self._loggers = {}
+        self._loggers_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    def start(self):
+        """启动后台线程（幂等），首次启动时先恢复并投递上次进程遗留的 pending 短信"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if not self._recovered:
+                self.recover()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="sms-delivery", daemon=True)
+            self._thread.start()
+
+    def recover(self) -> int:
+        """
+        恢复上次进程遗留的短信：入队超过 recovery_max_age 的放弃，其余截止时间按 recovery_deadline 从现在起重新计算，
+        返回补发条数
+        """
+        self._recovered = True
+        deadline_at = time.time() + self.recovery_deadline if self.recovery_deadline else 0
+        leftover, expired = self.outbox.recover(self.dispatcher.base_url, self._created_at, deadline_at,
+                                                self.recovery_max_age)
+        if expired:
+            self.logger.error("【短信超时未送达】发件箱中有 %d 条上次未送达的短信入队已超过 %ss，不再补发",
+                              expired, self.recovery_max_age)
+        if leftover:
+            self.logger.info("发件箱中有 %d 条上次未送达的短信，重新投递", leftover)
+        return leftover
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def enqueue(self, phones: str, content: str, logger=None, deadline=None) -> int:
+        """写入发件箱后立即返回短信 id，由后台线程投递"""
+        if logger is None:
+            logger = self.logger
+        deadline_at = time.time() + (deadline if deadline is not None else self.deadline)
+        message_id = self.outbox.add(self.dispatcher.base_url, phones, content, deadline_at)
+        with self._loggers_lock:
+            self._loggers[message_id] = logger
+        logger.info("短信[%d]已加入发件箱，%s 前送达，手机号: %s", message_id,
+                    time.strftime("%H:%M:%S", time.localtime(deadline_at)), phones)
+        self.start()
+        self._wakeup.set()
+        return message_id
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.deliver_pending()
+            except Exception as e:
+                self.logger.error("短信投递线程异常: %s", e)
+            self._wakeup.wait(self.retry_interval)
+            if self._stopped.is_set():
+                break
+            self._wakeup.clear()
+            # 稍等片刻，把同一任务连续入队的多条短信合并为一次请求
+            self._stopped.wait(self.linger)
+
+    def _pop_logger(self, message_id):
+        with self._loggers_lock:
+            return self._loggers.pop(message_id, None) or self.logger
+
+    def _peek_logger(self, message_id):
+        with self._loggers_lock:
+            return self._loggers.get(message_id) or self.logger
+
+    def deliver_pending(self) -> int:
+        """投递一轮发件箱中的 pending 短信，返回本轮送达条数"""
+        rows = self.outbox.pending(self.dispatcher.base_url)
+        if not rows:
+            return 0
+        now = time.time()
+        expired = [row for row in rows if row["deadline_at"] <= now]
+        for row in expired:
+            self._pop_logger(row["id"]).error(
+                "【短信超时未送达】短信[%d]已超过截止时间，放弃投递(已尝试 %d 次)，手机号: %s, 内容: %s",
+                row["id"], row["attempts"], row["phones"], row["content"])
+        self.outbox.mark([row["id"] for row in expired], EXPIRED, "超过截止时间")
+
+        # 同一次运行入队的短信写回同一个任务日志
+        groups = {}
+        for row in rows:
+            if row["deadline_at"] > now:
+                logger = self._peek_logger(row["id"])
+                groups.setdefault(id(logger), (logger, []))[1].append(row)
+
+        delivered = 0
+        batch_size = self.dispatcher.batch_size
+        for logger, group in groups.values():
+            for start in range(0, len(group), batch_size):
+                chunk = group[start:start + batch_size]
+                ids = [row["id"] for row in chunk]
+                messages = [{"phones": row["phones"], "content": row["content"]} for row in chunk]
+                deadline_at = min(row["deadline_at"] for row in chunk)
+                result = self.dispatcher.deliver(messages, logger=logger, deadline=deadline_at)
+                if result == SENT:
+                    self.outbox.mark(ids, SENT)
+                    for message_id in ids:
+                        self._pop_logger(message_id)
+                    delivered += len(chunk)
+                elif result == UNKNOWN:
+                    self.outbox.mark(ids, UNKNOWN, "请求已发出但未收到响应，结果未知")
+                    for message_id in ids:
+                        self._pop_logger(message_id)
+                else:
+                    self.outbox.mark(ids, PENDING, "发送失败")
+                    logger.warning("短信%s本轮发送失败，%d 秒后重试", ids, self.retry_interval)
+        return delivered
@@ -1,31 +1,95 @@
 # core/sms_client.py
-import json
 import logging
+import threading
 
-from plombery import get_logger
+from src.sms.dispatcher import DEFAULT_SMS_SETTINGS, SMSDispatcher
+from src.sms.outbox import DEFAULT_OUTBOX_SETTINGS, DeliveryWorker, SMSOutbox
+from src.utils.ConfigLoader import get_config
 
-import requests
 
 class SMSClient:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, outbox_settings=None, **settings):
         self.base_url = base_url
         self.logger = logging.getLogger("SMSClient")
+        options = dict(DEFAULT_SMS_SETTINGS)
+        options.update({k: v for k, v in settings.items() if v is not None})
+        self.dispatcher = SMSDispatcher(base_url, **options)
+        self.outbox_settings = dict(DEFAULT_OUTBOX_SETTINGS)
+        self.outbox_settings.update({k: v for k, v in (outbox_settings or {}).items() if v is not None})
+        self._delivery = None
+        self._delivery_lock = threading.Lock()
+
+    @property
+    def delivery(self) -> DeliveryWorker:
+        """后台投递线程，首次使用时打开发件箱"""
+        if self._delivery is None:
+            with self._delivery_lock:
+                if self._delivery is None:
+                    settings = self.outbox_settings
+                    path = settings["path"]
+                    if path:
+                        path = get_config().root_dir / path
+                    self._delivery = DeliveryWorker(
+                        self.dispatcher, SMSOutbox(path), deadline=settings["deadline"],
+                        retry_interval=settings["retry_interval"], linger=settings["linger"],
+                        recovery_deadline=settings["recovery_deadline"],
+                        recovery_max_age=settings["recovery_max_age"],
+                    )
+        return self._delivery
+
+    def resume_pending(self) -> bool:
+        """
+        服务启动时调用：发件箱中有上次进程遗留的 pending 短信时启动投递线程补发，返回是否启动。
+        没有遗留短信时不启动线程，短信网关的连接在第一次发送时才建立
+        """
+        if not self.outbox_settings["enabled"]:
+            return False
+        delivery = self.delivery
+        if not delivery.outbox.has_pending(self.base_url):
+            return False
+        delivery.start()
+        return True
+
+    def enqueue(self, phones: str, content: str, logger=None, deadline=None):
+        """
+        异步发送：写入发件箱后立即返回，由后台线程在截止时间（秒）内投递，结果写回 logger；
+        第一次入队时启动投递线程，并补发上次进程遗留的短信。
+        配置 sms_outbox.enabled 为 false 时退化为同步发送。
+        """
+        if logger is None:
+            logger = self.logger
+        if not self.outbox_settings["enabled"]:
+            return self.send_sms(phones, content, logger=logger)
+        return self.delivery.enqueue(phones, content, logger=logger, deadline=deadline)
 
     def send_sms(self, phones: str, content: str,logger=None):
-        """北水短信服务发送格式"""
+        """北水短信服务发送格式，立即发送一条，返回是否发送成功"""
         if logger is None:
             logger = self.logger
-        paramList = []
-        postData = {
-            "phones": phones,
-            "content": content
-        }
-        paramList.append(postData)
-        logger.info(f"post:{self.base_url},参数:{json.dumps(paramList, ensure_ascii=False)}")
         #TODO:发内网环境之前需要解除注释
-        resp = requests.post(self.base_url, json=paramList)
-        if resp == "success":
-            logger.info(f"【短信发送成功】手机号: {phones}, 内容: {content}")
-        else:
-            logger.error(f"【短信发送失败】手机号: {phones}, 内容: {content}")
-        return True
+        return self.dispatcher.send([{"phones": phones, "content": content}], logger=logger)
+
+    def batch(self, logger=None):
+        """
+        合并发送：with client.batch(logger) as sms: sms.enqueue(phones, content)
+        退出 with 时把本次运行的短信合并为 batchSend 请求发出
+        """
+        return self.dispatcher.batch(logger or self.logger)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_sms_client(base_url: str = None) -> SMSClient:
+    """按短信接口地址获取共享的 SMSClient，首次使用时才创建；默认取配置中的 sms_api"""
+    config = get_config()
+    if base_url is None:
+        base_url = config.get_sms_api()
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = SMSClient(base_url=base_url, outbox_settings=config.get("sms_outbox"),
+                               **(config.get("sms", {}) or {}))
+            _clients[base_url] = client
+        return client
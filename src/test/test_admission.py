@@ -0,0 +1,46 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils.admission import AdmissionTimeout, Limiter, apply_jitter
+
+
+def test_limiter_queues_in_arrival_order():
+    limiter = Limiter('db:10.10.15.145:54321', 1)
+    limiter.acquire()
+    order = []
+
+    def worker(name):
+        limiter.acquire(timeout=5)
+        order.append(name)
+        limiter.release()
+
+    threads = []
+    for name in ('first', 'second', 'third'):
+        thread = threading.Thread(target=worker, args=(name,))
+        thread.start()
+        threads.append(thread)
+        # 保证按顺序进入队列
+        while limiter.waiting < len(threads):
+            time.sleep(0.001)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == ['first', 'second', 'third']
+    assert limiter.active == 0
+
+
+def test_limiter_timeout():
+    limiter = Limiter('service:sms', 1)
+    limiter.acquire()
+    with pytest.raises(AdmissionTimeout):
+        limiter.acquire(timeout=0.05)
+    assert limiter.waiting == 0
+
+
+def test_apply_jitter():
+    triggers = [SimpleNamespace(schedule=SimpleNamespace(jitter=None))]
+    apply_jitter('check_config', triggers, jitter=60)
+    assert triggers[0].schedule.jitter == 60
@@ -0,0 +1,55 @@
+import datetime
+
+import pytest
+
+from src.utils.metric_history import MetricHistory, shift_months
+
+np = pytest.importorskip('numpy')
+
+from src.utils import anomaly  # noqa: E402
+
+SETTINGS = {
+    'min_history': 3,
+    'ratios': [{'name': 'hb_completion', 'label': '户表出账完成率', 'actual': 'hb_actual', 'expected': 'hb_expected'}],
+    'deltas': [{'label': '户表出账较上周期', 'current': 'hb_actual', 'base': 'hb_previous'}],
+}
+
+
+def test_flags_only_outlier_companies(tmp_path):
+    history = MetricHistory(tmp_path / 'history.db')
+    today = datetime.date(2025, 10, 5)
+    for k, actual in enumerate([900, 910, 905, 895], start=1):
+        day = shift_months(today, -k)
+        for company in ('ds_dx', 'ds_tz'):
+            history.record(company, {'hb_actual': actual, 'hb_expected': 1000}, run_date=day)
+
+    values = {
+        'ds_dx': {'hb_actual': 902, 'hb_expected': 1000, 'hb_previous': 900},
+        'ds_tz': {'hb_actual': 300, 'hb_expected': 1000, 'hb_previous': 895},
+    }
+    report = anomaly.analyze(values, history=history, settings=SETTINGS, run_date=today)
+    assert list(report.outliers) == ['ds_tz']
+    reasons = report.reasons('ds_tz')
+    assert any(reason.startswith('hb_actual偏离历史') for reason in reasons)
+    assert any(reason.startswith('户表出账完成率偏离历史') for reason in reasons)
+    assert '户表出账较上周期下降66.5%' in reasons
+    assert report.value('ds_dx', 'hb_completion') == pytest.approx(0.902)
+
+
+def test_missing_values_and_short_history_are_not_flagged():
+    values = {'ds_dx': {'hb_actual': -1, 'hb_expected': 1000, 'hb_previous': 900}}
+    report = anomaly.analyze(values, settings=SETTINGS, run_date=datetime.date(2025, 10, 5))
+    assert report.outliers == {}
+    assert np.isnan(report.zscores).all()
+
+
+# 盘中巡检关闭 z-score：累计值偏低不报异常，只检查指标对比
+def test_zscore_disabled_for_intraday_runs(tmp_path):
+    history = MetricHistory(tmp_path / 'history.db')
+    today = datetime.date(2025, 10, 5)
+    for k in range(1, 5):
+        history.record('ds_dx', {'hb_actual': 900 + k, 'hb_expected': 1000}, run_date=shift_months(today, -k))
+    values = {'ds_dx': {'hb_actual': 300, 'hb_expected': 1000, 'hb_previous': 310}}
+    report = anomaly.analyze(values, history=history, settings=dict(SETTINGS, zscore=False), run_date=today)
+    assert report.outliers == {}
+    assert np.isnan(report.zscores).all()
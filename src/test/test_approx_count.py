@@ -0,0 +1,45 @@
+import pytest
+
+from src.utils.approx_count import estimate_metrics, scale_count
+
+METRICS = [{'name': 'hb_actual', 'table': 'water_revenue.water_meter_read', 'filter': "client_type = '1'"},
+           {'name': 'dlb_actual', 'table': 'water_revenue.water_meter_read', 'filter': "client_type = '2'"}]
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = rows
+        self.sqls = []
+
+    def query(self, sql, params=None, memoize=True):
+        self.sqls.append(sql)
+        return self.rows(sql) if callable(self.rows) else self.rows
+
+
+def test_scale_count_error():
+    estimate = scale_count(400, 1.0)
+    assert estimate.value == 40000
+    # 1.96 * sqrt(400 * 0.99) / 0.01
+    assert estimate.error == 3901
+    assert scale_count(0, 100).error == 0
+
+
+def test_sample_uses_same_filters_on_sampled_table():
+    db = FakeDB([{'hb_actual': 120, 'dlb_actual': 30}])
+    result = estimate_metrics(db, METRICS, settings={'sample_percent': 10, 'seed': 7})
+    assert 'FROM water_revenue.water_meter_read TABLESAMPLE BERNOULLI (10) REPEATABLE (7)' in db.sqls[0]
+    assert "count(*) FILTER (WHERE client_type = '1') AS hb_actual" in db.sqls[0]
+    assert result['hb_actual'].value == 1200 and result['hb_actual'].error > 0
+
+
+def test_planner_reads_plan_rows():
+    db = FakeDB(lambda sql: [{'QUERY PLAN': [{'Plan': {'Plan Rows': 5000 if "'1'" in sql else 700}}]}])
+    result = estimate_metrics(db, METRICS, settings={'method': 'planner'})
+    assert db.sqls[0].startswith('EXPLAIN (FORMAT JSON) SELECT 1 FROM water_revenue.water_meter_read WHERE')
+    assert (result['hb_actual'].value, result['dlb_actual'].value) == (5000, 700)
+    assert result['hb_actual'].error is None
+
+
+def test_invalid_percent():
+    with pytest.raises(ValueError):
+        estimate_metrics(FakeDB([]), METRICS, settings={'sample_percent': 0})
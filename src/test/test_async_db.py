@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from src.utils import async_db
+from src.utils.async_db import AsyncDBUtils, run_by_company, to_numbered
+from src.utils.dbutils import QueryTimeout
+
+DB = {'host': '10.10.15.145', 'port': 54321, 'name': 'wpg_sjs', 'user': 'wpg'}
+
+
+class FakeConnection:
+    """asyncpg 连接替身：fetch 等待 delay 秒后返回"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+        self.executed = []
+
+    async def fetch(self, sql, *params, timeout=None):
+        self.calls += 1
+        self.executed.append((sql, params))
+        await asyncio.wait_for(asyncio.sleep(self.delay), timeout)
+        return [{'n': 1}]
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_timeouts(monkeypatch):
+    monkeypatch.setattr(async_db, 'resolve_timeout', lambda key, config: config.get(key))
+
+
+def test_run_by_company_concurrent_and_deduplicated():
+    shared = FakeConnection()
+    running = {'now': 0, 'peak': 0}
+
+    async def fetch(company):
+        running['now'] += 1
+        running['peak'] = max(running['peak'], running['now'])
+        db = AsyncDBUtils(DB, company=company)
+        db.conn = shared
+        try:
+            return company, await db.query('SELECT 1 AS n')
+        finally:
+            running['now'] -= 1
+
+    companies = ['ds_sjs', 'ds_cxd', 'ds_mtg', 'ds_hr']
+    res = run_by_company(companies, fetch, max_concurrency=2)
+    assert [company for company, _ in res] == companies
+    assert all(rows == [{'n': 1}] for _, rows in res)
+    # 同一物理库上相同 SQL 只执行一次，并发不超过上限
+    assert shared.calls == 1
+    assert running['peak'] == 2
+
+
+def test_statement_timeout_marks_branch():
+    async def fetch(company):
+        db = AsyncDBUtils(dict(DB, statement_timeout=0.01), company=company)
+        db.conn = FakeConnection(delay=1)
+        return await db.query('SELECT pg_sleep(1)', memoize=False)
+
+    res = run_by_company(['ds_sjs'], fetch, on_error=lambda company, e: type(e))
+    assert res == [QueryTimeout]
+
+
+# 与 DBUtils 相同的 %s / %(name)s 占位符，asyncpg 执行前转换为 $n
+def test_placeholders_translated_for_asyncpg():
+    assert to_numbered("SELECT 1 WHERE a = %s AND b LIKE 'x%%' AND c = %s", ('a', 3)) == \
+        ("SELECT 1 WHERE a = $1 AND b LIKE 'x%' AND c = $2", ('a', 3))
+    assert to_numbered('SELECT %(m)s, %(n)s, %(m)s', {'m': 1, 'n': 2}) == ('SELECT $1, $2, $1', (1, 2))
+    assert to_numbered("SELECT '100%'") == ("SELECT '100%'", ())
+    for sql, params in (('SELECT %s, %s', (1,)), ('SELECT %s', (1, 2)), ('SELECT %(m)s', (1,)),
+                        ('SELECT %(m)s', {'n': 1})):
+        with pytest.raises(ValueError):
+            to_numbered(sql, params)
+
+
+def test_query_params_and_format():
+    conn = FakeConnection(delay=0)
+
+    async def fetch(company):
+        db = AsyncDBUtils(DB, company=company)
+        db.conn = conn
+        return await db.query('SELECT n FROM t WHERE company = %s', ('ds_sjs',), memoize=False, fmt='tuple')
+
+    assert run_by_company(['ds_sjs'], fetch) == [[(1,)]]
+    assert conn.executed == [('SELECT n FROM t WHERE company = $1', ('ds_sjs',))]
+    with pytest.raises(ValueError):
+        asyncio.run(AsyncDBUtils(DB).query('SELECT 1', fmt='xml'))
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from src.utils import admission, dbutils
+from src.utils.circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError, format_states, \
+    is_connection_error
+from src.utils.db_pool import PoolTimeout
+from src.utils.dbutils import DBUtils
+
+KEY = ('10.10.15.145', 54321, 'wpg_sjs')
+
+
+class OperationalError(Exception):
+    pass
+
+
+class QueryCanceled(OperationalError):
+    pgcode = '57014'
+
+
+class ClosedConnection:
+    closed = 2
+
+
+def test_opens_after_consecutive_failures_and_fails_fast():
+    breaker = CircuitBreaker(KEY, failure_threshold=2, cooldown=60)
+    breaker.record_failure(OperationalError('timeout expired'))
+    breaker.before_call()
+    breaker.record_failure(OperationalError('timeout expired'))
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call(probe=lambda: pytest.fail('冷却期内不应探测'))
+    assert '熔断' in format_states([breaker.snapshot()])
+
+
+def test_half_open_probe():
+    breaker = CircuitBreaker(KEY, failure_threshold=1, cooldown=0.01)
+    breaker.record_failure(OperationalError('down'))
+    time.sleep(0.02)
+
+    def failing_probe():
+        raise OperationalError('still down')
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call(probe=failing_probe)
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    breaker.before_call(probe=lambda: None)
+    assert breaker.state == CLOSED and breaker.failures == 0
+
+
+def test_only_connection_errors_count():
+    assert is_connection_error(OperationalError('could not connect to server'), connecting=True)
+    assert is_connection_error(TimeoutError(), connecting=True)
+    assert is_connection_error(OperationalError('server closed the connection'), conn=ClosedConnection())
+    assert is_connection_error(OperationalError(2013, 'Lost connection to MySQL server during query'))
+    assert not is_connection_error(OperationalError('canceling statement due to statement timeout'))
+    # pymysql 连接没有 closed 属性，断开后 open 为 False
+    assert is_connection_error(OperationalError('lost connection'), conn=type('Conn', (), {'open': False})())
+    assert not is_connection_error(ValueError('syntax error'))
+
+
+def test_pool_timeout_not_counted(monkeypatch):
+    assert not is_connection_error(PoolTimeout('连接池已满'), connecting=True)
+
+    class FullPool:
+        def acquire(self):
+            raise PoolTimeout('连接池已满')
+
+    breaker = CircuitBreaker(KEY, failure_threshold=1)
+    monkeypatch.setattr(dbutils, 'breaker_for', lambda config: breaker)
+    monkeypatch.setattr(dbutils.db_pool, 'get_pool', lambda *args, **kwargs: FullPool())
+    monkeypatch.setattr(admission, 'acquire', lambda *args, **kwargs: None)
+    db = DBUtils({'host': KEY[0], 'port': KEY[1], 'name': KEY[2]}, company='wpg_sjs')
+    # 不包装为连接超时，熔断器不计数
+    with pytest.raises(PoolTimeout):
+        db.connect()
+    assert breaker.state == CLOSED and breaker.failures == 0
+
+
+def test_canceled_query_not_counted():
+    db = DBUtils({}, pooled=False, company='wpg_sjs')
+    db.breaker = CircuitBreaker(KEY, failure_threshold=1)
+    db.conn = object()
+    db._breaker_failure(QueryCanceled('canceling statement due to user request'))
+    assert db.breaker.state == CLOSED and db.breaker.failures == 0
+    db.conn = ClosedConnection()
+    db._breaker_failure(OperationalError('server closed the connection unexpectedly'))
+    assert db.breaker.state == OPEN
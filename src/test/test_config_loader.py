@@ -0,0 +1,50 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.ConfigLoader import ConfigLoader, get_config
+
+
+def test_shared_instance():
+    assert get_config() is get_config()
+    assert get_config().get('jobs.fetch_account_data.max_workers') is not None
+
+
+# 文件修改时间变化后整体替换快照
+def test_reload_if_changed(tmp_path):
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text('sms_api: http://a\njobs:\n  demo:\n    phones: "1"\n', encoding='utf-8')
+    config = ConfigLoader(str(config_file))
+    assert config.get('jobs.demo.phones') == '1'
+    assert config.get('jobs.demo.missing', 'x') == 'x'
+    old = config.snapshot()
+    assert not config.reload_if_changed()
+
+    config_file.write_text('sms_api: http://b\njobs:\n  demo:\n    phones: "2"\n', encoding='utf-8')
+    os.utime(config_file, (old.mtime + 10, old.mtime + 10))
+    assert config.reload_if_changed()
+    assert config.get_sms_api() == 'http://b'
+    assert config.get_config_by_job('demo') == {'phones': '2'}
+    # 旧快照保持不变
+    assert old.index['sms_api'] == 'http://a'
+
+
+# 运行范围内固定快照，运行中热更新不影响本次运行，派生线程复制上下文后读到同一份配置
+def test_run_snapshot_pins_config(tmp_path):
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text('jobs:\n  demo:\n    phones: "1"\n', encoding='utf-8')
+    config = ConfigLoader(str(config_file))
+    mtime = config.snapshot().mtime
+
+    def read():
+        return config.get_config_by_job('demo')['phones']
+
+    with config.run_snapshot():
+        config_file.write_text('jobs:\n  demo:\n    phones: "2"\n', encoding='utf-8')
+        os.utime(config_file, (mtime + 10, mtime + 10))
+        # 其它运行开始时重新加载
+        assert config.reload_if_changed()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(contextvars.copy_context().run, read).result() == '1'
+        assert read() == '1'
+    assert read() == '2'
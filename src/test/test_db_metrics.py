@@ -0,0 +1,23 @@
+from src.utils import db_metrics
+
+
+# 同一模板不同日期参数得到相同指纹
+def test_fingerprint_ignores_literals():
+    a = db_metrics.fingerprint("select count(*) from t_2025 where mr_month = '2025-09'")
+    b = db_metrics.fingerprint("SELECT count(*)  FROM t_2024 WHERE mr_month = '2024-09'")
+    assert a == b
+
+
+def test_run_stats_summary():
+    with db_metrics.run_stats('fetch_account') as run:
+        db_metrics.record(db_metrics.QueryRecord('query', company='ds_tz', fingerprint='abc',
+                                                 connect_ms=5, execute_ms=100, fetch_ms=1, rows=1, bytes=8))
+        db_metrics.record(db_metrics.QueryRecord('query', company='ds_tz', fingerprint='abc',
+                                                 execute_ms=50, rows=1, bytes=8))
+    [item] = run.snapshot()
+    assert item['pipeline'] == 'fetch_account'
+    assert item['calls'] == 2
+    assert item['execute_ms'] == 150
+    assert item['max_ms'] == 106
+    assert 'ds_tz' in run.format_table()
+    assert any(entry['pipeline'] == 'fetch_account' for entry in db_metrics.registry.snapshot())
@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+
+from src.utils.db_pool import ConnectionPool, is_broken, pool_key
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+        self.on_execute = None
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def execute(self, sql):
+                if conn.on_execute is not None:
+                    conn.on_execute()
+                if not conn.healthy:
+                    raise RuntimeError("server closed the connection")
+
+            def fetchall(self):
+                return [(1,)]
+
+            def close(self):
+                pass
+
+        return Cursor()
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_pool_key():
+    config = {'host': '172.16.14.90', 'port': 11032, 'user': 'wpg_read', 'name': 'wpg_2_tz'}
+    assert pool_key(config) == ('postgres', '172.16.14.90', 11032, 'wpg_2_tz', 'wpg_read')
+
+
+# 归还后的连接会被复用，健康检查失败的连接会被丢弃
+def test_pool_reuse_and_health_check():
+    created = []
+
+    def factory():
+        created.append(FakeConnection())
+        return created[-1]
+
+    pool = ConnectionPool('k', factory, max_size=2)
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    first.healthy = False
+    with pool.connection() as conn:
+        assert conn is not first
+    assert first.closed
+    assert len(created) == 2
+
+
+def test_pool_max_size():
+    pool = ConnectionPool('k', FakeConnection, max_size=1, acquire_timeout=0.1)
+    conn = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    # 其他线程归还后可以继续借出
+    threading.Timer(0.05, pool.release, args=(conn,)).start()
+    assert pool.acquire(timeout=1) is conn
+
+
+def test_pool_idle_eviction():
+    pool = ConnectionPool('k', FakeConnection, min_size=0, idle_timeout=0.01)
+    conn = pool.acquire()
+    pool.release(conn)
+    threading.Event().wait(0.05)
+    pool.evict_idle()
+    assert conn.closed
+    assert pool.size == 0
+
+
+# 健康检查期间连接记为借出，其它线程看到的连接数不会少算
+def test_health_check_keeps_connection_reserved():
+    pool = ConnectionPool('k', FakeConnection, max_size=1)
+    conn = pool.acquire()
+    pool.release(conn)
+    seen = []
+    conn.on_execute = lambda: seen.append((pool.size, id(conn) in pool._in_use))
+    assert pool.acquire() is conn
+    assert seen == [(1, True)]
+    pool.release(conn)
+
+    # 检查失败时移出借出记录并关闭，再新建连接
+    conn.healthy = False
+    other = pool.acquire()
+    assert other is not conn and conn.closed
+    assert pool.size == 1 and list(pool._in_use) == [id(other)]
+
+
+# pymysql 连接没有 closed 属性，断开后 open 为 False
+def test_is_broken_by_driver():
+    class MySQLConnection:
+        open = True
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            self.open = False
+
+    class AsyncpgConnection:
+        def is_closed(self):
+            return True
+
+    conn = MySQLConnection()
+    assert not is_broken(conn) and not is_broken(None)
+    conn.open = False
+    assert is_broken(conn) and is_broken(AsyncpgConnection())
+
+    pool = ConnectionPool('k', MySQLConnection, health_check=False)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.open = False
+            raise RuntimeError('Lost connection to MySQL server during query')
+    assert pool.size == 0
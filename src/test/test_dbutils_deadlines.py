@@ -0,0 +1,56 @@
+import pytest
+
+from src.utils import dbutils
+from src.utils.dbutils import DBUtils, QueryTimeout, deadlines, resolve_timeout
+
+
+class Canceled(Exception):
+    pgcode = '57014'
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = [('n',)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append(sql % params if params else sql)
+        if sql.startswith('SELECT pg_sleep'):
+            raise Canceled('canceling statement due to statement timeout')
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def test_resolve_timeout_takes_smallest(monkeypatch):
+    monkeypatch.setattr(dbutils, '_get_query_setting', lambda key: 600)
+    assert resolve_timeout('statement_timeout', {}) == 600
+    assert resolve_timeout('statement_timeout', {'statement_timeout': 120}) == 120
+    with deadlines(statement_timeout=30):
+        assert resolve_timeout('statement_timeout', {'statement_timeout': 120}) == 30
+
+
+def test_statement_timeout_set_and_canceled(monkeypatch):
+    monkeypatch.setattr(dbutils, '_get_query_setting',
+                        lambda key: None if key.endswith('timeout') else dbutils.DEFAULT_QUERY_SETTINGS[key])
+    db = DBUtils({'statement_timeout': 2}, pooled=False, company='ds_sjs')
+    db.conn = FakeConnection()
+    assert db.query('SELECT 1 AS n', memoize=False) == [{'n': 1}]
+    assert db.conn.executed[0] == 'SET LOCAL statement_timeout = 2000'
+    with pytest.raises(QueryTimeout) as info:
+        db.query('SELECT pg_sleep(10)', memoize=False)
+    assert info.value.company == 'ds_sjs' and info.value.stage == 'statement'
@@ -0,0 +1,93 @@
+import logging
+
+from src.utils import dbutils
+from src.utils.dbutils import DBUtils, summarize_rows
+
+ROWS = [(f'ds_{i}', i * 100) for i in range(5)]
+
+
+class FakeCursor:
+    def __init__(self, conn, name=None):
+        self.conn = conn
+        self.name = name
+        self.rows = list(ROWS)
+        self.closed = False
+        # 命名游标在第一次 fetch 之后才有 description
+        self.description = None if name else [('company',), ('hb_actual',)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def fetchmany(self, size):
+        self.conn.batches.append(size)
+        self.description = [('company',), ('hb_actual',)]
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cursors = []
+        self.batches = []
+
+    def cursor(self, name=None):
+        cursor = FakeCursor(self, name)
+        self.cursors.append(cursor)
+        return cursor
+
+
+def make_db(monkeypatch, **settings):
+    def setting(key):
+        if key.endswith('timeout'):
+            return None
+        return settings.get(key, dbutils.DEFAULT_QUERY_SETTINGS[key])
+
+    monkeypatch.setattr(dbutils, '_get_query_setting', setting)
+    db = DBUtils({}, pooled=False, company='ds_sjs')
+    db.conn = FakeConnection()
+    return db
+
+
+# 按 batch_size 分批拉取，每批转换为字典列表，结束后关闭命名游标
+def test_iter_query_batches(monkeypatch):
+    db = make_db(monkeypatch, itersize=3)
+    batches = list(db.iter_query('SELECT company, hb_actual FROM t', batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[0] == [{'company': 'ds_0', 'hb_actual': 0}, {'company': 'ds_1', 'hb_actual': 100}]
+    cursor = db.conn.cursors[-1]
+    assert cursor.name.startswith('dbutils_') and cursor.closed
+    assert db.conn.batches == [2, 2, 2, 2]
+    # 未指定 batch_size 时每次拉取 itersize 配置的行数
+    assert [len(batch) for batch in db.iter_query('SELECT company, hb_actual FROM t')] == [3, 2]
+    assert db.conn.batches[4:] == [3, 3, 3]
+
+
+def test_iter_rows_flattens_batches(monkeypatch):
+    db = make_db(monkeypatch, itersize=2)
+    rows = list(db.iter_rows('SELECT company, hb_actual FROM t'))
+    assert rows == [{'company': name, 'hb_actual': value} for name, value in ROWS]
+    assert list(db.iter_rows('SELECT company, hb_actual FROM t', fmt='tuple')) == ROWS
+
+
+# 结果日志只输出前 log_rows 行和总行数
+def test_result_log_is_capped(monkeypatch, caplog):
+    assert summarize_rows([1, 2], limit=2) == '[1, 2]'
+    assert summarize_rows([1, 2, 3], limit=2) == '[1, 2] ... 共 3 行'
+    db = make_db(monkeypatch, log_rows=2)
+    with caplog.at_level(logging.INFO, logger=dbutils.__name__):
+        assert len(db.query('SELECT company, hb_actual FROM t', memoize=False)) == 5
+    message = next(record.getMessage() for record in caplog.records if 'SQL执行结果' in record.getMessage())
+    assert message.endswith('... 共 5 行') and 'ds_2' not in message
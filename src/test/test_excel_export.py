@@ -0,0 +1,47 @@
+import csv
+
+import pytest
+
+from src.utils import excel_export
+
+
+class FakeDB:
+    """按批返回固定行的 DBUtils 替身"""
+
+    def __init__(self, config, company=None):
+        self.company = company
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_query(self, sql, params=None, batch_size=None, fmt='dict'):
+        if self.company == 'ds_bad':
+            raise RuntimeError('connection refused')
+        for start in range(0, 5, 2):
+            rows = [{'mr_month': '2025-09', 'seq': i} for i in range(start, min(start + 2, 5))]
+            yield [tuple(row.values()) for row in rows] if fmt == 'tuple' else rows
+
+
+def test_csv_export_one_file_per_company(tmp_path, monkeypatch):
+    monkeypatch.setattr(excel_export.dbutils, 'DBUtils', FakeDB)
+    counts = excel_export.export_detail(['ds_tz', 'ds_bad'], lambda company: {}, 'select 1', tmp_path / 'out',
+                                        fmt='csv', columns=['抄表月份', '序号'], sheet_name=str.upper)
+    assert counts == {'ds_tz': 5, 'ds_bad': 0}
+    with open(tmp_path / 'out' / 'DS_TZ.csv', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['抄表月份', '序号'] and rows[-1] == ['2025-09', '4']
+
+
+def test_xlsx_export_keeps_template_header(tmp_path, monkeypatch):
+    openpyxl = pytest.importorskip('openpyxl')
+    monkeypatch.setattr(excel_export.dbutils, 'DBUtils', FakeDB)
+    output = tmp_path / 'detail.xlsx'
+    excel_export.export_detail(['ds_tz'], lambda company: {}, 'select 1', output,
+                               template='工作日核对明细.xlsx', columns=['抄表月份', '序号'])
+    ws = openpyxl.load_workbook(output)['ds_tz']
+    assert ws['A1'].value == '工作日核对明细'
+    assert [ws['A2'].value, ws['B2'].value] == ['抄表月份', '序号']
+    assert ws.max_row == 7
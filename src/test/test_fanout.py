@@ -0,0 +1,36 @@
+import time
+
+from src.utils.fanout import run_by_company
+
+
+# 并发执行时结果顺序与分公司配置顺序一致
+def test_run_by_company_keeps_order():
+    delays = {'ds_a': 0.2, 'ds_b': 0.05, 'ds_c': 0.1}
+
+    def fetch(company):
+        time.sleep(delays[company])
+        return company
+
+    start = time.perf_counter()
+    res = run_by_company(list(delays), fetch, max_workers=3)
+    elapsed = time.perf_counter() - start
+    assert res == ['ds_a', 'ds_b', 'ds_c']
+    # 总耗时接近最慢的分公司，而不是所有分公司之和
+    assert elapsed < sum(delays.values())
+
+
+def test_run_by_company_sequential():
+    assert run_by_company(['ds_a', 'ds_b'], str.upper, max_workers=1) == ['DS_A', 'DS_B']
+    assert run_by_company([], str.upper) == []
+
+
+# 单个分公司失败时按 on_error 的结果返回，其余分公司不受影响
+def test_run_by_company_on_error():
+    def fetch(company):
+        if company == 'ds_b':
+            raise TimeoutError('timeout')
+        return company
+
+    res = run_by_company(['ds_a', 'ds_b', 'ds_c'], fetch, max_workers=3,
+                         on_error=lambda company, e: {'company': company, 'status': 'timeout'})
+    assert res == ['ds_a', {'company': 'ds_b', 'status': 'timeout'}, 'ds_c']
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent.parent.parent.resolve()
+# 应用启动导入耗时预算（微秒），可通过环境变量调整
+APP_IMPORT_BUDGET_US = int(os.environ.get("APP_IMPORT_BUDGET_US", 3_000_000))
+# 只应在任务运行时才导入的重量级依赖
+HEAVY_MODULES = {"openpyxl", "psycopg2", "pymysql", "requests", "dateutil", "numpy", "pandas"}
+
+
+def import_time(statement: str) -> dict:
+    """用 -X importtime 执行导入，返回 {模块名: 累计耗时(us)}"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT_DIR, capture_output=True, text=True,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    result = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        result[name.strip()] = int(cumulative)
+    return result
+
+
+def top_level(modules) -> set:
+    return {name.split(".")[0] for name in modules}
+
+
+# 工具模块导入时不应加载数据库驱动、requests 等重量级依赖
+def test_utils_import_is_light():
+    modules = import_time("import src.utils.dbutils, src.utils.metric_fetcher, src.sms.sms_client")
+    assert not top_level(modules) & HEAVY_MODULES
+
+
+def test_app_import_budget():
+    pytest.importorskip("plombery")
+    modules = import_time("import app")
+    # plombery 自身的依赖不计入，任务模块不能提前导入 Excel 和数据库驱动
+    assert not top_level(modules) & {"openpyxl", "psycopg2", "pymysql"}
+    assert modules["app"] < APP_IMPORT_BUDGET_US, f"app 导入耗时 {modules['app']}us 超出预算 {APP_IMPORT_BUDGET_US}us"
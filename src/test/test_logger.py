@@ -0,0 +1,49 @@
+import atexit
+import importlib
+import logging
+import queue
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def log_module(tmp_path_factory):
+    # 导入时在当前目录创建 logs/ 并挂载根日志处理器，测试中改到临时目录，结束后卸载
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp('logs'))
+        module = importlib.import_module('src.utils.logger')
+    yield module
+    logging.getLogger().removeHandler(module.queue_handler)
+    atexit.unregister(module.listener.stop)
+    module.listener.stop()
+
+
+def make_record(msg, *args):
+    return logging.LogRecord('test', logging.INFO, __file__, 1, msg, args, None)
+
+
+# 队列满时丢弃并计数，队列空出后补一条丢弃告警
+def test_dropping_queue_handler_counts_drops(log_module):
+    log_queue = queue.Queue(maxsize=2)
+    handler = log_module.DroppingQueueHandler(log_queue, max_length=20)
+    for i in range(5):
+        handler.handle(make_record('message %d', i))
+    assert handler.dropped == 3 and log_queue.qsize() == 2
+    assert [log_queue.get_nowait().getMessage() for _ in range(2)] == ['message 0', 'message 1']
+
+    handler.handle(make_record('x' * 50))
+    record = log_queue.get_nowait()
+    # 入队时已格式化并截断
+    assert record.getMessage() == 'x' * 20 + '...(已截断，共 50 字符)' and record.truncated
+    assert log_queue.get_nowait().getMessage() == '日志队列已满，丢弃 3 条日志（累计 3 条）'
+    assert log_queue.empty()
+
+
+def test_truncating_formatter(log_module):
+    formatter = log_module.TruncatingFormatter('%(levelname)s - %(message)s', max_length=10)
+    assert formatter.format(make_record('%s', 'y' * 30)) == 'INFO - ' + 'y' * 10 + '...(已截断，共 30 字符)'
+    assert formatter.format(make_record('short')) == 'INFO - short'
+    # 已在入队时截断的日志不再重复截断
+    record = make_record('z' * 30)
+    record.truncated = True
+    assert formatter.format(record) == 'INFO - ' + 'z' * 30
@@ -0,0 +1,34 @@
+from src.utils.metric_compiler import compile_metrics, map_result, render_metrics
+
+METRICS = [
+    {'name': 'hb_actual', 'label': '本周期户表出账(支)', 'table': 'water_revenue.water_meter_read',
+     'filter': "client_type = '1' and mr_enter_staff = '远传'"},
+    {'name': 'hb_expected', 'label': '本周期户表应出账(支)', 'table': 'water_revenue.water_meter_read',
+     'filter': "client_type = '1' and account_opening_plan = '1'"},
+    {'name': 'hb_previous', 'label': '上周期户表出账(支)', 'table': 'water_revenue.water_meter_read_his_{previous}',
+     'filter': "mr_month = '{previous_month}'"},
+]
+PARAMS = {'previous': 2025, 'previous_month': '2025-09'}
+
+
+# 每张表只出现一次，同表指标合并为 FILTER 聚合
+def test_compile_single_scan_per_table():
+    sql = compile_metrics(render_metrics(METRICS, PARAMS))
+    assert sql.count('FROM water_revenue.water_meter_read\n') == 1
+    assert sql.count('FROM water_revenue.water_meter_read_his_2025') == 1
+    assert "count(*) FILTER (WHERE client_type = '1' and mr_enter_staff = '远传') AS hb_actual" in sql
+    assert 'CROSS JOIN' in sql
+
+
+def test_compile_mysql_uses_case():
+    sql = compile_metrics(render_metrics(METRICS[:2], PARAMS), dialect='mysql')
+    assert 'FILTER' not in sql
+    assert 'sum(CASE WHEN' in sql
+
+
+def test_map_result_by_name():
+    metrics = render_metrics(METRICS, PARAMS)
+    data = map_result(metrics, [{'hb_previous': 3, 'hb_actual': 1}])
+    assert list(data) == ['本周期户表出账(支)', '本周期户表应出账(支)', '上周期户表出账(支)']
+    assert data['本周期户表应出账(支)'] == -1
+    assert data['上周期户表出账(支)'] == 3
@@ -0,0 +1,46 @@
+import datetime
+
+from src.utils import metric_fetcher
+from src.utils.metric_history import MetricHistory, shift_months
+
+
+def test_shift_months_clamps_to_month_end():
+    assert shift_months(datetime.date(2025, 3, 31), -1) == datetime.date(2025, 2, 28)
+    assert shift_months(datetime.date(2025, 1, 15), -1) == datetime.date(2024, 12, 15)
+    assert shift_months(datetime.date(2024, 2, 29), -12) == datetime.date(2023, 2, 28)
+
+
+def test_series_and_compare(tmp_path):
+    history = MetricHistory(tmp_path / 'history.db')
+    history.record('ds_dx', {'hb_actual': 100, 'hb_expected': -1}, run_date='2024-10-05')
+    history.record('ds_dx', {'hb_actual': 150}, run_date='2025-09-03')
+    history.record('ds_dx', {'hb_actual': 180}, run_date='2025-10-05')
+    history.record('ds_dx', {'hb_actual': 200}, run_date='2025-10-05')
+
+    assert history.series('ds_dx', 'hb_actual', '2025-09-01', '2025-10-31') == [('2025-09-03', 150), ('2025-10-05', 200)]
+    assert history.series('ds_dx', 'hb_expected') == []
+
+    item = history.compare('hb_actual', '2025-10-05')['ds_dx']
+    # 上月 5 日没有记录时取同月此前最近一次（9 月 3 日）
+    assert (item['current'], item['mom'], item['mom_delta'], item['yoy']) == (200, 150, 50, 100)
+    assert item['yoy_ratio'] == 2.0
+
+
+def test_fetch_metrics_reads_comparison_from_history(tmp_path):
+    history = MetricHistory(tmp_path / 'history.db')
+    last_month = shift_months(datetime.date.today(), -1)
+    history.record('ds_dx', {'hb_actual': 120}, run_date=last_month)
+    metrics = [{'name': 'hb_previous', 'table': 't', 'from_history': {'metric': 'hb_actual', 'offset': 'month'}}]
+    # 全部指标命中本地历史时不连接数据库
+    assert metric_fetcher.fetch_metrics('ds_dx', {}, metrics, history=history) == {'hb_previous': 120}
+    assert history.series('ds_dx', 'hb_previous') == [(datetime.date.today().isoformat(), 120)]
+
+
+# 每小时巡检只读历史，不覆盖当天的日样本
+def test_fetch_metrics_lookup_only(tmp_path):
+    history = MetricHistory(tmp_path / 'history.db')
+    last_month = shift_months(datetime.date.today(), -1)
+    history.record('ds_dx', {'hb_actual': 120}, run_date=last_month)
+    metrics = [{'name': 'hb_previous', 'table': 't', 'from_history': {'metric': 'hb_actual', 'offset': 'month'}}]
+    assert metric_fetcher.fetch_metrics('ds_dx', {}, metrics, history=history, record=False) == {'hb_previous': 120}
+    assert history.series('ds_dx', 'hb_previous') == []
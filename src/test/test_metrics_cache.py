@@ -0,0 +1,23 @@
+from src.utils.metrics_cache import MetricsCache
+
+METRICS = [
+    {'name': 'hb_actual', 'table': 'water_revenue.water_meter_read', 'filter': "client_type = '1'"},
+    {'name': 'hb_previous', 'table': 'water_revenue.water_meter_read_his_2025',
+     'filter': "mr_month = '2025-09' and mr_input_time <= '2025-09-30'", 'period': '2025-09', 'cutoff': '2025-09-30'},
+]
+
+
+# 只缓存已关账周期的指标，失效后重新查询
+def test_closed_period_cache(tmp_path):
+    cache = MetricsCache(tmp_path / 'metrics_cache.db')
+    cache.store('ds_tz', METRICS, {'hb_actual': 10, 'hb_previous': 20})
+    assert cache.lookup('ds_tz', METRICS) == {'hb_previous': 20}
+    assert cache.lookup('ds_my', METRICS) == {}
+
+    # 截止条件不同视为不同的 key
+    other_cutoff = [dict(METRICS[1], cutoff='2025-09-29')]
+    assert cache.lookup('ds_tz', other_cutoff) == {}
+
+    assert cache.invalidate(period='2025-09') == 1
+    assert cache.lookup('ds_tz', METRICS) == {}
+    cache.close()
@@ -0,0 +1,50 @@
+import sqlite3
+
+from src.utils import progress_monitor
+from src.utils.progress_monitor import ProgressMonitor, ProgressStore
+
+METRICS = [{'name': 'hb_actual', 'filter': "client_type = '1'"}, {'name': 'dlb_actual', 'filter': "client_type = '2'"}]
+
+
+class SqliteDB:
+    """用 SQLite 充当分公司库的 DBUtils 替身"""
+
+    def __init__(self, config, company=None):
+        self.conn = config['conn']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def query(self, sql, params=None, memoize=True):
+        cursor = self.conn.execute(sql)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def test_incremental_counts_and_reconcile(tmp_path, monkeypatch):
+    monkeypatch.setattr(progress_monitor.dbutils, 'DBUtils', SqliteDB)
+    branch = sqlite3.connect(':memory:')
+    branch.execute('CREATE TABLE wmr (client_type TEXT, mr_input_time TEXT)')
+    branch.executemany('INSERT INTO wmr VALUES (?, ?)',
+                       [('1', '2025-10-03 08:00:00'), ('2', '2025-10-03 08:05:00'), ('1', '2025-10-03 08:10:00')])
+    db_config = {'type': 'pg', 'conn': branch}
+    monitor = ProgressMonitor(ProgressStore(tmp_path / 'progress.db'), METRICS, table='wmr', reconcile_interval=3600)
+
+    result = monitor.update('ds_dx', db_config, period='2025-10', now=1000)
+    assert result['mode'] == 'full'
+    assert result['totals'] == {'hb_actual': 2, 'dlb_actual': 1}
+
+    branch.executemany('INSERT INTO wmr VALUES (?, ?)', [('1', '2025-10-03 09:00:00'), ('2', '2025-10-03 09:01:00')])
+    result = monitor.update('ds_dx', db_config, period='2025-10', now=1300)
+    assert result['mode'] == 'incremental'
+    assert result['totals'] == {'hb_actual': 3, 'dlb_actual': 2}
+    assert result['watermark'] == '2025-10-03 09:01:00'
+
+    # 高水位之前的迟到数据只有全量核对才能修正
+    branch.execute("INSERT INTO wmr VALUES ('1', '2025-10-03 07:00:00')")
+    assert monitor.update('ds_dx', db_config, period='2025-10', now=1600)['totals']['hb_actual'] == 3
+    result = monitor.update('ds_dx', db_config, period='2025-10', now=5000)
+    assert result['mode'] == 'full' and result['totals']['hb_actual'] == 4
@@ -0,0 +1,36 @@
+from src.utils.fanout import run_by_company
+from src.utils.query_memo import QueryMemo, current_memo, dsn_key, run_scope
+
+
+# ds_my 与 ds_tz 指向同一个物理库
+def test_dsn_key_alias():
+    ds_tz = {'host': '172.16.14.90', 'port': 11032, 'user': 'wpg_read', 'name': 'wpg_2_tz'}
+    ds_my = {'host': '172.16.14.90 ', 'port': '11032', 'user': 'wpg_read', 'name': 'wpg_2_tz'}
+    assert dsn_key(ds_tz) == dsn_key(ds_my)
+
+
+def test_memo_shared_across_fanout():
+    calls = []
+
+    def fetch(company):
+        return current_memo().get_or_compute(('wpg_2_tz', 'select 1'), lambda: calls.append(company) or len(calls))
+
+    with run_scope() as memo:
+        res = run_by_company(['ds_tz', 'ds_my', 'ds_tz'], fetch, max_workers=3)
+    assert res == [1, 1, 1]
+    assert len(calls) == 1
+    assert memo.hits == 2
+    assert current_memo() is None
+
+
+def test_memo_does_not_cache_errors():
+    memo = QueryMemo()
+
+    def fail():
+        raise RuntimeError('timeout')
+
+    try:
+        memo.get_or_compute('k', fail)
+    except RuntimeError:
+        pass
+    assert memo.get_or_compute('k', lambda: 'ok') == 'ok'
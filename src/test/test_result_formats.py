@@ -0,0 +1,63 @@
+import array
+
+import pytest
+
+from src.utils import dbutils
+from src.utils.dbutils import DBUtils, convert_rows
+
+COLUMNS = ['company', 'hb_actual', 'ratio']
+ROWS = [('ds_sjs', 139930, 0.98), ('ds_cxd', 88120, 0.95), ('ds_mtg', 1024, None)]
+
+
+class FakeCursor:
+    description = [(name,) for name in COLUMNS]
+
+    def __init__(self):
+        self.rows = list(ROWS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+
+def test_convert_rows_formats():
+    assert convert_rows(COLUMNS, ROWS, 'tuple') == ROWS
+    row = convert_rows(COLUMNS, ROWS, 'row')[0]
+    assert (row.company, row.hb_actual) == ('ds_sjs', 139930) and tuple(row) == ROWS[0]
+    columns = convert_rows(COLUMNS, ROWS, 'columns')
+    assert columns['hb_actual'] == array.array('q', [139930, 88120, 1024])
+    # 含空值的列保留为 list
+    assert columns['ratio'] == [0.98, 0.95, None]
+
+
+def test_query_columnar_in_batches(monkeypatch):
+    monkeypatch.setattr(dbutils, '_get_query_setting',
+                        lambda key: None if key.endswith('timeout') else 2 if key == 'itersize'
+                        else dbutils.DEFAULT_QUERY_SETTINGS[key])
+    db = DBUtils({}, pooled=False, company='ds_sjs')
+    db.conn = FakeConnection()
+    result = db.query('SELECT company, hb_actual, ratio FROM t', memoize=False, fmt='columns')
+    assert list(result['company']) == ['ds_sjs', 'ds_cxd', 'ds_mtg']
+    np = pytest.importorskip('numpy')
+    result = db.query('SELECT company, hb_actual, ratio FROM t', memoize=False, fmt='numpy')
+    assert result['hb_actual'].dtype == np.int64 and result['hb_actual'].sum() == 229074
+    with pytest.raises(ValueError):
+        db.query('SELECT 1', fmt='pandas')
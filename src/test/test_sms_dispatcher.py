@@ -0,0 +1,100 @@
+from src.sms.dispatcher import FAILED, UNKNOWN, SMSDispatcher, parse_response
+
+
+# 与 requests / urllib3 / http.client 异常同名：ConnectTimeout、NewConnectionError 时请求未发出，其余可能已发出
+class ConnectTimeout(ConnectionError):
+    pass
+
+
+class ReadTimeout(OSError):
+    pass
+
+
+class NewConnectionError(OSError):
+    pass
+
+
+class MaxRetryError(Exception):
+    def __init__(self, reason):
+        super().__init__(f'Max retries exceeded (Caused by {reason!r})')
+        self.reason = reason
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class RemoteDisconnected(ConnectionResetError):
+    pass
+
+
+class FakeResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.payloads = []
+
+    def post(self, url, json=None, timeout=None):
+        self.payloads.append(json)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_parse_response():
+    assert parse_response(200, 'success')[0]
+    assert parse_response(200, '{"code": 200, "msg": "ok"}')[0]
+    assert not parse_response(200, '{"code": 500, "msg": "余额不足"}')[0]
+    assert not parse_response(502, 'Bad Gateway')[0]
+
+
+# 同一次运行的短信合并为 batchSend 请求，按 batch_size 切分
+def test_batch_merges_messages():
+    session = FakeSession([FakeResponse(200, 'success'), FakeResponse(200, 'success')])
+    dispatcher = SMSDispatcher('http://sms', batch_size=2, session=session)
+    with dispatcher.batch() as sms:
+        for i in range(3):
+            sms.enqueue('13800000000', f'msg{i}')
+    assert [len(payload) for payload in session.payloads] == [2, 1]
+
+
+def test_retry_on_server_error_only():
+    refused = ConnectionError(MaxRetryError(NewConnectionError('Failed to establish a new connection')))
+    session = FakeSession([refused, FakeResponse(503, ''), FakeResponse(200, 'success')])
+    dispatcher = SMSDispatcher('http://sms', max_retries=2, backoff=0, session=session)
+    assert dispatcher.send([{'phones': '1', 'content': 'x'}])
+    assert len(session.payloads) == 3
+
+    session = FakeSession([FakeResponse(400, 'bad request')])
+    dispatcher = SMSDispatcher('http://sms', max_retries=2, backoff=0, session=session)
+    assert not dispatcher.send([{'phones': '1', 'content': 'x'}])
+    assert len(session.payloads) == 1
+
+
+# 读超时时网关可能已发出短信，batchSend 不幂等，不重发
+def test_read_timeout_is_unknown_and_not_retried():
+    session = FakeSession([ConnectTimeout('connect timed out'), ReadTimeout('read timed out')])
+    dispatcher = SMSDispatcher('http://sms', max_retries=2, backoff=0, session=session)
+    assert dispatcher.deliver([{'phones': '1', 'content': 'x'}]) == UNKNOWN
+    assert len(session.payloads) == 2
+
+    session = FakeSession([ConnectTimeout('connect timed out')] * 3)
+    dispatcher = SMSDispatcher('http://sms', max_retries=2, backoff=0, session=session)
+    assert dispatcher.deliver([{'phones': '1', 'content': 'x'}]) == FAILED
+    assert len(session.payloads) == 3
+
+
+# 连接被对端中断时请求体可能已经写出（复用失效的 keep-alive 连接），不重发
+def test_connection_aborted_is_not_retried():
+    aborted = ConnectionError(ProtocolError('Connection aborted.', RemoteDisconnected('Remote end closed connection')))
+    for error in (aborted, ConnectionResetError('Connection reset by peer')):
+        session = FakeSession([error, FakeResponse(200, 'success')])
+        dispatcher = SMSDispatcher('http://sms', max_retries=2, backoff=0, session=session)
+        assert dispatcher.deliver([{'phones': '1', 'content': 'x'}]) == UNKNOWN
+        assert len(session.payloads) == 1
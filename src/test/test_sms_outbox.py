@@ -0,0 +1,105 @@
+import time
+
+from src.sms.dispatcher import SMSDispatcher
+from src.sms.outbox import EXPIRED, PENDING, SENT, UNKNOWN, DeliveryWorker, SMSOutbox
+from src.sms.sms_client import SMSClient
+from src.test.test_sms_dispatcher import FakeResponse, FakeSession, ReadTimeout
+
+
+# 失败的短信留在发件箱，新的 worker（模拟重启）会补发
+def test_pending_messages_survive_restart(tmp_path):
+    path = tmp_path / 'outbox.db'
+    session = FakeSession([FakeResponse(503, '')])
+    dispatcher = SMSDispatcher('http://sms', max_retries=0, session=session)
+    worker = DeliveryWorker(dispatcher, SMSOutbox(path))
+    first = worker.outbox.add('http://sms', '1', 'a', time.time() + 60)
+    second = worker.outbox.add('http://sms', '1', 'b', time.time() + 60)
+    assert worker.deliver_pending() == 0
+    assert worker.outbox.status(first) == PENDING
+    worker.outbox.close()
+
+    session = FakeSession([FakeResponse(200, 'success')])
+    dispatcher = SMSDispatcher('http://sms', session=session)
+    worker = DeliveryWorker(dispatcher, SMSOutbox(path))
+    assert worker.deliver_pending() == 2
+    assert [len(payload) for payload in session.payloads] == [2]
+    assert worker.outbox.status(second) == SENT
+
+
+def test_expired_messages_are_not_sent(tmp_path):
+    session = FakeSession([])
+    worker = DeliveryWorker(SMSDispatcher('http://sms', session=session), SMSOutbox(tmp_path / 'outbox.db'))
+    message_id = worker.outbox.add('http://sms', '1', 'late', time.time() - 1)
+    assert worker.deliver_pending() == 0
+    assert worker.outbox.status(message_id) == EXPIRED
+    assert session.payloads == []
+
+
+def test_enqueue_returns_before_delivery(tmp_path):
+    session = FakeSession([FakeResponse(200, 'success')])
+    worker = DeliveryWorker(SMSDispatcher('http://sms', session=session), SMSOutbox(tmp_path / 'outbox.db'),
+                            linger=0)
+    message_id = worker.enqueue('1', 'hello', deadline=5)
+    for _ in range(100):
+        if worker.outbox.status(message_id) == SENT:
+            break
+        time.sleep(0.02)
+    worker.stop(timeout=1)
+    assert worker.outbox.status(message_id) == SENT
+
+
+# 重启前已过原截止时间的短信按 recovery_deadline 重新计算截止时间，仍然补发
+def test_recovered_messages_get_fresh_deadline(tmp_path):
+    path = tmp_path / 'outbox.db'
+    outbox = SMSOutbox(path)
+    message_id = outbox.add('http://sms', '1', 'left over', time.time() - 1)
+    outbox.close()
+
+    session = FakeSession([FakeResponse(200, 'success')])
+    worker = DeliveryWorker(SMSDispatcher('http://sms', session=session), SMSOutbox(path), recovery_deadline=60)
+    assert worker.recover() == 1
+    assert worker.deliver_pending() == 1
+    assert worker.outbox.status(message_id) == SENT
+
+
+# 结果未知的短信不留在 pending 中，下一轮不会重发
+def test_read_timeout_marks_unknown(tmp_path):
+    session = FakeSession([ReadTimeout('read timed out')])
+    worker = DeliveryWorker(SMSDispatcher('http://sms', session=session), SMSOutbox(tmp_path / 'outbox.db'))
+    message_id = worker.outbox.add('http://sms', '1', 'maybe sent', time.time() + 60)
+    assert worker.deliver_pending() == 0
+    assert worker.outbox.status(message_id) == UNKNOWN
+    assert worker.deliver_pending() == 0
+    assert len(session.payloads) == 1
+
+
+# 入队超过 recovery_max_age 的遗留短信视为过时告警，不再补发
+def test_stale_messages_not_recovered(tmp_path):
+    path = tmp_path / 'outbox.db'
+    outbox = SMSOutbox(path)
+    stale = outbox.add('http://sms', '1', 'stale', time.time() + 60)
+    fresh = outbox.add('http://sms', '1', 'fresh', time.time() - 1)
+    outbox._conn.execute('UPDATE sms_outbox SET created_at = created_at - 7200 WHERE id = ?', (stale,))
+    outbox._conn.commit()
+    outbox.close()
+
+    session = FakeSession([FakeResponse(200, 'success')])
+    worker = DeliveryWorker(SMSDispatcher('http://sms', session=session), SMSOutbox(path),
+                            recovery_deadline=60, recovery_max_age=3600)
+    assert worker.recover() == 1
+    assert worker.outbox.status(stale) == EXPIRED
+    assert worker.deliver_pending() == 1
+    assert worker.outbox.status(fresh) == SENT
+    assert [item['content'] for item in session.payloads[0]] == ['fresh']
+
+
+# 服务启动时只在有遗留短信时启动投递线程
+def test_resume_pending_only_with_leftovers(tmp_path):
+    path = tmp_path / 'outbox.db'
+    client = SMSClient('http://sms', outbox_settings={'path': str(path)})
+    assert not client.resume_pending()
+    assert client.delivery._thread is None
+
+    client.delivery.outbox.add('http://sms', '1', 'left over', time.time() + 60)
+    client.delivery.start = lambda: None
+    assert client.resume_pending()
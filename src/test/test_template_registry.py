@@ -0,0 +1,30 @@
+import pytest
+
+from src.utils import template_registry
+
+pytest.importorskip('openpyxl')
+
+
+def test_template_parsed_once_and_indexed():
+    registry = template_registry.TemplateRegistry()
+    template = registry.get('远传表出账明细.xlsx')
+    assert registry.get('远传表出账明细.xlsx') is template
+    assert template.row_of('类目') == 2
+    assert template.row_of('本周期户表应出账') == 3
+
+
+def test_report_rows_follow_template_order():
+    template = template_registry.get_template('远传表出账明细.xlsx')
+    metrics = [
+        {'name': 'hb_actual', 'label': '本周期户表出账(支)', 'row': '本周期户表实际出账'},
+        {'name': 'extra', 'label': '其它'},
+        {'name': 'hb_expected', 'label': '本周期户表应出账(支)', 'row': '本周期户表应出账'},
+    ]
+    rows = template_registry.report_rows(template, metrics)
+    assert [(row.name, row.row) for row in rows] == [('hb_expected', 3), ('hb_actual', 4), ('extra', None)]
+    data = {'本周期户表出账(支)': 10, '本周期户表应出账(支)': 12, '其它': 1}
+    assert template_registry.format_values(rows, data) == '本周期户表应出账(支): 12, 本周期户表出账(支): 10, 其它: 1'
+
+    wb, ws = template.new_workbook()
+    assert ws['A3'].value == '本周期户表应出账'
+    assert 'A1:F1' in {str(cell_range) for cell_range in ws.merged_cells.ranges}
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from src.utils.xxljob_client import XxlJobClient, XxlJobError, XxlJobLoginError
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self.body
+
+
+class FakeXxlSession:
+    """模拟 XXL-Job 管理端：每个执行器 total 条任务，会话失效时 pageList 返回 302"""
+
+    def __init__(self, total, expire_after=None):
+        self.total = total
+        self.expire_after = expire_after
+        self.logins = 0
+        self.pages = 0
+        self.cookies = []
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, timeout=None, allow_redirects=True):
+        with self._lock:
+            if url == 'login':
+                self.logins += 1
+                return FakeResponse(200, {'code': 200})
+            self.pages += 1
+            if self.expire_after is not None and self.pages == self.expire_after:
+                return FakeResponse(302)
+        group, start, length = data['jobGroup'], data['start'], data['length']
+        ids = range(start, min(start + length, self.total))
+        return FakeResponse(200, {'recordsTotal': self.total, 'data': [{'id': (group, i)} for i in ids]})
+
+
+def test_fetch_all_pages_with_single_login():
+    session = FakeXxlSession(total=250)
+    client = XxlJobClient('login', 'page', page_size=100, session=session)
+    result = client.fetch_groups({'dlb': {'jobGroup': 38}, 'hb': {'jobGroup': 35}})
+    assert [job['id'] for job in result['dlb']] == [(38, i) for i in range(250)]
+    assert len(result['hb']) == 250
+    assert session.logins == 1
+    assert session.pages == 6
+
+
+def test_relogin_on_redirect():
+    session = FakeXxlSession(total=10, expire_after=1)
+    client = XxlJobClient('login', 'page', session=session)
+    assert len(client.fetch_jobs({'jobGroup': 38})) == 10
+    assert session.logins == 2
+
+
+class UnreachableSession(FakeXxlSession):
+    """登录成功，pageList 网络不可达"""
+
+    def post(self, url, data=None, timeout=None, allow_redirects=True):
+        if url == 'login':
+            return super().post(url, data, timeout, allow_redirects)
+        raise ConnectionError('connection refused')
+
+
+def test_network_error_reported_per_group():
+    client = XxlJobClient('login', 'page', session=UnreachableSession(total=10))
+    result = client.fetch_groups({'dlb': {'jobGroup': 38}})
+    assert isinstance(result['dlb'], XxlJobError)
+    assert '获取任务列表失败' in str(result['dlb'])
+
+    assert not isinstance(result['dlb'], XxlJobLoginError)
+
+
+# 账号密码错误与 pageList 不可达区分开
+def test_login_failure_raised_separately():
+    class BadCredentials(FakeXxlSession):
+        def post(self, url, data=None, timeout=None, allow_redirects=True):
+            return FakeResponse(200, {'code': 500, 'msg': '账号或密码错误'})
+
+    client = XxlJobClient('login', 'page', session=BadCredentials(total=10))
+    with pytest.raises(XxlJobLoginError, match='账号或密码错误'):
+        client.fetch_groups({'dlb': {'jobGroup': 38}})
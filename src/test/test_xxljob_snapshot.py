@@ -0,0 +1,28 @@
+from src.utils.xxljob_snapshot import SnapshotStore, canonical_param, job_hash, spec_hash
+
+
+def test_canonical_param_tolerates_bare_keys_and_whitespace():
+    assert canonical_param('{0:["02180201", "02170201"]}') == canonical_param('{"0":["02180201","02170201"]}')
+    assert canonical_param('{"1":["a"],"0":["b"]}') == canonical_param('{"0":["b"], "1":["a"]}')
+    assert canonical_param('not json') == 'notjson'
+
+
+def test_job_hash_matches_spec():
+    spec = {'expected_cron': '0 0 7 1-5 * ?', 'expected_param': '{"2":["02150201"]}'}
+    job = {'id': 1, 'scheduleConf': '0 0 7  1-5 * ?\n', 'executorParam': '{ "2": ["02150201"] }', 'triggerStatus': 1}
+    assert job_hash(job) == spec_hash(spec)
+    assert job_hash(dict(job, triggerStatus=0)) != spec_hash(spec)
+
+
+def test_snapshot_diff(tmp_path):
+    store = SnapshotStore(tmp_path / 'snapshot.db')
+    jobs = [{'id': 1, 'scheduleConf': '0 0 7 * * ?', 'executorParam': '{}', 'triggerStatus': 1},
+            {'id': 2, 'scheduleConf': '0 0 6 * * ?', 'executorParam': '{}', 'triggerStatus': 1}]
+    diff = store.save('dlb', jobs)
+    assert diff['first'] and diff['changed'] == {1, 2}
+
+    assert store.save('dlb', jobs)['changed'] == set()
+
+    jobs = [dict(jobs[0], triggerStatus=0)]
+    diff = store.save('dlb', jobs)
+    assert diff['changed'] == {1} and diff['removed'] == {2}
@@ -1,16 +1,41 @@
 # utils/config.py
+import contextvars
 import logging
+import threading
 
-import yaml
+from contextlib import contextmanager
 from pathlib import Path
 
+
+class ConfigSnapshot:
+    """一次解析得到的配置快照，附带扁平化的 a.b.c 路径索引，创建后不再修改"""
+
+    def __init__(self, data: dict, mtime: float):
+        self.data = data or {}
+        self.mtime = mtime
+        self.index = {}
+        self._flatten(self.data, "")
+
+    def _flatten(self, node, prefix):
+        if not isinstance(node, dict):
+            return
+        for key, value in node.items():
+            path = f"{prefix}{key}"
+            self.index[path] = value
+            self._flatten(value, path + ".")
+
+
 class ConfigLoader:
     def __init__(self, config_file: str = "config.yaml"):
         # 根目录路径
         self.root_dir = Path(__file__).parent.parent.resolve()
         # 始终去根目录找 config 文件
         self.config_file = self._find_config(config_file)
-        self._config = self._load_config()
+        # 首次访问时才解析 yaml
+        self._snapshot = None
+        self._lock = threading.Lock()
+        # 任务运行期间固定使用的快照，由 run_snapshot() 设置；fanout / async_db 派生的线程和协程复制上下文后同样可见
+        self._pinned = contextvars.ContextVar(f"config_snapshot:{config_file}", default=None)
         self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
 
 
@@ -24,31 +49,96 @@ class ConfigLoader:
         else:
             raise FileNotFoundError(f"配置文件 {filename} 在根目录 {self.root_dir} 未找到")
 
-    def _load_config(self) -> dict:
+    def _load_config(self) -> ConfigSnapshot:
         if not self.config_file.exists():
             raise FileNotFoundError(f"配置文件 {self.config_file} 不存在")
+        import yaml
+
+        mtime = self.config_file.stat().st_mtime
         with open(self.config_file, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+            return ConfigSnapshot(yaml.safe_load(f), mtime)
+
+    def snapshot(self) -> ConfigSnapshot:
+        """当前配置快照，首次调用时加载；在 run_snapshot() 内返回本次运行固定的快照"""
+        pinned = self._pinned.get()
+        return pinned if pinned is not None else self._shared_snapshot()
+
+    def _shared_snapshot(self) -> ConfigSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load_config()
+                snapshot = self._snapshot
+        return snapshot
+
+    @property
+    def _config(self) -> dict:
+        return self.snapshot().data
+
+    def reload_if_changed(self) -> bool:
+        """
+        配置文件修改时间变化时重新加载，并整体替换进程内共享的快照（引用赋值，读取方不会看到半更新的配置）。
+        替换对所有线程立即生效，并发中的其它运行随后读到的是新配置；需要同一次运行内配置一致时使用 run_snapshot()。
+        """
+        snapshot = self._shared_snapshot()
+        try:
+            mtime = self.config_file.stat().st_mtime
+        except OSError:
+            return False
+        if mtime == snapshot.mtime:
+            return False
+        with self._lock:
+            if self._snapshot is not snapshot:
+                return True
+            try:
+                self._snapshot = self._load_config()
+            except Exception as e:
+                self.logger.error("重新加载配置文件 %s 失败，继续使用旧配置: %s", self.config_file, e)
+                return False
+        self.logger.info("配置文件 %s 已变更，重新加载完成", self.config_file)
+        return True
+
+    @contextmanager
+    def run_snapshot(self):
+        """
+        任务运行范围：开始时按需重新加载，with 块内（也可作为任务函数的装饰器）所有读取都使用这一份快照，
+        运行中配置文件再次热更新不影响本次运行，下一次运行生效
+        """
+        self.reload_if_changed()
+        token = self._pinned.set(self._shared_snapshot())
+        try:
+            yield
+        finally:
+            self._pinned.reset(token)
 
     def get_database(self,company) -> dict:
         """获取指定分公司名称对应的数据库配置"""
-        return self._config["database"][company]
+        return self.snapshot().index[f"database.{company}"]
 
     def get_sms_api(self) -> dict:
         """获取短信发送的api"""
-        return self._config["sms_api"]
+        return self.snapshot().index["sms_api"]
 
     def get_config_by_job(self,job_name) -> dict:
-        config = self._config["jobs"]
-        return config[job_name]
+        return self.snapshot().index[f"jobs.{job_name}"]
 
     def get(self, key: str, default=None):
         """支持通过 a.b.c 获取配置"""
-        keys = key.split(".")
-        value = self._config
-        try:
-            for k in keys:
-                value = value[k]
-            return value
-        except (KeyError, TypeError):
-            return default
+        return self.snapshot().index.get(key, default)
+
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+
+def get_config(config_file: str = "config.yaml") -> ConfigLoader:
+    """进程内共享的配置实例，所有任务模块共用同一份解析结果"""
+    loader = _loaders.get(config_file)
+    if loader is None:
+        with _loaders_lock:
+            loader = _loaders.get(config_file)
+            if loader is None:
+                loader = ConfigLoader(config_file)
+                _loaders[config_file] = loader
+    return loader
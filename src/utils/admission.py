@@ -0,0 +1,178 @@
+# utils/admission.py
+"""
+    跨任务的资源准入控制：多个 pipeline 同时触发（定时触发重叠、界面手动触发）时，
+    按资源限制同时访问同一服务器的并发数，超出限制的请求按先来先到排队。
+    - 数据库主机 db:<host>:<port>：DBUtils 借出连接时占用一个名额，close() 时归还
+    - 外部服务 service:<name>：XXL-Job 管理端（xxl_job）、短信网关（sms）每次 HTTP 请求占用一个名额
+    排队超过 queue_timeout 秒抛出 AdmissionTimeout。
+    register_pipeline() 包装 plombery 的同名函数，为定时触发加随机延迟（jitter），错开同一时刻触发的任务。
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from src.utils import db_metrics
+from src.utils.ConfigLoader import get_config
+
+# 准入控制默认参数，可在 config.yaml 的 admission 节点覆盖
+DEFAULT_ADMISSION_SETTINGS = {
+    "enabled": True,
+    "db_host_limit": 6,     # 同一数据库主机 (host:port) 同时占用的连接数，为空不限制
+    "db_hosts": {},         # 单独配置的主机 {"host:port": 名额}
+    "services": {},         # 外部服务名额 {xxl_job: 4, sms: 2}
+    "queue_timeout": 300,   # 排队最长秒数
+    "jitter": {},           # 定时触发随机延迟秒数 {pipeline id: 秒}
+}
+# 排队超过该秒数时写入任务日志
+_LOG_WAIT_SECONDS = 1.0
+
+default_logger = logging.getLogger(__name__)
+
+
+class AdmissionTimeout(TimeoutError):
+    """排队等待资源名额超时"""
+
+    def __init__(self, resource, waited):
+        super().__init__(f"资源 {resource} 排队 {waited:.0f}s 仍未获得名额")
+        self.resource = resource
+        self.waited = waited
+
+
+class Limiter:
+    """先来先到的计数信号量：有人排队时新请求不插队"""
+
+    def __init__(self, resource, limit):
+        self.resource = resource
+        self.limit = int(limit)
+        self.active = 0
+        self._waiters = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def acquire(self, timeout=None) -> float:
+        """获得一个名额，返回排队秒数"""
+        with self._cond:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return 0.0
+            ticket = object()
+            self._waiters.append(ticket)
+            start = time.monotonic()
+            try:
+                while not (self._waiters[0] is ticket and self.active < self.limit):
+                    remaining = None if timeout is None else start + timeout - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise AdmissionTimeout(self.resource, time.monotonic() - start)
+                    self._cond.wait(remaining)
+                self._waiters.popleft()
+                self.active += 1
+                return time.monotonic() - start
+            finally:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                # 队首变化，唤醒其它排队者重新检查
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.active = max(self.active - 1, 0)
+            self._cond.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_settings() -> dict:
+    settings = dict(DEFAULT_ADMISSION_SETTINGS)
+    settings.update({k: v for k, v in (get_config().get("admission", {}) or {}).items() if v is not None})
+    return settings
+
+
+def db_resource(db_config: dict) -> str:
+    return f"db:{db_config.get('host')}:{db_config.get('port')}"
+
+
+def _limit_of(resource: str, settings: dict):
+    kind, _, name = resource.partition(":")
+    if kind == "db":
+        return (settings["db_hosts"] or {}).get(name, settings["db_host_limit"])
+    return (settings["services"] or {}).get(name)
+
+
+def get_limiter(resource: str, settings=None):
+    """资源对应的限流器，未配置名额或未开启时返回 None；配置热更新后调整名额"""
+    settings = settings or get_settings()
+    if not settings["enabled"]:
+        return None
+    limit = _limit_of(resource, settings)
+    if not limit:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(resource)
+        if limiter is None:
+            limiter = Limiter(resource, limit)
+            _limiters[resource] = limiter
+    if limiter.limit != int(limit):
+        with limiter._cond:
+            limiter.limit = int(limit)
+            limiter._cond.notify_all()
+    return limiter
+
+
+def acquire(resource: str, logger=None):
+    """占用资源名额并返回限流器（调用方负责 release），不受限时返回 None"""
+    settings = get_settings()
+    limiter = get_limiter(resource, settings)
+    if limiter is None:
+        return None
+    waited = limiter.acquire(settings["queue_timeout"])
+    if waited >= _LOG_WAIT_SECONDS:
+        db_metrics.run_logger(logger or default_logger).info(
+            "资源 %s 并发已满（上限 %d），排队 %.1fs 后执行", resource, limiter.limit, waited)
+    return limiter
+
+
+@contextmanager
+def slot(resource: str, logger=None):
+    """with slot("service:sms"): ... 在 with 块内占用一个名额"""
+    limiter = acquire(resource, logger)
+    try:
+        yield
+    finally:
+        if limiter is not None:
+            limiter.release()
+
+
+def service_slot(name: str, logger=None):
+    return slot(f"service:{name}", logger)
+
+
+def snapshot() -> dict:
+    """{资源: {"limit", "active", "waiting"}}"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {item.resource: {"limit": item.limit, "active": item.active, "waiting": item.waiting}
+            for item in limiters}
+
+
+def apply_jitter(pipeline_id: str, triggers, jitter=None):
+    """为 APScheduler 触发器设置随机延迟，同一时刻触发的多个任务在 [0, jitter] 秒内错开"""
+    if jitter is None:
+        jitter = (get_settings()["jitter"] or {}).get(pipeline_id)
+    if jitter:
+        for trigger in triggers or ():
+            trigger.schedule.jitter = int(jitter)
+    return triggers
+
+
+def register_pipeline(id, tasks, triggers=None, jitter=None, **kwargs):
+    """plombery.register_pipeline 的包装：按 admission.jitter 配置（或参数 jitter）为定时触发加随机延迟"""
+    from plombery import register_pipeline as plombery_register_pipeline
+
+    return plombery_register_pipeline(id=id, tasks=tasks, triggers=apply_jitter(id, triggers, jitter), **kwargs)
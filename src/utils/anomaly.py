@@ -0,0 +1,170 @@
+# utils/anomaly.py
+"""
+    分公司 × 指标矩阵的异常检测：本次运行结果和本地指标历史载入 NumPy 矩阵（行 = 分公司，列 = 指标），
+    一次向量化计算完成率、较上周期/去年同期的变化和相对各分公司自身历史的 z-score，只标记异常分公司。
+    历史样本取过去若干个月“同一天”（当天没有记录时取该月此前最近一次）的值，与本次运行处于同一出账进度。
+    历史只有出账任务每天固定时刻写入的日样本，盘中其它时刻的累计值和完成率与之不可比，这类运行应关闭 zscore，
+    只保留完成率阈值和截止时间相同的指标对比。
+    numpy 为可选依赖，未安装时跳过分析。
+"""
+import datetime
+import logging
+import warnings
+
+from src.utils.metric_history import shift_months
+
+logger = logging.getLogger(__name__)
+
+# 异常检测默认参数，可在任务配置的 anomaly 节点覆盖
+DEFAULT_ANOMALY_SETTINGS = {
+    "enabled": True,
+    "zscore": True,           # 是否计算相对历史的 z-score，盘中巡检（与日样本不在同一时刻）应关闭
+    "history_months": 6,      # z-score 使用过去几个月同一天的历史值
+    "min_history": 3,         # 历史样本少于该数时不计算 z-score
+    "z_threshold": 3.0,       # |z| 大于等于该值视为异常
+    "ratio_threshold": None,  # 完成率低于该值视为异常，为空时只参与 z-score
+    "delta_threshold": 0.2,   # 较对比指标下降超过该比例视为异常
+    "ratios": [],             # [{name, label, actual, expected}]
+    "deltas": [],             # [{label, current, base}]
+}
+
+
+def numpy_available() -> bool:
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class AnomalyReport:
+    """一次分析的结果矩阵和异常原因"""
+
+    def __init__(self, companies, features, labels, current, mean, zscores, samples, outliers):
+        self.companies = companies  # 行
+        self.features = features    # 列：指标 name + 完成率 name
+        self.labels = labels        # {feature: 展示名称}
+        self.current = current      # 本次值矩阵
+        self.mean = mean            # 历史均值矩阵
+        self.zscores = zscores      # z-score 矩阵，样本不足时为 NaN
+        self.samples = samples      # 每个单元格的历史样本数
+        self.outliers = outliers    # {company: [异常原因]}
+
+    def reasons(self, company) -> list:
+        return self.outliers.get(company, [])
+
+    def value(self, company, feature):
+        value = self.current[self.companies.index(company), self.features.index(feature)]
+        return None if value != value else float(value)
+
+
+def load_history(history, companies, metrics, run_date, months):
+    """
+    从本地指标历史载入 (分公司, 指标, 月份) 三维数组，缺失为 NaN。
+    第 k 个月取 run_date 往前 k+1 个月同一天（或该月此前最近一次）的值。
+    """
+    import numpy as np
+
+    cube = np.full((len(companies), len(metrics), months), np.nan)
+    if history is None or not companies or not metrics or months <= 0:
+        return cube
+    targets = [shift_months(run_date, -(k + 1)) for k in range(months)]
+    month_slot = {(day.year, day.month): k for k, day in enumerate(targets)}
+    company_index = {company: i for i, company in enumerate(companies)}
+    metric_index = {metric: j for j, metric in enumerate(metrics)}
+    latest = {}
+    for row in history.query(start=targets[-1].replace(day=1), end=targets[0]):
+        i, j = company_index.get(row["company"]), metric_index.get(row["metric"])
+        if i is None or j is None:
+            continue
+        day = datetime.date.fromisoformat(row["run_date"])
+        k = month_slot.get((day.year, day.month))
+        if k is None or day > targets[k]:
+            continue
+        # 按日期升序返回，后写入的即为该月目标日之前最近一次
+        key = (i, j, k)
+        if key not in latest or row["run_date"] >= latest[key]:
+            latest[key] = row["run_date"]
+            cube[i, j, k] = row["value"]
+    return cube
+
+
+def _ratio(np, actual, expected):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(expected > 0, actual / expected, np.nan)
+
+
+def analyze(values_by_company: dict, metrics=None, history=None, settings=None, run_date=None) -> AnomalyReport:
+    """
+    values_by_company: {分公司: {指标 name: 值}}，负数视为缺失；metrics 为指标配置（用于展示名称）。
+    返回 AnomalyReport，numpy 未安装或未开启时返回 None。
+    """
+    options = dict(DEFAULT_ANOMALY_SETTINGS)
+    options.update({k: v for k, v in (settings or {}).items() if v is not None})
+    if not options["enabled"]:
+        return None
+    if not numpy_available():
+        logger.warning("未安装 numpy，跳过指标异常检测")
+        return None
+    import numpy as np
+
+    run_date = run_date or datetime.date.today()
+    companies = list(values_by_company)
+    metric_names = []
+    for values in values_by_company.values():
+        for name in values:
+            if name not in metric_names:
+                metric_names.append(name)
+    labels = {metric["name"]: metric.get("label", metric["name"]) for metric in (metrics or [])}
+
+    current = np.array(
+        [[values_by_company[company].get(name, np.nan) for name in metric_names] for company in companies],
+        dtype=float,
+    ).reshape(len(companies), len(metric_names))
+    current[current < 0] = np.nan
+    months = int(options["history_months"]) if options["zscore"] else 0
+    cube = load_history(history, companies, metric_names, run_date, months)
+
+    # 完成率列：本次值和历史值用同一组向量运算
+    column = {name: j for j, name in enumerate(metric_names)}
+    ratios = [spec for spec in options["ratios"] if spec["actual"] in column and spec["expected"] in column]
+    features = metric_names + [spec["name"] for spec in ratios]
+    for spec in ratios:
+        labels[spec["name"]] = spec.get("label", spec["name"])
+    if ratios:
+        actual_idx = [column[spec["actual"]] for spec in ratios]
+        expected_idx = [column[spec["expected"]] for spec in ratios]
+        current = np.concatenate([current, _ratio(np, current[:, actual_idx], current[:, expected_idx])], axis=1)
+        cube = np.concatenate([cube, _ratio(np, cube[:, actual_idx, :], cube[:, expected_idx, :])], axis=1)
+
+    samples = np.sum(~np.isnan(cube), axis=2)
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(cube, axis=2)
+        std = np.nanstd(cube, axis=2)
+        zscores = np.where((samples >= int(options["min_history"])) & (std > 0), (current - mean) / std, np.nan)
+
+    flagged = {company: [] for company in companies}
+    z_threshold = float(options["z_threshold"])
+    for i, j in zip(*np.nonzero(np.abs(np.nan_to_num(zscores)) >= z_threshold)):
+        flagged[companies[i]].append(
+            f"{labels.get(features[j], features[j])}偏离历史(z={zscores[i, j]:.1f}，历史均值{mean[i, j]:.4g})")
+
+    if options["ratio_threshold"] is not None and ratios:
+        offset = len(metric_names)
+        block = current[:, offset:]
+        for i, k in zip(*np.nonzero(np.nan_to_num(block, nan=np.inf) < float(options["ratio_threshold"]))):
+            flagged[companies[i]].append(f"{labels[ratios[k]['name']]}{block[i, k]:.1%}")
+
+    deltas = [spec for spec in options["deltas"] if spec["current"] in column and spec["base"] in column]
+    if deltas:
+        change = _ratio(np, current[:, [column[s["current"]] for s in deltas]],
+                        current[:, [column[s["base"]] for s in deltas]]) - 1
+        threshold = -float(options["delta_threshold"])
+        for i, k in zip(*np.nonzero(np.nan_to_num(change, nan=0.0) <= threshold)):
+            flagged[companies[i]].append(f"{deltas[k]['label']}下降{-change[i, k]:.1%}")
+
+    outliers = {company: reasons for company, reasons in flagged.items() if reasons}
+    if outliers:
+        logger.info("指标异常检测：%d 家分公司异常 %s", len(outliers), list(outliers))
+    return AnomalyReport(companies, features, labels, current, mean, zscores, samples, outliers)
@@ -0,0 +1,130 @@
+# utils/approx_count.py
+"""
+    近似统计：看板类快速查看不需要逐行 count(*)，按采样或规划器统计信息估算指标，并给出误差估计。
+    - sample: 表名替换为 "表 TABLESAMPLE BERNOULLI (p)"，与精确统计使用同样的过滤条件和同一个编译器，
+      计数按 100/p 放大；伯努利采样下放大后计数的标准误差约为 sqrt(c·(1-q))/q（c 为样本计数，q 为采样比例）
+    - planner: 每个 count 指标执行一次 EXPLAIN (FORMAT JSON)，取规划器按 pg_class.reltuples 和列统计估算的行数，
+      不扫描数据，误差无法量化（error 为 None）
+    只支持 postgres / kingbase，mysql 数据源回退到精确统计；sum 类指标只放大，不给误差。
+    正式短信仍走精确统计。
+"""
+import json
+import logging
+import math
+
+from src.utils import metric_compiler
+
+logger = logging.getLogger(__name__)
+
+# 近似统计默认参数，可在任务配置的 approximate 节点覆盖
+DEFAULT_APPROX_SETTINGS = {
+    "method": "sample",       # sample | planner
+    "sample_percent": 1.0,    # 采样比例（百分比）
+    "sampling": "BERNOULLI",  # BERNOULLI 按行采样，误差估计成立；SYSTEM 按数据页采样更快，但误差偏大
+    "seed": None,             # 配置后使用 REPEATABLE (seed)，多次运行结果一致
+    "z": 1.96,                # 误差范围的置信倍数，1.96 约为 95%
+}
+
+METHODS = ("sample", "planner")
+_SAMPLING = ("BERNOULLI", "SYSTEM")
+
+
+class Estimate:
+    """一个指标的估算值：value 为估算值，error 为 ± 误差（无法估计时为 None），method 为估算方式"""
+    __slots__ = ("value", "error", "method")
+
+    def __init__(self, value, error=None, method="exact"):
+        self.value = value
+        self.error = error
+        self.method = method
+
+    def __repr__(self):
+        if self.error is None:
+            return f"{self.value}({self.method})"
+        return f"{self.value}±{self.error}({self.method})"
+
+
+def _settings(settings) -> dict:
+    options = dict(DEFAULT_APPROX_SETTINGS)
+    options.update({k: v for k, v in (settings or {}).items() if v is not None})
+    if options["method"] not in METHODS:
+        raise ValueError(f"不支持的近似统计方式: {options['method']}，可选 {METHODS}")
+    sampling = str(options["sampling"]).upper()
+    if sampling not in _SAMPLING:
+        raise ValueError(f"不支持的采样方式: {options['sampling']}，可选 {_SAMPLING}")
+    options["sampling"] = sampling
+    percent = float(options["sample_percent"])
+    if not 0 < percent <= 100:
+        raise ValueError(f"采样比例必须在 (0, 100] 之间: {percent}")
+    options["sample_percent"] = percent
+    return options
+
+
+def sample_clause(percent: float, sampling="BERNOULLI", seed=None) -> str:
+    clause = f"TABLESAMPLE {sampling} ({percent:g})"
+    if seed is not None:
+        clause += f" REPEATABLE ({int(seed)})"
+    return clause
+
+
+def scale_count(count, percent: float, z=1.96) -> Estimate:
+    """样本计数放大为全表估算值；样本计数为 0 时按 1 估计误差，避免给出零误差"""
+    q = percent / 100
+    value = int(round((count or 0) / q))
+    error = int(math.ceil(z * math.sqrt(max(count or 0, 1) * (1 - q)) / q))
+    return Estimate(value, error, "sample")
+
+
+def sample_metrics(db, metrics, dialect=None, options=None) -> dict:
+    """所有指标编译为一条对采样表的聚合 SQL，返回 {name: Estimate}"""
+    options = _settings(options)
+    percent = options["sample_percent"]
+    clause = sample_clause(percent, options["sampling"], options["seed"])
+    sampled = [dict(metric, table=f"{metric['table']} {clause}") for metric in metrics]
+    # 采样结果每次不同，不进入查询去重缓存
+    rows = db.query(metric_compiler.compile_metrics(sampled, dialect=dialect), memoize=False)
+    row = rows[0] if rows else {}
+    result = {}
+    for metric in metrics:
+        value = row.get(metric["name"])
+        if metric.get("agg", "count") == "count":
+            result[metric["name"]] = scale_count(value, percent, options["z"])
+        else:
+            result[metric["name"]] = Estimate(int(round((value or 0) * 100 / percent)), None, "sample")
+    return result
+
+
+def _plan_rows(rows) -> int:
+    plan = next(iter(rows[0].values())) if rows else None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def planner_metrics(db, metrics, dialect=None, options=None) -> dict:
+    """count 指标读规划器估算行数；sum 指标规划器无法估算，改用采样"""
+    result, others = {}, []
+    for metric in metrics:
+        if metric.get("agg", "count") != "count":
+            others.append(metric)
+            continue
+        sql = f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {metric['table']}"
+        if metric.get("filter"):
+            sql += f" WHERE {metric['filter']}"
+        result[metric["name"]] = Estimate(_plan_rows(db.query(sql, memoize=False)), None, "planner")
+    if others:
+        result.update(sample_metrics(db, others, dialect, options))
+    return result
+
+
+def estimate_metrics(db, metrics, dialect=None, settings=None) -> dict:
+    """按 settings.method 估算指标，返回 {name: Estimate}；mysql 不支持时回退到精确统计"""
+    options = _settings(settings)
+    if dialect == "mysql":
+        logger.warning("mysql 数据源不支持 TABLESAMPLE / 规划器估算，回退到精确统计")
+        rows = db.query(metric_compiler.compile_metrics(metrics, dialect=dialect))
+        row = rows[0] if rows else {}
+        return {metric["name"]: Estimate(row.get(metric["name"]), 0) for metric in metrics}
+    if options["method"] == "planner":
+        return planner_metrics(db, metrics, dialect, options)
+    return sample_metrics(db, metrics, dialect, options)
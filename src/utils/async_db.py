@@ -0,0 +1,305 @@
+# utils/async_db.py
+"""
+    asyncio 数据库引擎：pg/kingbase 使用 asyncpg，mysql 使用 aiomysql，查询方式与 DBUtils.query 相同（默认返回字典列表，
+    fmt 可选格式见 dbutils.RESULT_FORMATS）。
+    分公司查询都是网络等待，全部分公司在一个事件循环中并发执行，不再每个分公司占用一个线程。
+    - 并发上限：db_query.async_concurrency，任务配置 max_concurrency 可覆盖
+    - 同一次运行内指向同一物理库的相同 SQL 只执行一次（与 query_memo 相同的 key）
+    - 连接、SQL 期限和熔断与 DBUtils 共用配置，调用埋点写入 db_metrics；跨任务的主机准入名额只对线程引擎生效
+    - 参数占位符与 DBUtils 相同（%s / %(name)s，%% 为字面量 %），asyncpg 执行前转换为 $1、$2
+    - 连接不跨运行复用：事件循环在每次运行结束时关闭，连接随之关闭
+    由 db_query.engine（或任务配置 engine）选择 threads（默认）或 asyncio，驱动未安装时使用 asyncio 引擎会报错。
+"""
+import asyncio
+import contextvars
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import circuit_breaker, db_metrics, dbutils, query_memo
+from src.utils.dbutils import QueryTimeout, resolve_timeout
+
+ENGINES = ("threads", "asyncio")
+
+# 单次运行内的查询去重：{key: asyncio.Future}，由 run_by_company() 设置
+_current_memo = contextvars.ContextVar("async_query_memo", default=None)
+
+default_logger = logging.getLogger(__name__)
+
+# psycopg2 / pymysql 风格的占位符
+_PLACEHOLDER = re.compile(r"%(%|s|\((\w+)\)s)")
+
+
+def get_engine(job_config=None) -> str:
+    """任务配置 engine 优先，其次为 db_query.engine"""
+    engine = (job_config or {}).get("engine") or dbutils._get_query_setting("engine")
+    if engine not in ENGINES:
+        raise ValueError(f"不支持的查询引擎: {engine}，可选 {ENGINES}")
+    return engine
+
+
+def to_numbered(sql: str, params=None):
+    """
+    DBUtils 风格的占位符（%s 按位置、%(name)s 按名称）转换为 asyncpg 的 $1、$2，返回 (sql, 参数元组)。
+    与 psycopg2 相同，params 为 None 时 SQL 原样执行，% 不做转义处理
+    """
+    if params is None:
+        return sql, ()
+    named = isinstance(params, dict)
+    names, values = {}, []
+
+    def replace(match):
+        token, name = match.group(1), match.group(2)
+        if token == "%":
+            return "%"
+        if named != (name is not None):
+            raise ValueError(f"SQL 占位符与参数类型不一致（{'字典' if named else '序列'}参数）: {match.group(0)}")
+        if name is None:
+            if len(values) >= len(params):
+                raise ValueError(f"SQL 占位符多于参数个数 {len(params)}")
+            values.append(params[len(values)])
+            return f"${len(values)}"
+        if name not in names:
+            if name not in params:
+                raise ValueError(f"缺少 SQL 参数: {name}")
+            values.append(params[name])
+            names[name] = len(values)
+        return f"${names[name]}"
+
+    sql = _PLACEHOLDER.sub(replace, sql)
+    if not named and len(values) != len(params):
+        raise ValueError(f"SQL 占位符 {len(values)} 个，参数 {len(params)} 个")
+    return sql, tuple(values)
+
+
+def _convert(rows, fmt):
+    """字典行转为 fmt 格式；结果为空时无法得到列名，按列格式返回空字典"""
+    if fmt == "dict":
+        return [dict(row) for row in rows]
+    columns = list(rows[0]) if rows else []
+    return dbutils.convert_rows(columns, [tuple(row.values()) for row in rows], fmt)
+
+
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
+async def open_connection(config: dict, timeout=None):
+    """按数据库配置新建一个异步连接；驱动在第一次建立连接时才导入"""
+    db_type = config.get("type")
+    options = {"timeout": timeout} if timeout else {}
+    if db_type == "mysql":
+        import aiomysql
+
+        connect = aiomysql.connect(
+            host=config.get("host"), port=config.get("port"), user=config.get("user"),
+            password=config.get("password"), db=config.get("name"),
+            charset="utf8mb4", cursorclass=aiomysql.DictCursor,
+            **({"connect_timeout": timeout} if timeout else {}),
+        )
+        return await asyncio.wait_for(connect, timeout) if timeout else await connect
+    elif db_type in ["kingbase", "postgres"] or db_type is None:
+        import asyncpg
+
+        return await asyncpg.connect(
+            host=config.get("host"), port=config.get("port"), user=config.get("user"),
+            password=config.get("password"), database=config.get("name"), **options
+        )
+    else:
+        raise ValueError(f"不支持的数据库类型: {db_type}")
+
+
+class AsyncDBUtils:
+    def __init__(self, config, company=None):
+        self.config = config
+        self.company = company
+        self.conn = None
+        self.breaker = None
+        self.is_mysql = config.get("type") == "mysql"
+        self._connect_ms = 0.0
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    def _record(self, operation, sql, connect_ms=None, execute_ms=0.0, rows=0, nbytes=0, ok=True):
+        if connect_ms is None:
+            connect_ms, self._connect_ms = self._connect_ms, 0.0
+        db_metrics.record(db_metrics.QueryRecord(
+            operation, company=self.company or self.config.get("name"),
+            fingerprint=db_metrics.fingerprint(sql) if sql else None,
+            connect_ms=connect_ms, execute_ms=execute_ms, rows=rows, bytes=nbytes, ok=ok,
+        ))
+
+    async def _probe(self):
+        conn = await open_connection(self.config, self.breaker.probe_timeout)
+        try:
+            if self.is_mysql:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT 1")
+            else:
+                await conn.fetchval("SELECT 1")
+        finally:
+            await self._close_connection(conn)
+
+    async def connect(self):
+        if self.conn is not None:
+            return
+        log = db_metrics.run_logger(self.logger)
+        self.breaker = dbutils.breaker_for(self.config)
+        if self.breaker is not None and self.breaker.state != circuit_breaker.CLOSED:
+            # 熔断中直接失败；冷却结束时在线程中执行探测，不阻塞事件循环
+            await asyncio.to_thread(self.breaker.before_call, lambda: asyncio.run(self._probe()), log)
+        timeout = resolve_timeout("connect_timeout", self.config)
+        start = time.perf_counter()
+        try:
+            self.conn = await open_connection(self.config, timeout)
+        except Exception as e:
+            elapsed_ms = _elapsed_ms(start)
+            self._record("connect", None, connect_ms=elapsed_ms, ok=False)
+            if self.breaker is not None and circuit_breaker.is_connection_error(e, connecting=True):
+                self.breaker.record_failure(e, log)
+            if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+                raise QueryTimeout(f"分公司 {self.company} 连接数据库超时({elapsed_ms / 1000:.1f}s): {e}",
+                                   company=self.company, stage="connect") from e
+            raise
+        self._connect_ms += _elapsed_ms(start)
+
+    async def query(self, sql: str, params=None, memoize=True, fmt="dict"):
+        """
+        执行查询，按 fmt 返回结果（与 DBUtils.query 相同，默认字典列表）；
+        在 run_by_company() 中时，同一物理库上相同的 SQL 只执行一次
+        """
+        dbutils._check_format(fmt)
+        memo = _current_memo.get() if memoize else None
+        if memo is None:
+            return _convert(await self._query(sql, params), fmt)
+        key = (query_memo.dsn_key(self.config), query_memo.normalize_sql(sql), repr(params))
+        future = memo.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            memo[key] = future
+            try:
+                future.set_result(await self._query(sql, params))
+            except BaseException as e:
+                # 失败的结果不缓存，后续调用可以重试
+                memo.pop(key, None)
+                future.set_exception(e)
+                # 没有其它等待方时取出异常，避免事件循环告警
+                future.exception()
+                raise
+        result = await asyncio.shield(future)
+        return _convert(result, fmt)
+
+    async def _fetch(self, sql, params, timeout):
+        if self.is_mysql:
+            async with self.conn.cursor() as cursor:
+                if timeout:
+                    await cursor.execute("SET SESSION max_execution_time = %s", (int(timeout * 1000),))
+                    grace = float(dbutils._get_query_setting("cancel_grace") or 0)
+                    await asyncio.wait_for(cursor.execute(sql, params), timeout + grace)
+                else:
+                    await cursor.execute(sql, params)
+                return [dict(row) for row in await cursor.fetchall()]
+        # asyncpg 超时后向服务端发送取消请求
+        sql, args = to_numbered(sql, params)
+        records = await self.conn.fetch(sql, *args, timeout=timeout)
+        return [dict(record) for record in records]
+
+    async def _query(self, sql: str, params=None):
+        if self.conn is None:
+            await self.connect()
+        timeout = resolve_timeout("statement_timeout", self.config)
+        log = db_metrics.run_logger(self.logger)
+        result = []
+        ok = False
+        start = time.perf_counter()
+        try:
+            self.logger.info("当前执行sql:%s", sql)
+            result = await self._fetch(sql, params, timeout)
+            self.logger.info("SQL执行结果:%s", dbutils.summarize_rows(result))
+            ok = True
+            if self.breaker is not None:
+                self.breaker.record_success(_elapsed_ms(start), log)
+            return result
+        except Exception as e:
+            # 语句超时取消不计入熔断，只有连接断开才算
+            if (self.breaker is not None and not dbutils.is_canceled(e)
+                    and circuit_breaker.is_connection_error(e, conn=self.conn)):
+                self.breaker.record_failure(e, log)
+            if isinstance(e, (asyncio.TimeoutError, TimeoutError)) or dbutils.is_canceled(e):
+                self.logger.error("分公司 %s 查询超时(期限 %ss)，已取消", self.company, timeout)
+                raise QueryTimeout(f"分公司 {self.company} 查询超时({timeout}s): {e}", company=self.company) from e
+            raise
+        finally:
+            self._record("query", sql, execute_ms=_elapsed_ms(start), rows=len(result),
+                         nbytes=db_metrics.approx_bytes(result), ok=ok)
+
+    async def _close_connection(self, conn):
+        if self.is_mysql:
+            conn.close()
+        else:
+            await conn.close()
+
+    async def close(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            try:
+                await self._close_connection(conn)
+            except Exception as e:
+                self.logger.warning("关闭连接失败: %s", e)
+
+    async def __aenter__(self):
+        # 连接在第一次 query 时才建立，命中查询去重时不建立连接
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+async def _run(companies, func, max_concurrency, logger, on_error):
+    _current_memo.set({})
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(company):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                return await func(company)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                logger.error("分公司 %s 执行失败，按未完成处理: %s", company, e)
+                return on_error(company, e)
+            finally:
+                logger.info("分公司 %s 执行耗时 %.3fs", company, time.perf_counter() - start)
+
+    return await asyncio.gather(*(call(company) for company in companies))
+
+
+def run_coroutine(coro):
+    """在当前线程运行协程；当前线程已有运行中的事件循环时改在新线程中运行，上下文（run_stats、期限）保持可见"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="async_db") as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
+
+
+def run_by_company(companies, func, max_concurrency=None, logger=None, on_error=None):
+    """
+    与 fanout.run_by_company 相同的语义，func 为 async def func(company)；
+    所有分公司在一个事件循环中并发执行，最多 max_concurrency 个同时进行，返回结果顺序与 companies 一致
+    """
+    if logger is None:
+        logger = default_logger
+    companies = list(companies or [])
+    if not companies:
+        return []
+    if max_concurrency is None:
+        max_concurrency = dbutils._get_query_setting("async_concurrency")
+    max_concurrency = max(1, min(int(max_concurrency), len(companies)))
+    start = time.perf_counter()
+    results = run_coroutine(_run(companies, func, max_concurrency, logger, on_error))
+    logger.info("共 %d 家分公司执行完成（asyncio），并发数 %d，总耗时 %.3fs",
+                len(companies), max_concurrency, time.perf_counter() - start)
+    return results
@@ -0,0 +1,194 @@
+# utils/circuit_breaker.py
+"""
+    数据库熔断：按 (host, port, dbname) 统计连续失败次数和最近的查询耗时。
+    - closed: 正常访问，连续失败达到 failure_threshold 次后打开
+    - open: cooldown 秒内直接抛出 CircuitOpenError，不再建立连接、等待超时
+    - half_open: 冷却结束后由一个调用方执行 SELECT 1 探测，成功则关闭，失败则重新打开并再次冷却；
+      探测期间其它调用方仍快速失败
+    只有建立连接失败和查询中连接断开计为失败；SQL 错误、语句超时被取消、本地连接池耗尽都说明数据库本身可用，不计入。
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from src.utils.db_pool import PoolTimeout, is_broken
+
+# 熔断默认参数，可在 config.yaml 的 circuit_breaker 节点或 database.<ds>.circuit_breaker 中覆盖
+DEFAULT_BREAKER_SETTINGS = {
+    "enabled": True,
+    "failure_threshold": 3,   # 连续失败几次后熔断
+    "cooldown": 60,           # 熔断后多少秒进入半开探测
+    "probe_timeout": 3,       # 半开探测的连接超时(秒)
+    "latency_window": 20,     # 统计最近多少次成功调用的耗时
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_TEXT = {CLOSED: "正常", OPEN: "熔断", HALF_OPEN: "半开探测"}
+
+_CONNECTION_ERRORS = ("OperationalError", "InterfaceError")
+# mysql 查询中连接断开：server has gone away / lost connection during query
+_MYSQL_CONNECTION_LOST = (2006, 2013)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(ConnectionError):
+    """数据源处于熔断状态，调用被快速拒绝"""
+
+    def __init__(self, key, remaining):
+        super().__init__(f"数据库 {format_key(key)} 已熔断，{remaining:.0f}s 后重新探测")
+        self.key = key
+        self.remaining = remaining
+
+
+def breaker_key(db_config: dict) -> tuple:
+    """熔断粒度为物理库：(host, port, dbname)"""
+    return db_config.get("host"), db_config.get("port"), db_config.get("name")
+
+
+def format_key(key) -> str:
+    host, port, name = key
+    return f"{host}:{port}/{name}"
+
+
+def is_connection_error(error, connecting=False, conn=None) -> bool:
+    """
+    是否说明数据库不可用：
+    - 建立连接时（connecting=True）：驱动的连接失败（OperationalError / InterfaceError）、网络错误、连接超时
+    - 查询中：只有连接已断开才算（InterfaceError、网络中断、mysql 2006/2013、连接对象已关闭），
+      语句超时、取消和 SQL 错误不计入
+    连接池耗尽（PoolTimeout）是本地资源不足，任何阶段都不计入。
+    """
+    if isinstance(error, PoolTimeout):
+        return False
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if connecting:
+        return isinstance(error, OSError) or bool(names & set(_CONNECTION_ERRORS))
+    if is_broken(conn):
+        return True
+    if isinstance(error, ConnectionError) or "InterfaceError" in names:
+        return True
+    args = getattr(error, "args", ())
+    return "OperationalError" in names and bool(args) and args[0] in _MYSQL_CONNECTION_LOST
+
+
+class CircuitBreaker:
+    def __init__(self, key, failure_threshold=3, cooldown=60, probe_timeout=3, latency_window=20, **_):
+        self.key = key
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = float(cooldown)
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.latencies = deque(maxlen=int(latency_window))
+        self._probing = False
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    def before_call(self, probe=None, log=None):
+        """
+        调用数据库前检查：熔断中直接抛出 CircuitOpenError；冷却结束时由当前调用方执行 probe()，
+        probe 抛出异常即探测失败
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(self.key, max(remaining, 0))
+            self.state = HALF_OPEN
+            self._probing = True
+        log = log or self.logger
+        log.info("数据库 %s 熔断冷却结束，执行 SELECT 1 探测", format_key(self.key))
+        start = time.perf_counter()
+        try:
+            if probe is not None:
+                probe()
+        except Exception as e:
+            self.record_failure(e, log)
+            raise CircuitOpenError(self.key, self.cooldown) from e
+        finally:
+            with self._lock:
+                self._probing = False
+        self.record_success((time.perf_counter() - start) * 1000, log)
+
+    def record_success(self, latency_ms=None, log=None):
+        with self._lock:
+            recovered = self.state != CLOSED
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            if latency_ms is not None:
+                self.latencies.append(latency_ms)
+        if recovered:
+            (log or self.logger).warning("数据库 %s 探测成功，熔断恢复", format_key(self.key))
+
+    def record_failure(self, error, log=None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            opened = self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold)
+            if opened:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+        if opened:
+            (log or self.logger).error("数据库 %s 连续失败 %d 次，熔断 %.0fs: %s",
+                                       format_key(self.key), self.failures, self.cooldown, error)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = list(self.latencies)
+            remaining = None
+            if self.state == OPEN:
+                remaining = max(self.opened_at + self.cooldown - time.monotonic(), 0)
+            return {
+                "key": format_key(self.key),
+                "state": self.state,
+                "failures": self.failures,
+                "avg_ms": sum(latencies) / len(latencies) if latencies else None,
+                "max_ms": max(latencies) if latencies else None,
+                "remaining": remaining,
+                "last_error": self.last_error,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(db_config: dict, settings=None) -> CircuitBreaker:
+    """按物理库获取进程内共享的熔断器，settings 只在首次创建时生效"""
+    key = breaker_key(db_config)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            options = dict(DEFAULT_BREAKER_SETTINGS)
+            options.update({k: v for k, v in (settings or {}).items() if v is not None})
+            breaker = CircuitBreaker(key, **options)
+            _breakers[key] = breaker
+        return breaker
+
+
+def snapshots(keys=None) -> list:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.snapshot() for breaker in breakers if keys is None or breaker.key in keys]
+
+
+def format_states(states) -> str:
+    """熔断状态表，输出到任务日志"""
+    lines = [f"{'数据库':<32}{'状态':<8}{'连续失败':>8}{'平均耗时ms':>12}{'最大耗时ms':>12}  备注"]
+    for item in states:
+        note = ""
+        if item["state"] == OPEN:
+            note = f"{item['remaining']:.0f}s 后探测；{item['last_error']}"
+        avg = f"{item['avg_ms']:.1f}" if item["avg_ms"] is not None else "-"
+        peak = f"{item['max_ms']:.1f}" if item["max_ms"] is not None else "-"
+        lines.append(f"{item['key']:<32}{STATE_TEXT[item['state']]:<8}{item['failures']:>8}{avg:>12}{peak:>12}  {note}")
+    return "\n".join(lines)
@@ -0,0 +1,192 @@
+# utils/db_metrics.py
+"""
+    数据库调用埋点：DBUtils 每次 connect / query / execute 记录连接、执行、拉取耗时，行数和近似字节数，
+    并带上分公司、pipeline id 和 SQL 指纹。
+    - run_stats(): 单次运行的明细，退出时以表格形式输出到 plombery 任务日志
+    - registry: 进程内累计统计，app 可通过 registry.snapshot() 读取
+    - run_stats() 退出时同时输出本次访问过的物理库的熔断状态
+"""
+import contextvars
+import hashlib
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from src.utils import circuit_breaker
+
+default_logger = logging.getLogger(__name__)
+
+_current_run = contextvars.ContextVar("db_run_stats", default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\d+(?:\.\d+)?")
+_SIZE_SAMPLE_ROWS = 100
+
+
+def fingerprint(sql: str) -> str:
+    """去掉字面量、数字和多余空白后的 SQL 摘要，同一模板不同日期参数（含 his_{year} 表名）得到相同指纹"""
+    normalized = _STRING_LITERAL.sub("?", sql)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = " ".join(normalized.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:10]
+
+
+def approx_bytes(rows) -> int:
+    """按前若干行的字符长度估算结果集大小"""
+    if not rows:
+        return 0
+    sample = rows[:_SIZE_SAMPLE_ROWS]
+    size = 0
+    for row in sample:
+        values = row.values() if isinstance(row, dict) else row
+        size += sum(len(str(value)) for value in values)
+    return size * len(rows) // len(sample)
+
+
+class QueryRecord:
+    __slots__ = ("operation", "company", "pipeline", "fingerprint", "connect_ms", "execute_ms",
+                 "fetch_ms", "rows", "bytes", "ok", "timestamp")
+
+    def __init__(self, operation, company=None, pipeline=None, fingerprint=None, connect_ms=0.0,
+                 execute_ms=0.0, fetch_ms=0.0, rows=0, bytes=0, ok=True):
+        self.operation = operation
+        self.company = company
+        self.pipeline = pipeline
+        self.fingerprint = fingerprint
+        self.connect_ms = connect_ms
+        self.execute_ms = execute_ms
+        self.fetch_ms = fetch_ms
+        self.rows = rows
+        self.bytes = bytes
+        self.ok = ok
+        self.timestamp = time.time()
+
+    @property
+    def total_ms(self) -> float:
+        return self.connect_ms + self.execute_ms + self.fetch_ms
+
+
+class _Aggregate:
+    __slots__ = ("calls", "errors", "connect_ms", "execute_ms", "fetch_ms", "max_ms", "rows", "bytes", "last_at")
+
+    def __init__(self):
+        self.calls = self.errors = self.rows = self.bytes = 0
+        self.connect_ms = self.execute_ms = self.fetch_ms = self.max_ms = 0.0
+        self.last_at = None
+
+    def add(self, record: QueryRecord):
+        self.calls += 1
+        self.errors += 0 if record.ok else 1
+        self.connect_ms += record.connect_ms
+        self.execute_ms += record.execute_ms
+        self.fetch_ms += record.fetch_ms
+        self.max_ms = max(self.max_ms, record.total_ms)
+        self.rows += record.rows
+        self.bytes += record.bytes
+        self.last_at = record.timestamp
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class QueryStats:
+    """按 (pipeline, 分公司, SQL 指纹) 聚合的统计，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._aggregates = {}
+
+    def add(self, record: QueryRecord):
+        key = (record.pipeline, record.company, record.fingerprint)
+        with self._lock:
+            aggregate = self._aggregates.get(key)
+            if aggregate is None:
+                aggregate = self._aggregates[key] = _Aggregate()
+            aggregate.add(record)
+
+    def snapshot(self) -> list:
+        """返回统计快照，按总耗时倒序"""
+        with self._lock:
+            items = [
+                {"pipeline": pipeline, "company": company, "fingerprint": fp, **aggregate.as_dict()}
+                for (pipeline, company, fp), aggregate in self._aggregates.items()
+            ]
+        items.sort(key=lambda item: item["connect_ms"] + item["execute_ms"] + item["fetch_ms"], reverse=True)
+        return items
+
+    def clear(self):
+        with self._lock:
+            self._aggregates.clear()
+
+    def format_table(self) -> str:
+        header = ("分公司", "SQL指纹", "次数", "失败", "连接ms", "执行ms", "拉取ms", "最大ms", "行数", "字节")
+        lines = [" | ".join(header)]
+        for item in self.snapshot():
+            lines.append(" | ".join(str(value) for value in (
+                item["company"] or "-", item["fingerprint"] or "-", item["calls"], item["errors"],
+                f"{item['connect_ms']:.1f}", f"{item['execute_ms']:.1f}", f"{item['fetch_ms']:.1f}",
+                f"{item['max_ms']:.1f}", item["rows"], item["bytes"],
+            )))
+        return "\n".join(lines)
+
+
+# 进程内累计统计
+registry = QueryStats()
+
+
+class _RunStats(QueryStats):
+    def __init__(self, pipeline, logger=None):
+        super().__init__()
+        self.pipeline = pipeline
+        self.logger = logger
+        # 本次运行访问过的物理库，退出时输出其熔断状态
+        self.breakers = set()
+
+
+def current_pipeline():
+    run = _current_run.get()
+    return run.pipeline if run is not None else None
+
+
+def run_logger(default=None):
+    """当前运行的任务日志，不在 run_stats() 中时返回 default"""
+    run = _current_run.get()
+    if run is not None and run.logger is not None:
+        return run.logger
+    return default or default_logger
+
+
+def note_breaker(key):
+    run = _current_run.get()
+    if run is not None:
+        run.breakers.add(key)
+
+
+def record(item: QueryRecord):
+    """记录一次数据库调用：写入当前运行的统计（如果有）和进程级累计统计"""
+    run = _current_run.get()
+    if run is not None:
+        if item.pipeline is None:
+            item.pipeline = run.pipeline
+        run.add(item)
+    registry.add(item)
+
+
+@contextmanager
+def run_stats(pipeline: str, logger=None):
+    """在 with 块内收集本次运行的数据库调用，退出时输出汇总表到日志"""
+    if logger is None:
+        logger = default_logger
+    run = _RunStats(pipeline, logger)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+        if run.snapshot():
+            logger.info("本次运行数据库调用统计 [%s]:\n%s", pipeline, run.format_table())
+        if run.breakers:
+            logger.info("数据库熔断状态 [%s]:\n%s", pipeline,
+                        circuit_breaker.format_states(circuit_breaker.snapshots(run.breakers)))
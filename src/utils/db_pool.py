@@ -0,0 +1,266 @@
+# utils/db_pool.py
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# 连接池默认参数，可在 config.yaml 的 db_pool 节点或 database.<ds>.pool 中覆盖
+DEFAULT_POOL_SETTINGS = {
+    "min_size": 0,           # 空闲回收时至少保留的连接数；只限制回收，不预先建立连接
+    "max_size": 5,           # 单个 DSN 最大连接数
+    "idle_timeout": 300,     # 连接空闲超过该秒数即回收
+    "acquire_timeout": 30,   # 连接池耗尽时等待连接的最长秒数
+    "health_check": True,    # 借出连接前执行 SELECT 1 检查
+}
+REAPER_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(TimeoutError):
+    """连接池已满且等待超时：本地连接不足，不代表数据库不可用"""
+
+
+def pool_key(db_config: dict) -> tuple:
+    """连接池的唯一标识：(type, host, port, dbname, user)"""
+    return (
+        db_config.get("type") or "postgres",
+        db_config.get("host"),
+        db_config.get("port"),
+        db_config.get("name"),
+        db_config.get("user"),
+    )
+
+
+def is_broken(conn) -> bool:
+    """
+    连接是否已断开，按驱动的属性判断：psycopg2 / aiomysql 为 closed，pymysql 为 open（没有 closed 属性），
+    asyncpg 为 is_closed()
+    """
+    if conn is None:
+        return False
+    is_closed = getattr(conn, "is_closed", None)
+    if callable(is_closed):
+        return bool(is_closed())
+    if hasattr(conn, "closed"):
+        return bool(conn.closed)
+    return not getattr(conn, "open", True)
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    单个 DSN 的线程安全连接池。连接在借出时按需建立，不预热；
+    min_size 只保证空闲回收后至少保留这么多连接，池中连接数仍可能少于 min_size。
+    """
+
+    def __init__(self, key, factory, min_size=0, max_size=5, idle_timeout=300,
+                 acquire_timeout=30, health_check=True):
+        if max_size < 1:
+            raise ValueError(f"连接池 max_size 必须大于 0: {max_size}")
+        self.key = key
+        self.factory = factory
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check = health_check
+        self._idle = []
+        # 借出中的连接：id(conn) -> _PooledConnection
+        self._in_use = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    @property
+    def size(self) -> int:
+        return len(self._idle) + len(self._in_use)
+
+    def acquire(self, timeout=None):
+        """借出一个连接；池已满时等待，超时抛出 PoolTimeout"""
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError(f"连接池 {self.key} 已关闭")
+                self._evict_idle_locked()
+                item = self._idle.pop() if self._idle else None
+                if item is not None:
+                    # 健康检查在锁外执行，期间先记为借出，连接数仍计入 max_size
+                    self._in_use[id(item.conn)] = item
+                else:
+                    if self.size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolTimeout(f"连接池 {self.key} 获取连接超时({timeout}s)")
+                        self._cond.wait(remaining)
+                        continue
+                    # 先占位，在锁外建立连接，避免阻塞其他线程
+                    placeholder = object()
+                    self._in_use[id(placeholder)] = placeholder
+            if item is None:
+                try:
+                    item = _PooledConnection(self.factory())
+                except Exception:
+                    with self._cond:
+                        self._in_use.pop(id(placeholder), None)
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._in_use.pop(id(placeholder), None)
+                    self._in_use[id(item.conn)] = item
+                self.logger.debug("连接池 %s 新建连接，当前连接数 %d", self.key, self.size)
+                return item.conn
+
+            if self.health_check and not self._is_healthy(item.conn):
+                self.logger.warning("连接池 %s 连接健康检查失败，丢弃后重试", self.key)
+                self._close_quietly(item.conn)
+                with self._cond:
+                    self._in_use.pop(id(item.conn), None)
+                    self._cond.notify()
+                continue
+            return item.conn
+
+    def release(self, conn, discard=False):
+        """归还连接；discard=True 或回滚失败时直接关闭该连接"""
+        with self._cond:
+            item = self._in_use.pop(id(conn), None)
+        if item is None:
+            self._close_quietly(conn)
+            return
+        if not discard:
+            try:
+                # 结束查询时隐式开启的事务，避免连接处于 idle in transaction
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or self._closed:
+                self._close_quietly(conn)
+            else:
+                item.last_used = time.monotonic()
+                self._idle.append(item)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ..."""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            discard = is_broken(conn)
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def evict_idle(self):
+        with self._cond:
+            self._evict_idle_locked()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for item in idle:
+            self._close_quietly(item.conn)
+
+    def _evict_idle_locked(self):
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        keep = []
+        # _idle 末尾为最近归还的连接，优先保留
+        for item in reversed(self._idle):
+            if now - item.last_used > self.idle_timeout and len(keep) + len(self._in_use) >= self.min_size:
+                self._close_quietly(item.conn)
+            else:
+                keep.append(item)
+        keep.reverse()
+        self._idle = keep
+
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        if is_broken(conn):
+            return False
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_reaper = None
+
+
+def get_pool(db_config: dict, factory, **settings) -> ConnectionPool:
+    """获取（不存在则创建）进程级共享的连接池，所有 pipeline 共用"""
+    key = pool_key(db_config)
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = dict(DEFAULT_POOL_SETTINGS)
+            options.update({k: v for k, v in settings.items() if v is not None})
+            options.update(db_config.get("pool") or {})
+            pool = ConnectionPool(key, factory, **options)
+            _pools[key] = pool
+            logger.info("创建连接池 %s，参数 %s", key[1:], options)
+            _start_reaper()
+    return pool
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _start_reaper():
+    global _reaper
+    if _reaper is not None:
+        return
+
+    def reap():
+        while True:
+            time.sleep(REAPER_INTERVAL)
+            for pool in list(_pools.values()):
+                pool.evict_idle()
+
+    _reaper = threading.Thread(target=reap, name="db-pool-reaper", daemon=True)
+    _reaper.start()
+
+
+atexit.register(close_all_pools)
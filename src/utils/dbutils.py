@@ -1,64 +1,569 @@
 # utils/dbutils.py
-import pymysql
-import psycopg2
+import array
+import collections
+import contextvars
+import functools
+import itertools
 import logging
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from copy import copy
 
-from src.utils.ConfigLoader import ConfigLoader
+from src.utils import admission, circuit_breaker, db_metrics, db_pool, query_memo
+from src.utils.ConfigLoader import get_config
+
+# 查询默认参数，可在 config.yaml 的 db_query 节点覆盖
+DEFAULT_QUERY_SETTINGS = {
+    "log_rows": 10,       # 结果日志最多输出的行数，超出部分只输出行数
+    "itersize": 2000,     # 流式查询每次从服务端拉取的行数
+    "connect_timeout": None,    # 建立连接的最长秒数，为空时不限制
+    "statement_timeout": None,  # 单条 SQL 的最长执行秒数，超时由服务端取消，为空时不限制
+    "cancel_grace": 5,    # 超过 statement_timeout 后仍未返回时，再等待几秒由客户端发送取消请求
+    "engine": "threads",  # 多分公司查询引擎：threads（DBUtils + 线程池）或 asyncio（utils/async_db.py）
+    "async_concurrency": 16,  # asyncio 引擎同时执行的分公司查询数
+}
+
+# 任务级期限，由 deadlines() 设置，fanout 工作线程继承
+_deadlines = contextvars.ContextVar("dbutils_deadlines", default=None)
+
+# 服务端取消查询的错误：pg/kingbase 的 query_canceled，mysql 的 max_execution_time 超时和 KILL QUERY
+_PG_CANCELED = "57014"
+_MYSQL_CANCELED = (3024, 1317)
+
+
+class QueryTimeout(TimeoutError):
+    """连接或 SQL 执行超过期限，stage 为 connect 或 statement"""
+
+    def __init__(self, message, company=None, stage="statement"):
+        super().__init__(message)
+        self.company = company
+        self.stage = stage
+
+def _get_settings(section: str) -> dict:
+    """读取共享配置中的全局配置节点"""
+    return get_config().get(section, {}) or {}
+
+
+def _get_pool_settings() -> dict:
+    return _get_settings("db_pool")
+
+
+def _get_query_setting(key: str):
+    return _get_settings("db_query").get(key, DEFAULT_QUERY_SETTINGS[key])
+
+
+def _to_dicts(columns, rows) -> list:
+    # mysql 使用 DictCursor 时行本身就是字典
+    return [row if isinstance(row, dict) else dict(zip(columns, row)) for row in rows]
+
+
+# 查询结果格式：
+#   dict     字典列表（默认）
+#   tuple    元组列表，直接使用驱动返回的行
+#   row      namedtuple 行，可按属性取值，内存与元组相同
+#   columns  按列的字典 {列名: array.array 或 list}，整数/浮点列使用紧凑的 array
+#   numpy    按列的字典 {列名: numpy.ndarray}，需要 numpy
+RESULT_FORMATS = ("dict", "tuple", "row", "columns", "numpy")
+_COLUMNAR = ("columns", "numpy")
+
+
+def _check_format(fmt: str):
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"不支持的结果格式: {fmt}，可选 {RESULT_FORMATS}")
+
+
+@functools.lru_cache(maxsize=256)
+def row_type(columns: tuple):
+    """列名相同的结果共用一个 namedtuple 类型；列名不是合法标识符时按位置重命名为 _0、_1 ..."""
+    return collections.namedtuple("Row", columns, rename=True)
+
+
+def _to_array(values: list):
+    """全部为整数（或全部为数值）的列转为 array('q') / array('d')，其余保留为 list"""
+    if values and all(type(value) is int for value in values):
+        try:
+            return array.array("q", values)
+        except OverflowError:
+            return values
+    if values and all(type(value) in (int, float) for value in values):
+        return array.array("d", values)
+    return values
+
+
+class ColumnarBuilder:
+    """逐批把游标返回的行转置为列，不为每一行构造字典"""
+
+    def __init__(self, columns, fmt="columns"):
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.rows = 0
+        self._chunks = [[] for _ in self.columns]
+
+    def add(self, rows):
+        if not rows:
+            return
+        self.rows += len(rows)
+        if isinstance(rows[0], dict):
+            rows = [tuple(row[name] for name in self.columns) for row in rows]
+        for chunk, values in zip(self._chunks, zip(*rows)):
+            chunk.append(values)
+
+    def build(self) -> dict:
+        if self.fmt == "numpy":
+            import numpy as np
+
+            return {
+                name: np.concatenate([np.asarray(values) for values in chunks]) if chunks else np.array([])
+                for name, chunks in zip(self.columns, self._chunks)
+            }
+        return {
+            name: _to_array(list(itertools.chain.from_iterable(chunks)))
+            for name, chunks in zip(self.columns, self._chunks)
+        }
+
+
+def convert_rows(columns, rows, fmt="dict"):
+    """驱动返回的行转为指定格式"""
+    if fmt == "dict":
+        return _to_dicts(columns, rows)
+    if fmt in _COLUMNAR:
+        builder = ColumnarBuilder(columns, fmt)
+        builder.add(rows)
+        return builder.build()
+    if rows and isinstance(rows[0], dict):
+        rows = [tuple(row[name] for name in columns) for row in rows]
+    if fmt == "row":
+        return list(map(row_type(tuple(columns))._make, rows))
+    return list(rows)
+
+
+def result_size(result) -> tuple:
+    """(行数, 近似字节数)，按列的结果按前若干行估算"""
+    if isinstance(result, dict):
+        columns = list(result.values())
+        count = len(columns[0]) if columns else 0
+        if not count:
+            return 0, 0
+        sample = list(zip(*(column[:100] for column in columns)))
+        return count, db_metrics.approx_bytes(sample) * count // len(sample)
+    return len(result), db_metrics.approx_bytes(result)
+
+
+def copy_result(result):
+    """查询去重命中时返回副本，避免调用方修改共享结果"""
+    if isinstance(result, dict):
+        return {name: copy(column) for name, column in result.items()}
+    if result and isinstance(result[0], dict):
+        return [dict(row) for row in result]
+    # 元组和 namedtuple 行不可修改，只复制列表
+    return list(result)
+
+
+@contextmanager
+def deadlines(connect_timeout=None, statement_timeout=None):
+    """
+    任务级连接、SQL 期限（秒）：with 块内（包括 fanout 工作线程）的查询生效，
+    与 db_query 全局配置、database.<ds> 数据源配置同时存在时取最小值
+    """
+    token = _deadlines.set({"connect_timeout": connect_timeout, "statement_timeout": statement_timeout})
+    try:
+        yield
+    finally:
+        _deadlines.reset(token)
+
+
+def resolve_timeout(key: str, db_config: dict):
+    """全局、数据源、任务三级期限中最小的一个，均未配置时返回 None"""
+    candidates = (_get_query_setting(key), db_config.get(key), (_deadlines.get() or {}).get(key))
+    values = [float(value) for value in candidates if value]
+    return min(values) if values else None
+
+
+def is_canceled(error) -> bool:
+    """是否为服务端因超时或取消请求中止的查询"""
+    if getattr(error, "pgcode", None) == _PG_CANCELED:
+        return True
+    args = getattr(error, "args", ())
+    return bool(args) and args[0] in _MYSQL_CANCELED
+
+
+def breaker_for(db_config: dict):
+    """物理库 (host, port, dbname) 的熔断器，circuit_breaker.enabled 为 false 时返回 None"""
+    settings = dict(_get_settings("circuit_breaker"))
+    settings.update(db_config.get("circuit_breaker") or {})
+    if not settings.get("enabled", True):
+        return None
+    breaker = circuit_breaker.get_breaker(db_config, settings)
+    db_metrics.note_breaker(breaker.key)
+    return breaker
+
+
+def summarize_rows(rows, limit=None) -> str:
+    """结果日志摘要：超过 limit 行时只输出前 limit 行和总行数"""
+    if limit is None:
+        limit = _get_query_setting("log_rows")
+    if len(rows) <= limit:
+        return str(rows)
+    return f"{rows[:limit]} ... 共 {len(rows)} 行"
+
+
+def open_connection(config: dict):
+    """按数据库配置新建一个物理连接"""
+    db_type = config.get("type")
+    host = config.get("host")
+    port = config.get("port")
+    user = config.get("user")
+    password = config.get("password")
+    dbname = config.get("name")
+    connect_timeout = resolve_timeout("connect_timeout", config)
+
+    # 数据库驱动在第一次建立连接时才导入，加快应用启动
+    if db_type == "mysql":
+        import pymysql
+        import pymysql.cursors
+
+        options = {"connect_timeout": connect_timeout} if connect_timeout else {}
+        return pymysql.connect(
+            host=host, port=port, user=user,
+            password=password, database=dbname,
+            charset="utf8mb4", cursorclass=pymysql.cursors.DictCursor, **options
+        )
+    elif db_type in ["kingbase", "postgres"] or db_type is None:
+        import psycopg2
+        # libpq 的 connect_timeout 为整数秒，最小 2 秒
+        options = {"connect_timeout": max(2, math.ceil(connect_timeout))} if connect_timeout else {}
+        return psycopg2.connect(
+            host=host, port=port, user=user,
+            password=password, dbname=dbname, **options
+        )
+    else :
+        raise ValueError(f"不支持的数据库类型: {db_type}")
+
+
+def _elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
 
 
 class DBUtils:
-    def __init__(self, config):
+    def __init__(self, config, pooled=True, company=None):
         self.config = config
         self.conn = None
+        # pooled=True 时从进程级连接池借出连接，close() 归还而不是断开
+        self.pooled = pooled
+        self.pool = None
+        # 埋点标签：分公司标识，pipeline id 取自 db_metrics.run_stats()
+        self.company = company
+        self._connect_ms = 0.0
+        self.breaker = None
+        # 数据库主机的准入名额，借出连接时占用，close() 时归还
+        self._admission = None
         self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
 
+    def _probe(self):
+        """半开探测：单独建立一个短超时连接执行 SELECT 1，不经过连接池"""
+        conn = open_connection(dict(self.config, connect_timeout=self.breaker.probe_timeout))
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+
+    def _breaker_success(self, latency_ms):
+        if self.breaker is not None:
+            self.breaker.record_success(latency_ms, db_metrics.run_logger(self.logger))
+
+    def _breaker_failure(self, error, connecting=False):
+        """只有连接失败或连接断开计入熔断；超时取消的查询说明数据库仍在响应"""
+        if self.breaker is None or is_canceled(error):
+            return
+        if circuit_breaker.is_connection_error(error, connecting=connecting, conn=self.conn):
+            self.breaker.record_failure(error, db_metrics.run_logger(self.logger))
+
     def connect(self):
-        db_type = self.config.get("type")
-        host = self.config.get("host")
-        port = self.config.get("port")
-        user = self.config.get("user")
-        password = self.config.get("password")
-        dbname = self.config.get("name")
-
-        if db_type == "mysql":
-            self.conn = pymysql.connect(
-                host=host, port=port, user=user,
-                password=password, database=dbname,
-                charset="utf8mb4", cursorclass=pymysql.cursors.DictCursor
-            )
-        elif db_type in ["kingbase", "postgres"] or db_type is None:
-            self.conn = psycopg2.connect(
-                host=host, port=port, user=user,
-                password=password, dbname=dbname
-            )
-        else :
-            raise ValueError(f"不支持的数据库类型: {db_type}")
-
-    def query(self, sql: str, params=None):
+        if self.conn is not None:
+            return
+        self.breaker = breaker_for(self.config)
+        if self.breaker is not None:
+            # 熔断中直接失败，不再等待连接超时
+            self.breaker.before_call(self._probe, db_metrics.run_logger(self.logger))
+        # 多个任务同时访问同一主机时超出名额的连接排队
+        self._admission = admission.acquire(admission.db_resource(self.config), self.logger)
+        start = time.perf_counter()
+        try:
+            if self.pooled:
+                self.pool = db_pool.get_pool(self.config, lambda: open_connection(self.config),
+                                             **_get_pool_settings())
+                self.conn = self.pool.acquire()
+            else:
+                self.conn = open_connection(self.config)
+        except Exception as e:
+            elapsed_ms = _elapsed_ms(start)
+            self._release_admission()
+            self._record("connect", None, connect_ms=elapsed_ms, ok=False)
+            if isinstance(e, db_pool.PoolTimeout):
+                # 本地连接池耗尽，不是数据库连接超时
+                raise
+            self._breaker_failure(e, connecting=True)
+            timeout = resolve_timeout("connect_timeout", self.config)
+            if isinstance(e, TimeoutError) or (timeout and elapsed_ms >= timeout * 1000 * 0.9):
+                raise QueryTimeout(f"分公司 {self.company} 连接数据库超时({elapsed_ms / 1000:.1f}s): {e}",
+                                   company=self.company, stage="connect") from e
+            raise
+        # 连接耗时计入随后的第一次 query/execute
+        self._connect_ms += _elapsed_ms(start)
+
+    def _record(self, operation, sql, connect_ms=None, execute_ms=0.0, fetch_ms=0.0, rows=0, nbytes=0, ok=True):
+        if connect_ms is None:
+            connect_ms, self._connect_ms = self._connect_ms, 0.0
+        db_metrics.record(db_metrics.QueryRecord(
+            operation, company=self.company or self.config.get("name"),
+            fingerprint=db_metrics.fingerprint(sql) if sql else None,
+            connect_ms=connect_ms, execute_ms=execute_ms, fetch_ms=fetch_ms,
+            rows=rows, bytes=nbytes, ok=ok,
+        ))
+
+    @property
+    def is_mysql(self) -> bool:
+        return self.config.get("type") == "mysql"
+
+    def _set_statement_timeout(self, timeout):
+        """
+        设置服务端语句超时：pg/kingbase 用 SET LOCAL，事务结束（连接归还时回滚）自动失效；
+        mysql 用会话级 max_execution_time，查询结束后由调用方重置
+        """
+        with self.conn.cursor() as cursor:
+            if self.is_mysql:
+                cursor.execute("SET SESSION max_execution_time = %s", (int(timeout * 1000) if timeout else 0,))
+            else:
+                cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout * 1000),))
+
+    def _cancel(self, sql):
+        """客户端主动取消仍在执行的查询，服务端未按 statement_timeout 中止或网络无响应时使用"""
+        self.logger.warning("分公司 %s 查询超过期限仍未返回，发送取消请求: %s", self.company, sql)
+        try:
+            if self.is_mysql:
+                # pymysql 不支持 cancel，另开连接执行 KILL QUERY
+                killer = open_connection(self.config)
+                try:
+                    with killer.cursor() as cursor:
+                        cursor.execute("KILL QUERY %s", (self.conn.thread_id(),))
+                finally:
+                    killer.close()
+            else:
+                self.conn.cancel()
+        except Exception as e:
+            self.logger.error("分公司 %s 取消查询失败: %s", self.company, e)
+
+    @contextmanager
+    def _watchdog(self, sql, timeout):
+        if not timeout:
+            yield
+            return
+        timer = threading.Timer(timeout + float(_get_query_setting("cancel_grace") or 0), self._cancel, (sql,))
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+    def _timeout_error(self, error, timeout, elapsed_ms):
+        self.logger.error("分公司 %s 查询超时(期限 %ss，已执行 %.1fs)，已由服务端取消",
+                          self.company, timeout, elapsed_ms / 1000)
+        return QueryTimeout(f"分公司 {self.company} 查询超时({timeout}s): {error}", company=self.company)
+
+    def _cursor(self, fmt="dict"):
+        """mysql 的连接默认使用 DictCursor，非 dict 格式改用元组游标，避免驱动先构造字典"""
+        if self.is_mysql and fmt != "dict":
+            import pymysql.cursors
+            return self.conn.cursor(pymysql.cursors.Cursor)
+        return self.conn.cursor()
+
+    def query(self, sql: str, params=None, memoize=True, fmt="dict"):
+        """
+        执行查询，按 fmt 返回结果（默认字典列表，可选格式见 RESULT_FORMATS）。
+        处于 query_memo.run_scope() 中时，同一物理库上相同的 SQL 只会执行一次。
+        """
+        _check_format(fmt)
+        memo = query_memo.current_memo() if memoize else None
+        if memo is None:
+            return self._query(sql, params, fmt)
+        key = (query_memo.dsn_key(self.config), query_memo.normalize_sql(sql), repr(params), fmt)
+        result = memo.get_or_compute(key, lambda: self._query(sql, params, fmt))
+        # 返回副本，避免调用方修改共享结果
+        return copy_result(result)
+
+    def _fetch(self, cursor, columns, fmt):
+        if fmt in _COLUMNAR:
+            # 按批转置，不需要先取回全部行再转换
+            builder = ColumnarBuilder(columns, fmt)
+            itersize = _get_query_setting("itersize")
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    return builder.build()
+                builder.add(rows)
+        return convert_rows(columns, cursor.fetchall(), fmt)
+
+    def _query(self, sql: str, params=None, fmt="dict"):
         if self.conn is None:
             self.connect()
-        with self.conn.cursor() as cursor:
+        execute_ms = fetch_ms = 0.0
+        result = []
+        ok = False
+        timeout = resolve_timeout("statement_timeout", self.config)
+        begin = time.perf_counter()
+        try:
+            if timeout:
+                self._set_statement_timeout(timeout)
+            with self._cursor(fmt) as cursor, self._watchdog(sql, timeout):
+                start = time.perf_counter()
+                if params is None:
+                    cursor.execute(sql)
+                else:
+                    cursor.execute(sql, params)
+                execute_ms = _elapsed_ms(start)
+                self.logger.info("当前执行sql:%s", sql)
+                # 获取列名
+                columns = [desc[0] for desc in cursor.description]
+                start = time.perf_counter()
+                # 按 fmt 组装结果，默认为字典列表
+                result = self._fetch(cursor, columns, fmt)
+                fetch_ms = _elapsed_ms(start)
+                if isinstance(result, dict):
+                    self.logger.info("SQL执行结果: 按列返回 %d 行，列 %s", result_size(result)[0], list(result))
+                else:
+                    self.logger.info("SQL执行结果:%s", summarize_rows(result))
+                ok = True
+                self._breaker_success(execute_ms + fetch_ms)
+                return result
+        except Exception as e:
+            self._breaker_failure(e)
+            if timeout and is_canceled(e):
+                raise self._timeout_error(e, timeout, _elapsed_ms(begin)) from e
+            raise
+        finally:
+            if timeout and self.is_mysql:
+                self._reset_mysql_timeout()
+            rows, nbytes = result_size(result)
+            self._record("query", sql, execute_ms=execute_ms, fetch_ms=fetch_ms, rows=rows, nbytes=nbytes, ok=ok)
+
+    def _reset_mysql_timeout(self):
+        try:
+            self._set_statement_timeout(None)
+        except Exception:
+            pass
+
+    def iter_query(self, sql: str, params=None, batch_size=None, fmt="dict"):
+        """
+        流式查询，按批返回结果（默认字典列表，fmt 可选格式见 RESULT_FORMATS，按列格式每批一个字典），
+        内存占用与 batch_size 成正比。
+        pg/kingbase 使用服务端命名游标，mysql 使用 SSCursor，不会一次性拉取全部结果。
+        每批调用一次 fetchmany(batch_size)，即每次从服务端拉取 batch_size 行（命名游标为一次 FETCH），
+        batch_size 默认取 db_query.itersize 配置。
+        """
+        _check_format(fmt)
+        if batch_size is None:
+            batch_size = _get_query_setting("itersize")
+        if self.conn is None:
+            self.connect()
+        # 流式查询只设置服务端超时：每次 FETCH 单独计时，消费方处理批次的时间不计入
+        timeout = resolve_timeout("statement_timeout", self.config)
+        if timeout:
+            self._set_statement_timeout(timeout)
+        if self.is_mysql:
+            import pymysql.cursors
+            cursor = self.conn.cursor(pymysql.cursors.SSCursor)
+        else:
+            cursor = self.conn.cursor(name=f"dbutils_{uuid.uuid4().hex[:12]}")
+        total = nbytes = 0
+        execute_ms = fetch_ms = 0.0
+        ok = False
+        try:
+            start = time.perf_counter()
             if params is None:
                 cursor.execute(sql)
             else:
                 cursor.execute(sql, params)
-            self.logger.info(f"当前执行sql:{sql}")
-            # 获取列名
-            columns = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchall()
-            # 组装成字典列表
-            result = [dict(zip(columns, row)) for row in rows]
-            self.logger.info(f"SQL执行结果:{result}")
-            return result
+            execute_ms = _elapsed_ms(start)
+            self.logger.info("当前执行流式sql:%s", sql)
+            columns = None
+            while True:
+                start = time.perf_counter()
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    fetch_ms += _elapsed_ms(start)
+                    break
+                if columns is None:
+                    # 命名游标在第一次 fetch 之后才有 description
+                    columns = [desc[0] for desc in cursor.description]
+                batch = convert_rows(columns, rows, fmt)
+                fetch_ms += _elapsed_ms(start)
+                count, size = result_size(batch)
+                total += count
+                nbytes += size
+                yield batch
+            ok = True
+            self._breaker_success(execute_ms + fetch_ms)
+        except Exception as e:
+            self._breaker_failure(e)
+            if timeout and is_canceled(e):
+                raise self._timeout_error(e, timeout, execute_ms + fetch_ms) from e
+            raise
+        finally:
+            cursor.close()
+            if timeout and self.is_mysql:
+                self._reset_mysql_timeout()
+            self.logger.info("流式sql执行结束，共返回 %d 行", total)
+            self._record("iter_query", sql, execute_ms=execute_ms, fetch_ms=fetch_ms,
+                         rows=total, nbytes=nbytes, ok=ok)
+
+    def iter_rows(self, sql: str, params=None, batch_size=None, fmt="dict"):
+        """逐行返回的流式查询，fmt 为 dict / tuple / row，batch_size 为每次从服务端拉取的行数"""
+        if fmt in _COLUMNAR:
+            raise ValueError("iter_rows 不支持按列格式，请使用 iter_query")
+        return itertools.chain.from_iterable(self.iter_query(sql, params, batch_size=batch_size, fmt=fmt))
 
     def execute(self, sql: str, params=None):
         if self.conn is None:
             self.connect()
-        with self.conn.cursor() as cursor:
-            cursor.execute(sql, params or ())
-            self.conn.commit()
+        start = time.perf_counter()
+        ok = False
+        rowcount = 0
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(sql, params or ())
+                self.conn.commit()
+                rowcount = max(cursor.rowcount, 0)
+            ok = True
+        finally:
+            self._record("execute", sql, execute_ms=_elapsed_ms(start), rows=rowcount, ok=ok)
+
+    def _release_admission(self):
+        if self._admission is not None:
+            self._admission.release()
+            self._admission = None
 
     def close(self):
         if self.conn:
-            self.conn.close()
+            if self.pool is not None:
+                # 查询中断开的连接直接关闭，不放回连接池
+                self.pool.release(self.conn, discard=db_pool.is_broken(self.conn))
+            else:
+                self.conn.close()
             self.conn = None
+        self._release_admission()
+
+    def __enter__(self):
+        # 连接在第一次 query/execute 时才借出，命中查询去重时不占用连接
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
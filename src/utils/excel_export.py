@@ -0,0 +1,170 @@
+# utils/excel_export.py
+"""
+    表级明细导出：按分公司用 DBUtils.iter_query 流式读取，逐行写入 openpyxl write_only 工作簿（或 CSV），
+    每个分公司一个 sheet / 文件，内存占用只与批大小有关，与总行数无关。
+    xlsx 模式保留模板前 header_rows 行的表头（值、样式、行高、合并单元格）和列宽，
+    数据行沿用模板第一行数据的列样式。
+"""
+import csv
+import logging
+from copy import copy
+from pathlib import Path
+
+from src.utils import dbutils, template_registry
+from src.utils.template_registry import TemplateHeader, sheet_title
+
+default_logger = logging.getLogger(__name__)
+
+
+class XlsxDetailWriter:
+    """write_only 工作簿：已写入的行由 openpyxl 落到临时文件，不在内存中保留"""
+
+    def __init__(self, path, header: TemplateHeader = None):
+        import openpyxl
+
+        self.path = Path(path)
+        self.header = header
+        self.workbook = openpyxl.Workbook(write_only=True)
+
+    def _styled_cell(self, ws, value, style):
+        from openpyxl.cell import WriteOnlyCell
+
+        cell = WriteOnlyCell(ws, value=value)
+        for attr, attr_value in style.items():
+            setattr(cell, attr, attr_value)
+        return cell
+
+    def add_sheet(self, title: str, columns=None):
+        """新建 sheet 并写入模板表头，columns 不为空时替换最后一行表头的列名"""
+        ws = self.workbook.create_sheet(sheet_title(title))
+        header = self.header
+        if header is None:
+            if columns:
+                ws.append(list(columns))
+            return _XlsxSheet(ws, [])
+        for key, width in header.widths.items():
+            ws.column_dimensions[key].width = width
+        for index, height in header.heights.items():
+            ws.row_dimensions[index].height = height
+        for cell_range in header.merged:
+            ws.merged_cells.add(cell_range)
+        for index, row in enumerate(header.rows):
+            cells = list(row)
+            if columns and index == len(header.rows) - 1:
+                # 列数多于模板时沿用最后一列的样式
+                last_style = cells[-1][1] if cells else {}
+                cells = [(label, cells[i][1] if i < len(cells) else last_style) for i, label in enumerate(columns)]
+            ws.append([self._styled_cell(ws, value, style) for value, style in cells])
+        # 每列一个带样式的原型单元格，数据行复制其样式索引，避免逐个单元格重复登记样式
+        prototypes = [self._styled_cell(ws, None, style) for style in header.data_styles]
+        return _XlsxSheet(ws, prototypes)
+
+    def close(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.workbook.save(str(self.path))
+
+
+class _XlsxSheet:
+    def __init__(self, ws, prototypes):
+        self.ws = ws
+        self.prototypes = prototypes
+        self.rows = 0
+
+    def append(self, values):
+        if self.prototypes:
+            from openpyxl.cell import WriteOnlyCell
+
+            last = self.prototypes[-1]
+            cells = []
+            for i, value in enumerate(values):
+                cell = WriteOnlyCell(self.ws, value=value)
+                cell._style = copy((self.prototypes[i] if i < len(self.prototypes) else last)._style)
+                cells.append(cell)
+            self.ws.append(cells)
+        else:
+            self.ws.append(list(values))
+        self.rows += 1
+
+    def close(self):
+        pass
+
+
+class CsvDetailWriter:
+    """CSV 模式：path 为目录，每个分公司一个 utf-8-sig 编码的 csv 文件，Excel 可直接打开"""
+
+    def __init__(self, path, header: TemplateHeader = None):
+        self.path = Path(path)
+        self.header = header
+        self.files = []
+
+    def add_sheet(self, title: str, columns=None):
+        self.path.mkdir(parents=True, exist_ok=True)
+        file_path = self.path / f"{sheet_title(title)}.csv"
+        self.files.append(file_path)
+        labels = columns or (self.header.labels if self.header else None)
+        return _CsvSheet(file_path, labels)
+
+    def close(self):
+        pass
+
+
+class _CsvSheet:
+    def __init__(self, file_path, labels):
+        self.file = open(file_path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+        self.rows = 0
+        if labels:
+            self.writer.writerow(labels)
+
+    def append(self, values):
+        self.writer.writerow(values)
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+
+WRITERS = {"xlsx": XlsxDetailWriter, "csv": CsvDetailWriter}
+
+
+def open_writer(fmt: str, output, template=None, header_rows=2, columns=None):
+    """按格式创建明细写入器；CSV 模式在配置了列名时不读取模板"""
+    if fmt not in WRITERS:
+        raise ValueError(f"不支持的明细导出格式: {fmt}，可选 {sorted(WRITERS)}")
+    header = None
+    if template and (fmt == "xlsx" or not columns):
+        # 模板表头由注册表解析并缓存，多次导出不重复加载模板
+        header = template_registry.get_template(template).header(header_rows)
+    return WRITERS[fmt](output, header)
+
+
+def export_detail(companies, get_database, sql: str, output, fmt="xlsx", template=None, header_rows=2,
+                  columns=None, params=None, sheet_name=None, batch_size=None, logger=None) -> dict:
+    """
+    逐个分公司流式导出明细，返回 {分公司: 行数}。
+    get_database(company) 返回数据源配置，sheet_name(company) 返回 sheet 名称（默认分公司编码）。
+    单个分公司查询失败时记录错误并继续导出其它分公司。
+    """
+    if logger is None:
+        logger = default_logger
+    writer = open_writer(fmt, output, template, header_rows, columns)
+    counts = {}
+    try:
+        for company in companies:
+            sheet = writer.add_sheet(sheet_name(company) if sheet_name else company, columns)
+            try:
+                with dbutils.DBUtils(get_database(company), company=company) as db:
+                    # 元组行直接写入，不经过字典
+                    for batch in db.iter_query(sql, params, batch_size=batch_size, fmt="tuple"):
+                        for row in batch:
+                            sheet.append(row)
+            except Exception as e:
+                logger.error("分公司 %s 明细导出失败，已写入 %d 行: %s", company, sheet.rows, e)
+            finally:
+                sheet.close()
+            counts[company] = sheet.rows
+            logger.info("分公司 %s 明细导出 %d 行", company, sheet.rows)
+    finally:
+        writer.close()
+    logger.info("明细导出完成: %s，共 %d 行", output, sum(counts.values()))
+    return counts
@@ -0,0 +1,55 @@
+# utils/fanout.py
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 4
+
+default_logger = logging.getLogger(__name__)
+
+
+def _timed_call(func, company, logger, on_error=None):
+    start = time.perf_counter()
+    try:
+        return func(company)
+    except Exception as e:
+        if on_error is None:
+            raise
+        logger.error("分公司 %s 执行失败，按未完成处理: %s", company, e)
+        return on_error(company, e)
+    finally:
+        elapsed = time.perf_counter() - start
+        logger.info("分公司 %s 执行耗时 %.3fs", company, elapsed)
+
+
+def run_by_company(companies, func, max_workers=None, logger=None, on_error=None):
+    """
+    按分公司并发执行 func(company)，返回结果顺序与 companies 一致。
+    max_workers 为 1 时退化为顺序执行；总耗时约等于最慢的分公司。
+    传入 on_error(company, exc) 时单个分公司失败不影响其它分公司，该分公司的结果为 on_error 的返回值。
+    """
+    if logger is None:
+        logger = default_logger
+    companies = list(companies or [])
+    if not companies:
+        return []
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+    max_workers = max(1, min(int(max_workers), len(companies)))
+
+    start = time.perf_counter()
+    if max_workers == 1:
+        results = [_timed_call(func, company, logger, on_error) for company in companies]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout") as executor:
+            # 每个任务复制一份当前上下文，保证 contextvars 在工作线程中可见
+            futures = [
+                executor.submit(contextvars.copy_context().run, _timed_call, func, company, logger, on_error)
+                for company in companies
+            ]
+            # 按提交顺序取结果，保证短信、Excel 中分公司顺序稳定
+            results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    logger.info("共 %d 家分公司执行完成，并发数 %d，总耗时 %.3fs", len(companies), max_workers, elapsed)
+    return results
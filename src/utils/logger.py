@@ -1,23 +1,103 @@
 # core/logger.py
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
 LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True)
 
+# 日志队列容量，队列满时丢弃日志并计数，业务线程不会阻塞在文件 IO 上
+QUEUE_SIZE = 10000
+# 单条日志消息最大字符数，超出部分截断（例如整段 SQL 结果、短信内容）
+MAX_MESSAGE_LENGTH = 4000
+
+
+def truncate(text: str, limit: int = MAX_MESSAGE_LENGTH) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...(已截断，共 {len(text)} 字符)"
+    return text
+
+
+class TruncatingFormatter(logging.Formatter):
+    """对超长消息截断的 Formatter"""
+
+    def __init__(self, fmt=None, datefmt=None, max_length=MAX_MESSAGE_LENGTH):
+        super().__init__(fmt, datefmt)
+        self.max_length = max_length
+
+    def formatMessage(self, record):
+        # 经过 DroppingQueueHandler 的日志已在入队时截断
+        if not getattr(record, "truncated", False):
+            record.message = truncate(record.message, self.max_length)
+        return super().formatMessage(record)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """非阻塞的 QueueHandler：队列满时丢弃日志并计数，下次入队成功时补一条丢弃告警"""
+
+    def __init__(self, log_queue, max_length=MAX_MESSAGE_LENGTH):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.dropped = 0
+        self._unreported = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # 在调用线程中完成 %-格式化（参数可能随后被修改），并截断超长消息以限制队列内存
+        record = super().prepare(record)
+        record.msg = truncate(record.msg, self.max_length)
+        record.truncated = True
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+        if self._unreported:
+            with self._lock:
+                count, self._unreported = self._unreported, 0
+            if count:
+                warning = logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"日志队列已满，丢弃 {count} 条日志（累计 {self.dropped} 条）",
+                })
+                try:
+                    self.queue.put_nowait(warning)
+                except queue.Full:
+                    with self._lock:
+                        self._unreported += count
+
+
 logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 logger.setLevel(logging.INFO)
 
 # 控制台输出
 console_handler = logging.StreamHandler()
-console_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+console_formatter = TruncatingFormatter("%(asctime)s - %(levelname)s - %(message)s")
 console_handler.setFormatter(console_formatter)
-logger.addHandler(console_handler)
 
 # 文件输出（滚动日志）
 file_handler = RotatingFileHandler(LOG_DIR / "service.log", maxBytes=5*1024*1024, backupCount=3)
-file_formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+file_formatter = TruncatingFormatter("%(asctime)s - %(levelname)s - %(message)s")
 file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
+
+# 业务线程只把日志放入有界队列，由后台 listener 线程写控制台和文件
+log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+logger.addHandler(queue_handler)
+listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+
+def dropped_count() -> int:
+    """因队列已满被丢弃的日志条数"""
+    return queue_handler.dropped
@@ -0,0 +1,96 @@
+# utils/metric_compiler.py
+"""
+    把 config.yaml 中声明的指标（name / label / table / filter）编译成单次扫描的聚合 SQL：
+    同一张表上的所有指标合并为一个 count(*) FILTER (WHERE ...) 查询，每张表只扫描一次；
+    多张表的聚合结果通过 cross join 拼成一行，一次数据库往返取回全部指标。
+"""
+import re
+
+_NAME_PATTERN = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def render_metrics(metrics, params: dict) -> list:
+    """用 SQL 模板参数填充每个指标的 table / filter，返回新的指标列表"""
+    rendered = []
+    for metric in metrics:
+        name = metric.get("name", "")
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"指标名称只能包含小写字母、数字和下划线: {name!r}")
+        if not metric.get("table"):
+            raise ValueError(f"指标 {name} 未配置 table")
+        item = dict(metric)
+        item["table"] = metric["table"].format(**params).strip()
+        if metric.get("filter"):
+            item["filter"] = " ".join(str(metric["filter"]).format(**params).split())
+        for key in ("period", "cutoff"):
+            if metric.get(key) is not None:
+                item[key] = str(metric[key]).format(**params)
+        rendered.append(item)
+    return rendered
+
+
+def group_by_table(metrics) -> dict:
+    """按（填充后的）表名分组，保持配置顺序"""
+    groups = {}
+    for metric in metrics:
+        groups.setdefault(metric["table"], []).append(metric)
+    return groups
+
+
+def _aggregate(metric, use_filter: bool) -> str:
+    agg = metric.get("agg", "count")
+    condition = metric.get("filter")
+    if agg == "count":
+        value = "1"
+    elif agg == "sum":
+        if not metric.get("column"):
+            raise ValueError(f"指标 {metric['name']} 的 agg 为 sum 时必须配置 column")
+        value = metric["column"]
+    else:
+        raise ValueError(f"不支持的聚合方式: {agg}")
+
+    if not condition:
+        expr = "count(*)" if agg == "count" else f"coalesce(sum({value}), 0)"
+    elif use_filter:
+        expr = "count(*)" if agg == "count" else f"sum({value})"
+        expr = f"{expr} FILTER (WHERE {condition})"
+        if agg == "sum":
+            expr = f"coalesce({expr}, 0)"
+    else:
+        # mysql 不支持 FILTER 子句，改用 SUM(CASE ...)
+        expr = f"coalesce(sum(CASE WHEN {condition} THEN {value} ELSE 0 END), 0)"
+    return f"{expr} AS {metric['name']}"
+
+
+def compile_table_query(table: str, metrics, dialect=None) -> str:
+    """单张表上的全部指标编译为一个聚合查询"""
+    use_filter = dialect != "mysql"
+    conditions = [metric.get("filter") for metric in metrics]
+    distinct = list(dict.fromkeys(conditions))
+    if len(distinct) == 1 and distinct[0]:
+        # 所有指标条件相同，直接放到 WHERE 中，无需逐列过滤
+        metrics = [{**metric, "filter": None} for metric in metrics]
+    columns = ",\n       ".join(_aggregate(metric, use_filter) for metric in metrics)
+    sql = f"SELECT {columns}\nFROM {table}"
+    if all(conditions):
+        # 各指标条件取并集作为 WHERE，便于利用 mr_month 等索引缩小扫描范围
+        sql += "\nWHERE " + " OR ".join(f"({c})" for c in distinct)
+    return sql
+
+
+def compile_metrics(metrics, dialect=None) -> str:
+    """所有表的聚合查询拼成一条 SQL，返回一行、列名即指标名"""
+    groups = group_by_table(metrics)
+    if not groups:
+        raise ValueError("未配置任何指标")
+    parts = [compile_table_query(table, items, dialect) for table, items in groups.items()]
+    if len(parts) == 1:
+        return parts[0]
+    subqueries = [f"({part}) t{i}" for i, part in enumerate(parts)]
+    return "SELECT *\nFROM " + "\nCROSS JOIN ".join(subqueries)
+
+
+def map_result(metrics, rows, missing=-1) -> dict:
+    """把查询结果按指标 label（未配置时用 name）映射，缺失的指标填 missing"""
+    row = rows[0] if rows else {}
+    return {metric.get("label", metric["name"]): row.get(metric["name"], missing) for metric in metrics}
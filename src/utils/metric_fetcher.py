@@ -0,0 +1,111 @@
+# utils/metric_fetcher.py
+import logging
+
+from src.utils import approx_count, async_db, dbutils, metric_compiler
+from src.utils import metric_history as metric_history_module
+from src.utils import metrics_cache as metrics_cache_module
+
+logger = logging.getLogger(__name__)
+
+
+def get_metrics_cache(config):
+    """按 config.yaml 的 metrics_cache 配置获取历史指标缓存，未开启时返回 None"""
+    if not config.get("metrics_cache.enabled", False):
+        return None
+    path = config.get("metrics_cache.path")
+    if path:
+        path = config.root_dir / path
+    return metrics_cache_module.get_cache(path)
+
+
+def get_metric_history(config):
+    """按 config.yaml 的 metric_history 配置获取指标历史，未开启时返回 None"""
+    if not config.get("metric_history.enabled", False):
+        return None
+    path = config.get("metric_history.path")
+    if path:
+        path = config.root_dir / path
+    return metric_history_module.get_history(path)
+
+
+def lookup_history(company: str, metrics, history) -> dict:
+    """
+    配置了 from_history: {metric: 指标名, offset: month|year} 的指标直接取本地历史中上月同日 / 去年同日的值，
+    历史中没有记录时返回结果里不包含该指标，仍查询数据库
+    """
+    values = {}
+    for metric in metrics:
+        source = metric.get("from_history")
+        if not source:
+            continue
+        value = history.value_at_offset(company, source["metric"], source.get("offset", "month"))
+        if value is not None:
+            values[metric["name"]] = value
+    if values:
+        logger.info("分公司 %s 从本地指标历史读取 %d 项: %s", company, len(values), list(values))
+    return values
+
+
+def local_values(company: str, metrics, cache=None, history=None) -> dict:
+    """本地缓存和指标历史中已有的指标值"""
+    values = cache.lookup(company, metrics) if cache is not None else {}
+    if history is not None:
+        values.update(lookup_history(company, [m for m in metrics if m["name"] not in values], history))
+    return values
+
+
+def fetch_metrics(company: str, db_config: dict, metrics, cache=None, history=None, job=None, record=True) -> dict:
+    """
+    查询一个分公司的全部指标，返回 {name: value}。
+    已关账周期的指标优先读本地缓存，配置了 from_history 的指标读本地历史，只有未命中的指标才编译进 SQL 查询数据库。
+    传入 history 时本次结果写入指标历史；record 为 False 时历史只用于查询，不写入。
+    """
+    values = local_values(company, metrics, cache, history)
+    live = [metric for metric in metrics if metric["name"] not in values]
+    if live:
+        sql = metric_compiler.compile_metrics(live, dialect=db_config.get("type"))
+        # 连接从进程级连接池借出，退出 with 时归还
+        with dbutils.DBUtils(db_config, company=company) as db:
+            rows = db.query(sql)
+        if rows:
+            values.update(rows[0])
+        if cache is not None:
+            cache.store(company, live, values)
+    if history is not None and record:
+        history.record(company, values, job=job)
+    return values
+
+
+async def fetch_metrics_async(company: str, db_config: dict, metrics, cache=None, history=None, job=None,
+                              record=True) -> dict:
+    """fetch_metrics 的 asyncio 版本，数据库查询使用 async_db.AsyncDBUtils，其余逻辑相同"""
+    values = local_values(company, metrics, cache, history)
+    live = [metric for metric in metrics if metric["name"] not in values]
+    if live:
+        sql = metric_compiler.compile_metrics(live, dialect=db_config.get("type"))
+        async with async_db.AsyncDBUtils(db_config, company=company) as db:
+            rows = await db.query(sql)
+        if rows:
+            values.update(rows[0])
+        if cache is not None:
+            cache.store(company, live, values)
+    if history is not None and record:
+        history.record(company, values, job=job)
+    return values
+
+
+def estimate_metrics(company: str, db_config: dict, metrics, cache=None, history=None, settings=None):
+    """
+    近似模式：本地缓存、历史命中的指标为精确值（误差 0），其余指标按采样或规划器统计估算。
+    返回 ({name: value}, {name: ± 误差或 None})；估算值不写入缓存和指标历史
+    """
+    values = local_values(company, metrics, cache, history)
+    errors = {name: 0 for name in values}
+    live = [metric for metric in metrics if metric["name"] not in values]
+    if live:
+        with dbutils.DBUtils(db_config, company=company) as db:
+            estimates = approx_count.estimate_metrics(db, live, dialect=db_config.get("type"), settings=settings)
+        for name, estimate in estimates.items():
+            values[name] = estimate.value
+            errors[name] = estimate.error
+    return values, errors
@@ -0,0 +1,195 @@
+# utils/metric_history.py
+"""
+    分公司指标历史（SQLite）：每次运行的 {分公司: {指标: 值}} 按 (company, metric, run_date) 保存，同一天重复运行以最后一次为准。
+    - series() / query(): 按分公司、指标、日期范围查询趋势
+    - compare(): 与上月同日、去年同日的环比 / 同比，直接读本地历史，不再扫描 water_meter_read_his_* 表
+    命令行：
+        python -m src.utils.metric_history series --company ds_dx --metric hb_actual --start 2025-09-01 --end 2025-09-30
+        python -m src.utils.metric_history compare --metric hb_actual [--date 2025-10-05]
+"""
+import argparse
+import calendar
+import datetime
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).parent.parent.resolve() / "data" / "metric_history.db"
+
+# 主键即 (company, metric, run_date) 聚簇索引，按分公司 + 指标 + 日期范围查询只需一次范围扫描
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_history (
+    company   TEXT NOT NULL,
+    metric    TEXT NOT NULL,
+    run_date  TEXT NOT NULL,
+    value     INTEGER NOT NULL,
+    job       TEXT,
+    run_at    TEXT NOT NULL,
+    PRIMARY KEY (company, metric, run_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_metric_history_metric_date ON metric_history (metric, run_date);
+"""
+
+
+def _as_date(value) -> datetime.date:
+    if value is None:
+        return datetime.date.today()
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
+
+
+def shift_months(day: datetime.date, months: int) -> datetime.date:
+    """按月平移，目标月份没有该日时取月末（例如 3 月 31 日的上月同日为 2 月 28/29 日）"""
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    month += 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+OFFSETS = {"month": -1, "year": -12}
+
+
+class MetricHistory:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else DEFAULT_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    def record(self, company: str, values: dict, run_date=None, job=None) -> int:
+        """保存一个分公司本次运行的指标 {name: value}，未查询到（缺失或为负数）的值不保存"""
+        run_date = _as_date(run_date).isoformat()
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        rows = [
+            (company, name, run_date, int(value), job, now)
+            for name, value in values.items()
+            if value is not None and value >= 0
+        ]
+        if rows:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO metric_history (company, metric, run_date, value, job, run_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.commit()
+        return len(rows)
+
+    def query(self, company=None, metric=None, start=None, end=None) -> list:
+        """按条件查询历史，返回按 (company, metric, run_date) 排序的字典列表"""
+        conditions, params = [], []
+        for column, value in (("company", company), ("metric", metric)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if start:
+            conditions.append("run_date >= ?")
+            params.append(_as_date(start).isoformat())
+        if end:
+            conditions.append("run_date <= ?")
+            params.append(_as_date(end).isoformat())
+        sql = "SELECT company, metric, run_date, value FROM metric_history"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY company, metric, run_date"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{"company": c, "metric": m, "run_date": d, "value": v} for c, m, d, v in rows]
+
+    def series(self, company: str, metric: str, start=None, end=None) -> list:
+        """单个分公司单个指标的 [(run_date, value)]"""
+        return [(row["run_date"], row["value"]) for row in self.query(company, metric, start, end)]
+
+    def value_on(self, company: str, metric: str, day) -> object:
+        """
+        指定日期的值；当天没有运行记录时取同一个月内该日期之前最近的一次，仍没有时返回 None
+        """
+        day = _as_date(day)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM metric_history WHERE company = ? AND metric = ? AND run_date <= ? "
+                "AND run_date >= ? ORDER BY run_date DESC LIMIT 1",
+                (company, metric, day.isoformat(), day.replace(day=1).isoformat()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def value_at_offset(self, company: str, metric: str, offset: str, run_date=None):
+        """上月同日(offset=month) / 去年同日(offset=year) 的值"""
+        return self.value_on(company, metric, shift_months(_as_date(run_date), OFFSETS[offset]))
+
+    def compare(self, metric: str, run_date=None, companies=None) -> dict:
+        """
+        各分公司指标的环比、同比：
+        {company: {"current", "mom", "mom_delta", "mom_ratio", "yoy", "yoy_delta", "yoy_ratio"}}
+        """
+        run_date = _as_date(run_date)
+        if companies is None:
+            with self._lock:
+                companies = [row[0] for row in self._conn.execute(
+                    "SELECT DISTINCT company FROM metric_history WHERE metric = ? ORDER BY company", (metric,))]
+        result = {}
+        for company in companies:
+            current = self.value_on(company, metric, run_date)
+            item = {"current": current}
+            for key, offset in (("mom", "month"), ("yoy", "year")):
+                base = self.value_at_offset(company, metric, offset, run_date)
+                item[key] = base
+                item[f"{key}_delta"] = current - base if current is not None and base is not None else None
+                item[f"{key}_ratio"] = round(current / base, 4) if current is not None and base else None
+            result[company] = item
+        return result
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_history(path=None) -> MetricHistory:
+    """按文件路径获取进程内共享的历史实例"""
+    path = Path(path) if path else DEFAULT_PATH
+    with _instances_lock:
+        history = _instances.get(path)
+        if history is None:
+            history = MetricHistory(path)
+            _instances[path] = history
+        return history
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分公司指标历史查询")
+    parser.add_argument("action", choices=["series", "compare"])
+    parser.add_argument("--path", default=None, help="历史文件路径，默认 src/data/metric_history.db")
+    parser.add_argument("--company", default=None)
+    parser.add_argument("--metric", required=True)
+    parser.add_argument("--start", default=None, help="例如 2025-09-01")
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--date", default=None, help="对比日期，默认今天")
+    args = parser.parse_args(argv)
+    history = MetricHistory(args.path)
+    try:
+        if args.action == "series":
+            for row in history.query(args.company, args.metric, args.start, args.end):
+                print(f"{row['company']}\t{row['run_date']}\t{row['value']}")
+        else:
+            companies = [args.company] if args.company else None
+            print("分公司\t本期\t上月同日\t环比差\t去年同日\t同比差")
+            for company, item in history.compare(args.metric, args.date, companies).items():
+                print("\t".join(str(value) for value in (
+                    company, item["current"], item["mom"], item["mom_delta"], item["yoy"], item["yoy_delta"])))
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# utils/metrics_cache.py
+"""
+    已关账周期（上周期 / 去年同期）历史指标的本地持久化缓存（SQLite）。
+    key 为 (分公司, 指标, 周期, 截止条件, 指标定义签名)，历史表重新归档后需要显式失效：
+        python -m src.utils.metrics_cache invalidate --period 2025-09 [--company ds_tz]
+"""
+import argparse
+import datetime
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).parent.parent.resolve() / "data" / "metrics_cache.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS closed_period_metrics (
+    company    TEXT NOT NULL,
+    metric     TEXT NOT NULL,
+    period     TEXT NOT NULL,
+    cutoff     TEXT NOT NULL,
+    signature  TEXT NOT NULL,
+    value      INTEGER NOT NULL,
+    cached_at  TEXT NOT NULL,
+    PRIMARY KEY (company, metric, period, cutoff, signature)
+)
+"""
+
+
+def is_closed(metric: dict) -> bool:
+    """配置了 period 的指标来自已关账的历史表，结果可以缓存"""
+    return bool(metric.get("period"))
+
+
+def signature(metric: dict) -> str:
+    """填充后的表名与过滤条件的摘要，指标定义变化时自动失效"""
+    text = f"{metric['table']}|{metric.get('filter') or ''}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class MetricsCache:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else DEFAULT_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    @staticmethod
+    def _key(company, metric):
+        return (company, metric["name"], str(metric["period"]), str(metric.get("cutoff") or ""), signature(metric))
+
+    def lookup(self, company: str, metrics) -> dict:
+        """返回已缓存的已关账指标 {name: value}"""
+        result = {}
+        with self._lock:
+            for metric in metrics:
+                if not is_closed(metric):
+                    continue
+                row = self._conn.execute(
+                    "SELECT value FROM closed_period_metrics "
+                    "WHERE company = ? AND metric = ? AND period = ? AND cutoff = ? AND signature = ?",
+                    self._key(company, metric),
+                ).fetchone()
+                if row is not None:
+                    result[metric["name"]] = row[0]
+        if result:
+            self.logger.info("分公司 %s 命中历史指标缓存 %d 项: %s", company, len(result), list(result))
+        return result
+
+    def store(self, company: str, metrics, values: dict):
+        """写入已关账指标，未查询到（缺失或为负数）的值不缓存"""
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        rows = []
+        for metric in metrics:
+            value = values.get(metric["name"])
+            if not is_closed(metric) or value is None or value < 0:
+                continue
+            rows.append(self._key(company, metric) + (int(value), now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO closed_period_metrics "
+                "(company, metric, period, cutoff, signature, value, cached_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def invalidate(self, company=None, period=None, metric=None) -> int:
+        """按条件删除缓存，条件都为空时清空全部，返回删除行数"""
+        conditions, params = [], []
+        for column, value in (("company", company), ("period", period), ("metric", metric)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        sql = "DELETE FROM closed_period_metrics"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            deleted = self._conn.execute(sql, params).rowcount
+            self._conn.commit()
+        self.logger.info("历史指标缓存失效 company=%s period=%s metric=%s，删除 %d 条", company, period, metric, deleted)
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_cache(path=None) -> MetricsCache:
+    """按文件路径获取进程内共享的缓存实例"""
+    path = Path(path) if path else DEFAULT_PATH
+    with _instances_lock:
+        cache = _instances.get(path)
+        if cache is None:
+            cache = MetricsCache(path)
+            _instances[path] = cache
+        return cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="已关账周期指标缓存管理")
+    parser.add_argument("action", choices=["invalidate"])
+    parser.add_argument("--path", default=None, help="缓存文件路径，默认 src/data/metrics_cache.db")
+    parser.add_argument("--company", default=None)
+    parser.add_argument("--period", default=None, help="例如 2025-09")
+    parser.add_argument("--metric", default=None)
+    args = parser.parse_args(argv)
+    cache = MetricsCache(args.path)
+    try:
+        deleted = cache.invalidate(company=args.company, period=args.period, metric=args.metric)
+        print(f"已删除 {deleted} 条缓存")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
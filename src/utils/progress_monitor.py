@@ -0,0 +1,182 @@
+# utils/progress_monitor.py
+"""
+    出账进度增量监控：每个分公司保存 mr_input_time 高水位和各指标的累计值（SQLite），
+    每次只统计高水位之后新录入的行并累加，避免在出账日高频执行全表 count(*)。
+    - 首次运行、进入新的出账月份或距上次全量核对超过 reconcile_interval 秒时执行一次全量统计，修正累计误差
+      （例如高水位时刻之后才提交、但录入时间更早的行）
+    - 增量查询的范围条件需要分公司库在 mr_input_time 上有索引
+"""
+import datetime
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from src.utils import dbutils, metric_compiler
+
+DEFAULT_PATH = Path(__file__).parent.parent.resolve() / "data" / "progress_monitor.db"
+
+# 进度监控默认参数，可在 jobs.progress_monitor 节点覆盖
+DEFAULT_PROGRESS_SETTINGS = {
+    "table": "water_revenue.water_meter_read",
+    "watermark_column": "mr_input_time",
+    "reconcile_interval": 3600,   # 全量核对间隔（秒）
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress_state (
+    company        TEXT NOT NULL,
+    metric         TEXT NOT NULL,
+    period         TEXT NOT NULL,
+    total          INTEGER NOT NULL,
+    watermark      TEXT,
+    reconciled_at  REAL NOT NULL,
+    updated_at     REAL NOT NULL,
+    PRIMARY KEY (company, metric)
+)
+"""
+
+_COLUMN = re.compile(r"^[A-Za-z_][A-Za-z0-9_.]*$")
+_TIMESTAMP = re.compile(r"^[0-9][0-9:. T+-]*$")
+
+
+def watermark_literal(value) -> str:
+    """高水位值转为 SQL 字面量；值来自数据库本身，仍校验格式避免拼接出非法 SQL"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        text = value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    else:
+        text = str(value)
+    if not _TIMESTAMP.match(text):
+        raise ValueError(f"无法识别的高水位值: {value!r}")
+    return f"'{text}'"
+
+
+class ProgressStore:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else DEFAULT_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def load(self, company: str) -> dict:
+        """{metric: {"period", "total", "watermark", "reconciled_at"}}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT metric, period, total, watermark, reconciled_at FROM progress_state WHERE company = ?",
+                (company,),
+            ).fetchall()
+        return {
+            metric: {"period": period, "total": total, "watermark": watermark, "reconciled_at": reconciled_at}
+            for metric, period, total, watermark, reconciled_at in rows
+        }
+
+    def save(self, company: str, period: str, totals: dict, watermark, reconciled_at: float):
+        now = datetime.datetime.now().timestamp()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO progress_state "
+                "(company, metric, period, total, watermark, reconciled_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(company, name, period, int(total), watermark, reconciled_at, now) for name, total in totals.items()],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=None) -> ProgressStore:
+    path = Path(path) if path else DEFAULT_PATH
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ProgressStore(path)
+            _stores[path] = store
+        return store
+
+
+class ProgressMonitor:
+    def __init__(self, store: ProgressStore, metrics, table=None, watermark_column="mr_input_time",
+                 reconcile_interval=3600):
+        if not _COLUMN.match(watermark_column):
+            raise ValueError(f"非法的高水位字段: {watermark_column!r}")
+        self.store = store
+        self.table = table or DEFAULT_PROGRESS_SETTINGS["table"]
+        self.metrics = [dict(metric, table=self.table) for metric in metrics]
+        self.column = watermark_column
+        self.reconcile_interval = reconcile_interval
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    def _window(self, low, high) -> list:
+        """给每个指标的过滤条件加上 (low, high] 的录入时间范围"""
+        bounds = []
+        if low is not None:
+            bounds.append(f"{self.column} > {watermark_literal(low)}")
+        bounds.append(f"{self.column} <= {watermark_literal(high)}")
+        window = " and ".join(bounds)
+        return [
+            dict(metric, filter=f"({metric['filter']}) and {window}" if metric.get("filter") else window)
+            for metric in self.metrics
+        ]
+
+    def needs_reconcile(self, state: dict, period: str, now: float) -> bool:
+        names = [metric["name"] for metric in self.metrics]
+        if any(name not in state for name in names):
+            return True
+        if any(state[name]["period"] != period for name in names):
+            return True
+        reconciled_at = min(state[name]["reconciled_at"] for name in names)
+        return now - reconciled_at >= self.reconcile_interval
+
+    def update(self, company: str, db_config: dict, period=None, now=None) -> dict:
+        """
+        刷新一个分公司的进度，返回 {"company", "mode": full|incremental, "totals", "delta", "watermark"}
+        """
+        period = period or datetime.date.today().strftime("%Y-%m")
+        now = now if now is not None else datetime.datetime.now().timestamp()
+        state = self.store.load(company)
+        full = self.needs_reconcile(state, period, now)
+        low = None if full else state[self.metrics[0]["name"]]["watermark"]
+        previous = {metric["name"]: state.get(metric["name"], {}).get("total", 0) for metric in self.metrics}
+
+        with dbutils.DBUtils(db_config, company=company) as db:
+            # 先确定本次的上界，计数只统计 (low, high]，保证累计值与高水位一致
+            sql = f"SELECT max({self.column}) AS watermark FROM {self.table}"
+            if low is not None:
+                sql += f" WHERE {self.column} > {watermark_literal(low)}"
+            rows = db.query(sql, memoize=False)
+            high = rows[0].get("watermark") if rows else None
+            counts = {metric["name"]: 0 for metric in self.metrics}
+            if high is not None:
+                dialect = db_config.get("type")
+                rows = db.query(metric_compiler.compile_metrics(self._window(low, high), dialect=dialect),
+                                memoize=False)
+                if rows:
+                    counts.update({name: int(value or 0) for name, value in rows[0].items() if name in counts})
+
+        if full:
+            totals = counts
+            drift = {name: totals[name] - previous[name] for name in totals if state}
+            if any(drift.values()):
+                self.logger.info("分公司 %s 全量核对修正累计值: %s", company, drift)
+            reconciled_at = now
+            watermark = str(high) if high is not None else None
+        else:
+            totals = {name: previous[name] + counts[name] for name in counts}
+            reconciled_at = min(state[name]["reconciled_at"] for name in totals)
+            watermark = str(high) if high is not None else low
+        self.store.save(company, period, totals, watermark, reconciled_at)
+        return {
+            "company": company,
+            "mode": "full" if full else "incremental",
+            "totals": totals,
+            "delta": {name: totals[name] - previous[name] for name in totals},
+            "watermark": watermark,
+        }
@@ -0,0 +1,82 @@
+# utils/query_memo.py
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+default_logger = logging.getLogger(__name__)
+
+_current_memo = contextvars.ContextVar("query_memo", default=None)
+
+
+def dsn_key(db_config: dict) -> tuple:
+    """规范化后的物理数据库标识，别名数据源（如 ds_my / ds_tz）得到相同的 key"""
+    port = db_config.get("port")
+    return (
+        (db_config.get("type") or "postgres").lower(),
+        str(db_config.get("host") or "").strip().lower(),
+        int(port) if port not in (None, "") else None,
+        str(db_config.get("name") or "").strip(),
+        str(db_config.get("user") or "").strip(),
+    )
+
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class QueryMemo:
+    """
+    单次运行内的查询结果缓存，key 为 (规范化 DSN, 最终 SQL, 参数)。
+    同一 key 的并发查询只有一个线程真正访问数据库，其余线程等待其结果。
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = Future()
+                self._futures[key] = future
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+                self.hits += 1
+        if owner:
+            try:
+                future.set_result(compute())
+            except BaseException as e:
+                # 失败的结果不缓存，后续调用可以重试
+                with self._lock:
+                    self._futures.pop(key, None)
+                future.set_exception(e)
+                raise
+        return future.result()
+
+
+def current_memo():
+    return _current_memo.get()
+
+
+@contextmanager
+def run_scope(logger=None):
+    """
+    在 with 块内开启查询去重，fanout 的工作线程会继承该上下文。
+    退出时输出节省的数据库往返次数。
+    """
+    if logger is None:
+        logger = default_logger
+    memo = QueryMemo()
+    token = _current_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _current_memo.reset(token)
+        logger.info("查询去重：实际执行 %d 次查询，节省 %d 次数据库往返", memo.misses, memo.hits)
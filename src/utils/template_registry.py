@@ -0,0 +1,206 @@
+# utils/template_registry.py
+"""
+    报表模板注册表：src/template 下的 .xlsx 模板只解析一次，按文件修改时间缓存。
+    解析结果包含全部单元格的值和样式、行高、列宽、合并区域、命名单元格，以及 A 列行标签 -> 行号索引，
+    报表写入时直接按索引定位单元格，无需每次运行重新加载模板。
+    report_rows() 把指标配置（row 指向模板行标签）与模板布局对齐，Excel 和短信使用同一份布局。
+"""
+import logging
+import re
+import threading
+from copy import copy
+from pathlib import Path
+
+TEMPLATE_DIR = Path(__file__).parent.parent.resolve() / "template"
+
+# sheet 名称最长 31 个字符，且不能包含 []:*?/\
+_INVALID_TITLE = re.compile(r"[\[\]:*?/\\]")
+_STYLE_ATTRS = ("font", "fill", "border", "alignment", "number_format", "protection")
+
+logger = logging.getLogger(__name__)
+
+
+def sheet_title(name: str) -> str:
+    return _INVALID_TITLE.sub("_", str(name))[:31] or "Sheet"
+
+
+def _cell_style(cell) -> dict:
+    return {attr: copy(getattr(cell, attr)) for attr in _STYLE_ATTRS}
+
+
+def _apply_style(cell, style: dict):
+    for attr, value in style.items():
+        setattr(cell, attr, copy(value))
+
+
+class TemplateHeader:
+    """模板前若干行表头、列宽、合并单元格和数据行列样式，供明细导出使用"""
+
+    def __init__(self, rows, heights, widths, merged, data_styles):
+        self.rows = rows                # [[(值, {样式属性: 值})]]
+        self.heights = heights          # {行号: 行高}
+        self.widths = widths            # {列字母: 列宽}
+        self.merged = merged            # 表头内的合并区域，例如 ["A1:F1"]
+        self.data_styles = data_styles  # 数据行每列的样式
+
+    @property
+    def labels(self) -> list:
+        """最后一行表头的列名"""
+        return [value for value, _ in self.rows[-1]] if self.rows else []
+
+
+class ReportRow:
+    """一个指标在报表中的位置：模板行标签、行号（模板中没有该行时为 None）、指标 name 和展示 label"""
+    __slots__ = ("row_label", "row", "name", "label")
+
+    def __init__(self, row_label, row, name, label):
+        self.row_label = row_label
+        self.row = row
+        self.name = name
+        self.label = label
+
+
+class TemplateModel:
+    """一次解析得到的模板，创建后不再修改"""
+
+    def __init__(self, path, mtime, title, cells, heights, widths, merged, names=None):
+        self.path = path
+        self.mtime = mtime
+        self.title = title
+        self.cells = cells        # [[(值, 样式)]]，按行
+        self.heights = heights
+        self.widths = widths
+        self.merged = merged
+        self.names = names or {}  # 命名单元格 {名称: 坐标}
+        self.row_index = {}
+        for index, row in enumerate(cells, start=1):
+            value = row[0][0] if row else None
+            if value not in (None, ""):
+                self.row_index.setdefault(str(value).strip(), index)
+        self._headers = {}
+
+    def row_of(self, label: str):
+        return self.row_index.get(label)
+
+    def header(self, header_rows=2) -> TemplateHeader:
+        header = self._headers.get(header_rows)
+        if header is None:
+            data_row = self.cells[header_rows] if len(self.cells) > header_rows else []
+            header = TemplateHeader(
+                rows=self.cells[:header_rows],
+                heights={index: height for index, height in self.heights.items() if index <= header_rows},
+                widths=self.widths,
+                merged=[ref for ref in self.merged if _max_row(ref) <= header_rows],
+                data_styles=[style for _, style in data_row],
+            )
+            self._headers[header_rows] = header
+        return header
+
+    def new_workbook(self):
+        """按缓存的单元格、样式、行高、列宽和合并区域生成一个新工作簿，返回 (wb, ws)"""
+        import openpyxl
+
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = sheet_title(self.title)
+        for key, width in self.widths.items():
+            ws.column_dimensions[key].width = width
+        for index, height in self.heights.items():
+            ws.row_dimensions[index].height = height
+        for row_index, row in enumerate(self.cells, start=1):
+            for col_index, (value, style) in enumerate(row, start=1):
+                cell = ws.cell(row=row_index, column=col_index, value=value)
+                if style:
+                    _apply_style(cell, style)
+        for ref in self.merged:
+            ws.merge_cells(ref)
+        return wb, ws
+
+    @classmethod
+    def blank(cls, title: str, labels, header_label="类目"):
+        """模板缺失时的最简布局：第 1 行标题，第 2 行类目，其后每行一个行标签"""
+        cells = [[(title, {})], [(header_label, {})]] + [[(label, {})] for label in labels]
+        return cls(None, None, title, cells, {}, {}, [])
+
+
+def _max_row(ref: str) -> int:
+    digits = re.findall(r"\d+", ref)
+    return int(digits[-1]) if digits else 0
+
+
+def parse_template(path: Path) -> TemplateModel:
+    import openpyxl
+
+    mtime = path.stat().st_mtime
+    wb = openpyxl.load_workbook(path)
+    try:
+        ws = wb.active
+        cells = [[(cell.value, _cell_style(cell)) for cell in row] for row in ws.iter_rows()]
+        heights = {index: dim.height for index, dim in ws.row_dimensions.items() if dim.height}
+        widths = {key: dim.width for key, dim in ws.column_dimensions.items() if dim.width}
+        merged = [str(cell_range) for cell_range in ws.merged_cells.ranges]
+        names = {}
+        for name, defined in getattr(wb.defined_names, "items", lambda: [])():
+            destinations = list(defined.destinations)
+            if destinations:
+                names[name] = destinations[0][1].replace("$", "")
+        title = cells[0][0][0] if cells and cells[0] and cells[0][0][0] else ws.title
+        return TemplateModel(path, mtime, title, cells, heights, widths, merged, names)
+    finally:
+        wb.close()
+
+
+class TemplateRegistry:
+    """按文件名缓存模板解析结果，文件修改时间变化后重新解析"""
+
+    def __init__(self, template_dir=None):
+        self.template_dir = Path(template_dir) if template_dir else TEMPLATE_DIR
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def path_of(self, name) -> Path:
+        path = Path(name)
+        return path if path.is_absolute() else self.template_dir / path
+
+    def get(self, name) -> TemplateModel:
+        path = self.path_of(name)
+        mtime = path.stat().st_mtime
+        model = self._models.get(path)
+        if model is not None and model.mtime == mtime:
+            return model
+        with self._lock:
+            model = self._models.get(path)
+            if model is None or model.mtime != mtime:
+                model = parse_template(path)
+                self._models[path] = model
+                logger.info("已解析报表模板 %s，行标签 %d 个", path.name, len(model.row_index))
+        return model
+
+
+registry = TemplateRegistry()
+
+
+def get_template(name) -> TemplateModel:
+    return registry.get(name)
+
+
+def report_rows(template: TemplateModel, metrics) -> list:
+    """
+    指标与模板行对齐：配置了 row 的指标按模板行号排序，其余指标按配置顺序排在后面（只出现在短信中）
+    """
+    placed, unplaced = [], []
+    for metric in metrics:
+        label = metric.get("label", metric["name"])
+        row_label = metric.get("row")
+        row = template.row_of(row_label) if row_label else None
+        item = ReportRow(row_label, row, metric["name"], label)
+        (placed if row is not None else unplaced).append(item)
+        if row_label and row is None:
+            logger.warning("指标 %s 配置的模板行 %s 在模板 %s 中不存在", metric["name"], row_label, template.title)
+    placed.sort(key=lambda item: item.row)
+    return placed + unplaced
+
+
+def format_values(rows, data: dict) -> str:
+    """按报表布局把一个分公司的数据格式化为短信中的一行"""
+    return ", ".join(f"{row.label}: {data.get(row.label)}" for row in rows)
@@ -0,0 +1,193 @@
+# utils/xxljob_client.py
+"""
+    XXL-Job 管理端客户端：一次登录复用会话 Cookie，会话过期或收到 401 / 重定向到登录页时才重新登录；
+    pageList 先取第一页得到 recordsTotal，其余分页和多个执行器(jobGroup)用有界线程池并发拉取。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils import admission
+
+# XXL-Job 客户端默认参数，可在 config.yaml 的 xxl_job 节点覆盖
+DEFAULT_XXLJOB_SETTINGS = {
+    "username": "admin",
+    "password": "123456",
+    "page_size": 100,      # pageList 每页条数
+    "max_workers": 4,      # 分页 / 执行器并发请求数
+    "timeout": 10,         # 单次请求超时秒数
+    "session_ttl": 1800,   # 登录会话复用时长（秒），超过后主动重新登录
+}
+
+
+class XxlJobError(Exception):
+    """登录或获取任务列表失败"""
+
+
+class XxlJobLoginError(XxlJobError):
+    """登录失败（账号密码错误或登录请求失败），与获取任务列表失败区分提示"""
+
+
+class XxlJobClient:
+    def __init__(self, login_url: str, page_url: str, username="admin", password="123456", page_size=100,
+                 max_workers=4, timeout=10, session_ttl=1800, session=None):
+        self.login_url = login_url
+        self.page_url = page_url
+        self.username = username
+        self.password = password
+        self.page_size = max(1, int(page_size))
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.session_ttl = session_ttl
+        self._session = session
+        self._logged_in_at = None
+        self._lock = threading.Lock()
+        self._session_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    # requests 在任务运行时才导入，加快应用启动
+                    import requests
+                    self._session = requests.Session()
+        return self._session
+
+    def _session_expired(self) -> bool:
+        if self._logged_in_at is None:
+            return True
+        if self.session_ttl and time.time() - self._logged_in_at >= self.session_ttl:
+            return True
+        # 登录 Cookie 自带过期时间时以 Cookie 为准
+        cookies = getattr(self.session, "cookies", None)
+        for cookie in cookies or ():
+            expires = getattr(cookie, "expires", None)
+            if expires is not None and expires <= time.time():
+                return True
+        return False
+
+    def login(self, force=False):
+        """登录并缓存会话；会话仍有效时直接返回，并发调用只会登录一次"""
+        with self._lock:
+            if not force and not self._session_expired():
+                return
+            self.logger.info("正在尝试登录 XXL-Job...")
+            try:
+                with admission.service_slot("xxl_job", self.logger):
+                    response = self.session.post(self.login_url, timeout=self.timeout,
+                                                 data={"userName": self.username, "password": self.password})
+                response.raise_for_status()
+                body = response.json()
+            except Exception as e:
+                raise XxlJobLoginError(f"登录请求失败: {e}") from e
+            if body.get("code") != 200:
+                raise XxlJobLoginError(f"登录失败: {body.get('msg', '未知错误')}")
+            self._logged_in_at = time.time()
+            self.logger.info("登录成功！")
+
+    @staticmethod
+    def _needs_login(response) -> bool:
+        # 未登录时管理端返回 401，或 302 跳转到登录页
+        return response.status_code == 401 or 300 <= response.status_code < 400
+
+    def _post(self, payload: dict):
+        """请求 pageList；网络异常和排队超时统一转为 XxlJobError，由调用方按执行器失败处理"""
+        try:
+            # 管理端并发受 admission.services.xxl_job 限制，多个任务同时轮询时排队
+            with admission.service_slot("xxl_job", self.logger):
+                return self.session.post(self.page_url, data=payload, timeout=self.timeout, allow_redirects=False)
+        except Exception as e:
+            raise XxlJobError(f"获取任务列表失败: {e}") from e
+
+    def _post_page(self, payload: dict) -> dict:
+        self.login()
+        logged_in_at = self._logged_in_at
+        response = self._post(payload)
+        if self._needs_login(response):
+            self.logger.info("XXL-Job 会话已失效(HTTP %s)，重新登录", response.status_code)
+            with self._lock:
+                # 其它线程已经重新登录过时不再重复登录
+                if self._logged_in_at == logged_in_at:
+                    self._logged_in_at = None
+            self.login()
+            response = self._post(payload)
+        try:
+            response.raise_for_status()
+            if self._needs_login(response):
+                raise XxlJobError(f"重新登录后仍被重定向(HTTP {response.status_code})")
+            return response.json()
+        except XxlJobError:
+            raise
+        except Exception as e:
+            raise XxlJobError(f"获取任务列表失败: {e}") from e
+
+    def _page_payload(self, filters: dict, start: int) -> dict:
+        payload = {"triggerStatus": -1}
+        payload.update(filters)
+        payload.update({"start": start, "length": self.page_size})
+        return payload
+
+    def fetch_jobs(self, filters: dict, executor=None) -> list:
+        """
+        拉取满足条件（jobGroup / jobDesc / triggerStatus ...）的全部任务。
+        第一页返回 recordsTotal 后，剩余分页并发请求，结果按分页顺序合并。
+        """
+        first = self._post_page(self._page_payload(filters, 0))
+        jobs = list(first.get("data") or [])
+        total = int(first.get("recordsTotal") or first.get("recordsFiltered") or len(jobs))
+        starts = list(range(self.page_size, total, self.page_size))
+        if starts:
+            own_executor = executor is None
+            if own_executor:
+                executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="xxljob-page")
+            try:
+                pages = list(executor.map(lambda start: self._post_page(self._page_payload(filters, start)), starts))
+            finally:
+                if own_executor:
+                    executor.shutdown(wait=True)
+            for page in pages:
+                jobs.extend(page.get("data") or [])
+        self.logger.info("执行器 %s 共获取到 %d 条任务数据（%d 页）", filters.get("jobGroup"), len(jobs), len(starts) + 1)
+        return jobs
+
+    def fetch_groups(self, groups: dict) -> dict:
+        """
+        并发拉取多个执行器的任务列表：groups 为 {名称: 查询条件}，返回 {名称: 任务列表或 XxlJobError}。
+        单个执行器失败不影响其它执行器；首次登录失败时抛出 XxlJobLoginError。
+        """
+        self.login()
+        results = {}
+        # 执行器级别与分页级别使用两个线程池，避免外层任务占满线程后内层分页排队死锁
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="xxljob-page") as pages, \
+                ThreadPoolExecutor(max_workers=max(1, len(groups)), thread_name_prefix="xxljob-group") as pool:
+            futures = {name: pool.submit(self.fetch_jobs, filters, pages) for name, filters in groups.items()}
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except XxlJobError as e:
+                    self.logger.error("执行器 %s 获取任务列表失败: %s", name, e)
+                    results[name] = e
+        return results
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_xxljob_client(config) -> XxlJobClient:
+    """
+    进程内共享的客户端，多次运行复用同一登录会话；账号和分页参数取 xxl_job 节点，
+    配置变化后按新参数创建新的客户端
+    """
+    settings = dict(DEFAULT_XXLJOB_SETTINGS)
+    settings.update({k: v for k, v in (config.get("xxl_job") or {}).items() if v is not None})
+    key = (config.get("XXL_LOGIN_URL"), config.get("XXL_PAGE_URL")) + tuple(sorted(settings.items()))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = XxlJobClient(config.get("XXL_LOGIN_URL"), config.get("XXL_PAGE_URL"), **settings)
+            _clients[key] = client
+        return client
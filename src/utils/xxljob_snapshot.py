@@ -0,0 +1,148 @@
+# utils/xxljob_snapshot.py
+"""
+    XXL-Job 任务配置快照（SQLite）：每次拉取的任务列表按任务 id 保存，
+    每个任务带一个内容摘要 = hash(规范化 Cron, 解析后的 executorParam JSON, triggerStatus)。
+    - 与上一次快照比较摘要，只有摘要变化的任务才需要逐项校验和告警
+    - 期望配置使用同样的规范化方式计算摘要，摘要一致即可判定配置正确
+"""
+import datetime
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_PATH = Path(__file__).parent.parent.resolve() / "data" / "xxljob_snapshot.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS xxl_job_snapshot (
+    job_id          INTEGER PRIMARY KEY,
+    job_group       TEXT NOT NULL,
+    job_desc        TEXT,
+    schedule_conf   TEXT,
+    executor_param  TEXT,
+    trigger_status  INTEGER,
+    hash            TEXT NOT NULL,
+    updated_at      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS xxl_job_change (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id      INTEGER NOT NULL,
+    job_group   TEXT NOT NULL,
+    old_hash    TEXT,
+    new_hash    TEXT,
+    changed_at  TEXT NOT NULL
+);
+"""
+
+# executorParam 中常见的非法 JSON 写法：未加引号的数字键，例如 {0:["02180201"]}
+_BARE_KEY = re.compile(r'([{,]\s*)(-?\d+)\s*:')
+
+
+def canonical_cron(cron) -> str:
+    """合并 Cron 各字段之间的空白"""
+    return " ".join((cron or "").split())
+
+
+def canonical_param(param) -> str:
+    """
+    解析 executorParam 后按键排序重新序列化；数字键未加引号时先补引号再解析，
+    仍无法解析时退化为去掉空白后的原文
+    """
+    text = (param or "").strip()
+    if not text:
+        return ""
+    for candidate in (text, _BARE_KEY.sub(r'\1"\2":', text)):
+        try:
+            return json.dumps(json.loads(candidate), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        except ValueError:
+            continue
+    return "".join(text.split())
+
+
+def content_hash(cron, param, trigger_status) -> str:
+    text = f"{canonical_cron(cron)}|{canonical_param(param)}|{trigger_status}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def job_hash(job: dict) -> str:
+    """pageList 返回的任务摘要"""
+    return content_hash(job.get("scheduleConf"), job.get("executorParam"), job.get("triggerStatus"))
+
+
+def spec_hash(spec: dict) -> str:
+    """期望配置的摘要，期望任务处于启用状态(triggerStatus=1)"""
+    return content_hash(spec.get("expected_cron"), spec.get("expected_param"), 1)
+
+
+class SnapshotStore:
+    def __init__(self, path=None):
+        self.path = Path(path) if path else DEFAULT_PATH
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+
+    def hashes(self, group: str) -> dict:
+        """上一次快照中该执行器的 {job_id: hash}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, hash FROM xxl_job_snapshot WHERE job_group = ?", (group,)
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, group: str, jobs) -> dict:
+        """
+        保存本次拉取的任务列表并与上一次快照比较，返回
+        {"changed": 新增或摘要变化的 job_id, "removed": 本次未出现的 job_id, "first": 是否首次快照}
+        """
+        previous = self.hashes(group)
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        current = {}
+        rows = []
+        for job in jobs:
+            digest = job_hash(job)
+            current[job["id"]] = digest
+            rows.append((job["id"], group, job.get("jobDesc"), job.get("scheduleConf"), job.get("executorParam"),
+                         job.get("triggerStatus"), digest, now))
+        changed = {job_id for job_id, digest in current.items() if previous.get(job_id) != digest}
+        removed = set(previous) - set(current)
+        changes = [(job_id, group, previous.get(job_id), current.get(job_id), now) for job_id in changed | removed]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO xxl_job_snapshot (job_id, job_group, job_desc, schedule_conf, "
+                "executor_param, trigger_status, hash, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.executemany("DELETE FROM xxl_job_snapshot WHERE job_id = ?", [(job_id,) for job_id in removed])
+            self._conn.executemany(
+                "INSERT INTO xxl_job_change (job_id, job_group, old_hash, new_hash, changed_at) VALUES (?, ?, ?, ?, ?)",
+                changes,
+            )
+            self._conn.commit()
+        if changed or removed:
+            self.logger.info("执行器 %s 任务快照变化：变更 %d 个，删除 %d 个", group, len(changed), len(removed))
+        return {"changed": changed, "removed": removed, "first": not previous}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_store(path=None) -> SnapshotStore:
+    """按文件路径获取进程内共享的快照实例"""
+    path = Path(path) if path else DEFAULT_PATH
+    with _instances_lock:
+        store = _instances.get(path)
+        if store is None:
+            store = SnapshotStore(path)
+            _instances[path] = store
+        return store